@@ -29,7 +29,7 @@ export default function ViewerPageClient() {
         const ctx = canvas.getContext('2d')
         await page.render({canvasContext: ctx, viewport}).promise
         try {
-          const res = await fetch(`/anchors/${fileId}`)
+          const res = await fetch(`/anchors/${fileId}?page=${pageNumber}`)
           const data = await res.json()
           const anchors = data.anchors || []
           anchors.filter((a: any) => a.page === pageNumber).forEach((a: any) => {
@@ -0,0 +1,207 @@
+import os
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+_NO_SPAN = np.iinfo(np.int64).max
+# Pages are joined with this separator when offsets are counted over the whole document
+# (the layout chunk_pages uses for chunk char_start/char_end).
+PAGE_SEP = "\n\n"
+
+
+def group_words(words: List[Dict[str, Any]], spans: Optional[Dict[int, Tuple[int, int]]], group_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Bounding boxes and text spans of consecutive groups of group_size words on one page.
+
+    Returns (boxes float32 (g, 4) as x0, top, x1, bottom; spans int32 (g, 2) as char_start, char_end,
+    -1 where none of the group's words are located in the page text). `spans` maps word index to its
+    (start, end) in the page text, as returned by pdf_ingest._page_text_and_spans.
+    """
+    n = len(words)
+    if n == 0:
+        return np.zeros((0, 4), dtype=np.float32), np.zeros((0, 2), dtype=np.int32)
+    coords = np.array([(float(w.get("x0", 0)), float(w.get("top", 0)), float(w.get("x1", 0)), float(w.get("bottom", 0)))
+                       for w in words], dtype=np.float64)
+    starts = np.arange(0, n, group_size)
+    boxes = np.empty((len(starts), 4), dtype=np.float32)
+    boxes[:, 0] = np.minimum.reduceat(coords[:, 0], starts)
+    boxes[:, 1] = np.minimum.reduceat(coords[:, 1], starts)
+    boxes[:, 2] = np.maximum.reduceat(coords[:, 2], starts)
+    boxes[:, 3] = np.maximum.reduceat(coords[:, 3], starts)
+    word_spans = np.full((n, 2), -1, dtype=np.int64)
+    for i, span in (spans or {}).items():
+        if i < n:
+            word_spans[i] = span
+    located = word_spans[:, 0] >= 0
+    char_start = np.minimum.reduceat(np.where(located, word_spans[:, 0], _NO_SPAN), starts)
+    char_end = np.maximum.reduceat(np.where(located, word_spans[:, 1], -1), starts)
+    char_start[char_start == _NO_SPAN] = -1
+    return boxes, np.stack([char_start, char_end], axis=1).astype(np.int32)
+
+
+class AnchorTable:
+    """A document's word-group anchors in columnar form.
+
+    Anchor ids are row numbers, in page order. The anchors of page p (1-based) are the rows
+    page_offsets[p-1]:page_offsets[p]. boxes holds x0, top, x1, bottom in PDF points (float32), spans
+    the anchor's char_start/char_end in its page's text (-1 if unknown) and page_dims each page's
+    width and height, once per page. text_offsets[p-1] is where page p's text starts in the document
+    (PAGE_SEP.join(pages)); it is None for anchors converted from legacy JSON.
+
+    covering()/covering_page() map a text range (a RAG chunk, a snippet) to the anchors whose words
+    it overlaps with two binary searches over the located anchors' document offsets.
+    """
+
+    def __init__(self, page_offsets: np.ndarray, boxes: np.ndarray, spans: np.ndarray, page_dims: np.ndarray,
+                 text_offsets: Optional[np.ndarray] = None):
+        self.page_offsets = page_offsets
+        self.boxes = boxes
+        self.spans = spans
+        self.page_dims = page_dims
+        self.text_offsets = text_offsets
+        self._doc_index: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    @classmethod
+    def from_pages(cls, pages: List[Tuple[np.ndarray, np.ndarray, Tuple[float, float]]],
+                   text_lengths: Optional[List[int]] = None) -> "AnchorTable":
+        """Concatenate per-page (boxes, spans, (width, height)) as produced with group_words;
+        text_lengths (each page's text length) locates the pages in the document text."""
+        text_offsets = None
+        if text_lengths is not None:
+            text_offsets = np.concatenate([[0], np.cumsum(np.asarray(text_lengths, dtype=np.int64) + len(PAGE_SEP))]).astype(np.int64)
+        counts = [len(boxes) for boxes, _, _ in pages]
+        page_offsets = np.concatenate([[0], np.cumsum(counts, dtype=np.int64)]).astype(np.int64)
+        boxes = np.concatenate([b for b, _, _ in pages]) if pages else np.zeros((0, 4), dtype=np.float32)
+        spans = np.concatenate([s for _, s, _ in pages]) if pages else np.zeros((0, 2), dtype=np.int32)
+        page_dims = np.array([dims for _, _, dims in pages], dtype=np.float32).reshape(-1, 2)
+        return cls(page_offsets, boxes.astype(np.float32), spans.astype(np.int32), page_dims, text_offsets)
+
+    @classmethod
+    def from_dicts(cls, anchors: List[Dict[str, Any]]) -> "AnchorTable":
+        """Convert the JSON anchor list written by older uploads ({id, page, bbox, page_dim, ...})."""
+        by_page: Dict[int, List[Dict[str, Any]]] = {}
+        for a in anchors or []:
+            by_page.setdefault(int(a.get("page", 1)), []).append(a)
+        pages = []
+        for p in range(1, max(by_page, default=0) + 1):
+            group = sorted(by_page.get(p, []), key=lambda a: a.get("id", 0))
+            boxes = np.array([[a["bbox"]["x0"], a["bbox"]["y0"], a["bbox"]["x1"], a["bbox"]["y1"]] for a in group],
+                             dtype=np.float32).reshape(-1, 4)
+            spans = np.array([[a.get("char_start", -1), a.get("char_end", -1)] for a in group], dtype=np.int32).reshape(-1, 2)
+            dim = (group[0].get("page_dim") or {}) if group else {}
+            pages.append((boxes, spans, (dim.get("width", 0.0), dim.get("height", 0.0))))
+        return cls.from_pages(pages)
+
+    def __len__(self) -> int:
+        return len(self.boxes)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_dims)
+
+    @property
+    def nbytes(self) -> int:
+        extra = self.text_offsets.nbytes if self.text_offsets is not None else 0
+        return int(self.page_offsets.nbytes + self.boxes.nbytes + self.spans.nbytes + self.page_dims.nbytes + extra)
+
+    def page_rows(self, page: int) -> range:
+        """Anchor ids on a 1-based page (empty for pages out of range)."""
+        if page < 1 or page > self.page_count:
+            return range(0)
+        return range(int(self.page_offsets[page - 1]), int(self.page_offsets[page]))
+
+    def first_id(self, page: int) -> Optional[int]:
+        rows = self.page_rows(page)
+        return rows.start if len(rows) else None
+
+    def span_lookup(self) -> Dict[int, Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """{page: (char_starts, char_ends, ids)} of the anchors located in their page text."""
+        out = {}
+        for p in range(1, self.page_count + 1):
+            rows = self.page_rows(p)
+            if not len(rows):
+                continue
+            spans = self.spans[rows.start:rows.stop]
+            ids = np.arange(rows.start, rows.stop, dtype=np.int64)
+            located = spans[:, 0] >= 0
+            if located.any():
+                out[p] = (spans[located, 0].astype(np.int64), spans[located, 1].astype(np.int64), ids[located])
+        return out
+
+    def _document_index(self) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        # (doc starts, doc ends, ids) of the located anchors; words are grouped in text order, so both
+        # offset columns are non-decreasing and can be binary searched
+        if self.text_offsets is None:
+            return None
+        if self._doc_index is None:
+            located = np.flatnonzero(self.spans[:, 0] >= 0)
+            pages = np.searchsorted(self.page_offsets, located, side="right")
+            base = self.text_offsets[pages - 1]
+            starts = base + self.spans[located, 0]
+            ends = np.maximum.accumulate(base + self.spans[located, 1]) if len(located) else base
+            self._doc_index = (starts, ends, located)
+        return self._doc_index
+
+    def covering(self, char_start: int, char_end: int) -> Optional[Tuple[int, int]]:
+        """(first id, last id) of the anchors overlapping document text [char_start, char_end), or None."""
+        index = self._document_index()
+        if index is None:
+            return None
+        starts, ends, ids = index
+        lo = int(np.searchsorted(ends, char_start, side="right"))
+        hi = int(np.searchsorted(starts, char_end, side="left"))
+        if lo >= hi:
+            return None
+        return int(ids[lo]), int(ids[hi - 1])
+
+    def covering_page(self, page: int, start: int, end: int) -> Optional[Tuple[int, int]]:
+        """covering() for a range given in one page's text."""
+        if self.text_offsets is None or page < 1 or page > self.page_count:
+            return None
+        base = int(self.text_offsets[page - 1])
+        return self.covering(base + start, base + end)
+
+    def to_dicts(self, page: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Anchors as JSON objects ({id, page, bbox, page_dim, bbox_norm, char_start, char_end}), for
+        one page or all of them."""
+        rows = self.page_rows(page) if page is not None else range(len(self))
+        if not len(rows):
+            return []
+        ids = np.arange(rows.start, rows.stop)
+        pages = np.searchsorted(self.page_offsets, ids, side="right")
+        boxes = self.boxes[rows.start:rows.stop].astype(np.float64)
+        dims = self.page_dims[pages - 1].astype(np.float64)
+        norm = boxes / np.where(np.tile(dims, 2) > 0, np.tile(dims, 2), 1.0)
+        boxes, dims, norm = np.round(boxes, 3).tolist(), np.round(dims, 3).tolist(), np.round(norm, 6).tolist()
+        spans = self.spans[rows.start:rows.stop].tolist()
+        out = []
+        for i, r in enumerate(ids.tolist()):
+            (x0, y0, x1, y1), (w, h), (nx0, ny0, nx1, ny1) = boxes[i], dims[i], norm[i]
+            anchor = {
+                "id": r,
+                "page": int(pages[i]),
+                "bbox": {"x0": x0, "y0": y0, "x1": x1, "y1": y1},
+                "page_dim": {"width": w, "height": h},
+                "bbox_norm": {"x0": nx0, "y0": ny0, "x1": nx1, "y1": ny1},
+            }
+            if spans[i][0] >= 0:
+                anchor["char_start"], anchor["char_end"] = spans[i]
+            out.append(anchor)
+        return out
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            arrays = {"page_offsets": self.page_offsets, "boxes": self.boxes, "spans": self.spans, "page_dims": self.page_dims}
+            if self.text_offsets is not None:
+                arrays["text_offsets"] = self.text_offsets
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["AnchorTable"]:
+        try:
+            with np.load(path) as data:
+                text_offsets = data["text_offsets"] if "text_offsets" in data.files else None
+                return cls(data["page_offsets"], data["boxes"], data["spans"], data["page_dims"], text_offsets)
+        except Exception:
+            return None
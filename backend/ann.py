@@ -0,0 +1,99 @@
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+# Approximate search kicks in once the requested files hold at least this many chunks.
+ANN_MIN_CHUNKS = int(os.environ.get("ANN_MIN_CHUNKS", "50000"))
+# Inverted lists probed per query; higher means better recall and slower queries.
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "16"))
+# Number of k-means centroids; 0 picks ~4*sqrt(N).
+ANN_NLIST = int(os.environ.get("ANN_NLIST", "0"))
+
+
+def _normalize(x: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(x, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (x / norms).astype(np.float32, copy=False)
+
+
+def _assign(x: np.ndarray, centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+    """Nearest centroid (by inner product on unit vectors) for every row, in blocks to bound memory."""
+    out = np.empty(len(x), dtype=np.int32)
+    for i in range(0, len(x), block):
+        out[i:i + block] = np.argmax(x[i:i + block] @ centroids.T, axis=1)
+    return out
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 10, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit vectors; returns k unit-norm centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), size=k, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        # per-cluster sums via one sort + reduceat instead of a scatter-add
+        order = np.argsort(labels, kind="stable")
+        sums = np.zeros_like(centroids)
+        present = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)])[present]
+        sums[present] = np.add.reduceat(x[order], starts, axis=0)
+        empty = counts == 0
+        if empty.any():
+            # re-seed empty clusters with random points so every list stays useful
+            sums[empty] = x[rng.choice(len(x), size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index over cosine similarity.
+
+    Vectors are normalized, clustered with k-means and stored grouped by centroid, so a query only
+    scores the rows of the `nprobe` closest lists. Row ids returned by search are positions in the
+    matrix passed to the constructor.
+    """
+
+    def __init__(self, vectors: np.ndarray, nlist: Optional[int] = None, iters: int = 10, train_size: int = 64, seed: int = 0):
+        x = _normalize(np.asarray(vectors, dtype=np.float32))
+        n = len(x)
+        nlist = nlist or ANN_NLIST or int(4 * np.sqrt(n))
+        self.nlist = max(1, min(nlist, n))
+        rng = np.random.default_rng(seed)
+        # train on a sample: k-means quality saturates long before it sees every row
+        sample_n = min(n, self.nlist * train_size)
+        sample = x[rng.choice(n, size=sample_n, replace=False)] if sample_n < n else x
+        self.centroids = kmeans(sample, self.nlist, iters=iters, seed=seed)
+        labels = _assign(x, self.centroids)
+        order = np.argsort(labels, kind="stable")
+        self.ids = order.astype(np.int64)
+        self.data = x[order]
+        self.list_offsets = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=self.nlist))]).astype(np.int64)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.data.nbytes + self.ids.nbytes + self.centroids.nbytes + self.list_offsets.nbytes)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def search(self, query: np.ndarray, k: int, nprobe: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Return (row_ids, cosine_scores) of the approximate top-k, best first."""
+        q = np.asarray(query, dtype=np.float32)
+        qn = float(np.linalg.norm(q))
+        if qn == 0 or k <= 0 or len(self.ids) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        q = q / qn
+        nprobe = max(1, min(nprobe or ANN_NPROBE, self.nlist))
+        probe = np.argpartition(-(self.centroids @ q), nprobe - 1)[:nprobe]
+        # lists are contiguous in self.data, so each probed list is one slice and one matrix-vector product
+        spans = [(int(self.list_offsets[c]), int(self.list_offsets[c + 1])) for c in probe]
+        spans = [(a, b) for a, b in spans if b > a]
+        if not spans:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        rows = np.concatenate([np.arange(a, b) for a, b in spans])
+        scores = np.concatenate([self.data[a:b] @ q for a, b in spans])
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return self.ids[rows[top]], scores[top]
@@ -0,0 +1,70 @@
+"""Benchmark chunking throughput on long documents.
+
+Usage: python bench_chunk.py [pdf ...] [--pages 2000] [--tokens 200] [--repeat 3]
+Chunks the given PDFs (their cached extraction artifacts, with anchors) and a synthetic document of
+--pages pages, and reports MB/s and chunks/s for chunk_pages next to the old fixed-size chunk_text.
+"""
+import sys
+import time
+import random
+import argparse
+
+import pdf_ingest
+from groq_rag import chunk_pages, chunk_text, CHARS_PER_TOKEN, PAGE_SEP
+
+
+def _synthetic_pages(n: int, seed: int = 0):
+    rng = random.Random(seed)
+    vocab = ["model", "data", "results", "we", "the", "of", "analysis", "proposed", "method", "network",
+             "performance", "table", "figure", "shows", "training", "accuracy", "et", "al.", "and", "in"]
+    pages = []
+    for _ in range(n):
+        sentences = []
+        for _ in range(rng.randint(20, 35)):
+            words = [rng.choice(vocab) for _ in range(rng.randint(6, 30))]
+            sentences.append(" ".join(words).capitalize() + rng.choice([".", ".", ".", "?", "!"]))
+            if rng.random() < 0.1:
+                sentences[-1] += "\n"
+        pages.append(" ".join(sentences))
+    return pages
+
+
+def _bench(name, pages, anchors, tokens, repeat):
+    doc = PAGE_SEP.join(pages)
+    mb = len(doc.encode("utf-8")) / 1e6
+    best_new = best_old = None
+    n_new = n_old = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n_new = sum(1 for _ in chunk_pages(pages, anchors, max_tokens=tokens, overlap_tokens=tokens // 4))
+        t1 = time.perf_counter()
+        size = tokens * CHARS_PER_TOKEN
+        n_old = len(chunk_text(doc, chunk_size=size, overlap=size // 4))
+        t2 = time.perf_counter()
+        best_new = t1 - t0 if best_new is None else min(best_new, t1 - t0)
+        best_old = t2 - t1 if best_old is None else min(best_old, t2 - t1)
+    print(f"{name}: {len(pages)} pages, {mb:.2f} MB, {len(anchors or [])} anchors")
+    print(f"  chunk_pages  {best_new:8.4f}s  {mb / best_new:8.1f} MB/s  {n_new / best_new:10.0f} chunks/s  ({n_new} chunks)")
+    print(f"  chunk_text   {best_old:8.4f}s  {mb / best_old:8.1f} MB/s  {n_old / best_old:10.0f} chunks/s  ({n_old} chunks)")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pdfs", nargs="*")
+    ap.add_argument("--pages", type=int, default=2000)
+    ap.add_argument("--tokens", type=int, default=200)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    for p in args.pdfs:
+        try:
+            art = pdf_ingest.load_or_ingest(p)
+        except Exception as e:
+            print("skipping", p, e)
+            continue
+        _bench(p, art["pages"], art["anchors"], args.tokens, args.repeat)
+    _bench("synthetic", _synthetic_pages(args.pages), None, args.tokens, args.repeat)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Benchmark page extraction speedup vs. number of process-pool workers.
+
+Usage: python bench_extract.py [pdf ...] [--workers 1,2,4,8] [--repeat 3]
+Defaults to every readable PDF in backend/uploaded_pdfs. The extraction cache is bypassed.
+"""
+import os
+import sys
+import time
+import argparse
+
+import pdf_ingest
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    ap = argparse.ArgumentParser()
+    ap.add_argument("pdfs", nargs="*")
+    ap.add_argument("--workers", default="1,2,4,8")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    pdfs = args.pdfs
+    if not pdfs:
+        upload_dir = os.path.join(here, "uploaded_pdfs")
+        pdfs = [os.path.join(upload_dir, f) for f in sorted(os.listdir(upload_dir)) if f.endswith(".pdf")]
+    counts = {}
+    for p in pdfs:
+        try:
+            counts[p] = pdf_ingest._page_count(p)
+        except Exception as e:
+            print("skipping", p, e)
+    pdfs = list(counts)
+    pages = sum(counts.values())
+    print(f"{len(pdfs)} files, {pages} pages, {os.cpu_count()} cores, {pdf_ingest.EXTRACT_PAGES_PER_TASK} pages/task")
+
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(",") if w.strip()]:
+        if workers > 1:
+            # warm the pool so process start-up isn't counted
+            pdf_ingest.ingest_many(pdfs[:1], workers=workers)
+        best = None
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            pdf_ingest.ingest_many(pdfs, workers=workers)
+            elapsed = time.perf_counter() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        baseline = baseline or best
+        print(f"workers={workers:<3d} {best:8.3f}s  {pages / best:8.1f} pages/s  speedup x{baseline / best:.2f}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
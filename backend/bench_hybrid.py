@@ -0,0 +1,59 @@
+"""Benchmark hybrid (vector + BM25) search latency.
+
+Usage: python bench_hybrid.py [--chunks 1000,10000,50000] [--dim 384] [--queries 50]
+Builds synthetic indexes in a temporary INDEX_DIR (split over 10 files) and reports the mean
+latency of search() with and without query_text, in ms and ms per thousand chunks.
+"""
+import sys
+import time
+import random
+import argparse
+import tempfile
+
+import numpy as np
+
+import groq_rag
+
+VOCAB = [f"w{i}" for i in range(20000)]
+
+
+def _text(rng: random.Random, n: int = 60) -> str:
+    # Zipf-like term distribution, roughly like prose
+    return " ".join(VOCAB[min(len(VOCAB) - 1, int(rng.paretovariate(1.1)) - 1)] for _ in range(n))
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chunks", default="1000,10000,50000")
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--queries", type=int, default=50)
+    ap.add_argument("--files", type=int, default=10)
+    args = ap.parse_args()
+
+    groq_rag.INDEX_DIR = tempfile.mkdtemp()
+    # time both legs even when no embedding API key is configured
+    groq_rag._embedding_model_key = lambda: "bench"
+    rng = random.Random(0)
+    np_rng = np.random.default_rng(0)
+    for n in [int(c) for c in args.chunks.split(",") if c.strip()]:
+        file_ids = []
+        per_file = max(1, n // args.files)
+        for f in range(args.files):
+            fid = f"bench_{n}_{f}"
+            vecs = np_rng.standard_normal((per_file, args.dim)).astype(np.float32)
+            entries = [{"id": f"{fid}_{i}", "vector": v.tolist(), "text": _text(rng), "meta": {}} for i, v in enumerate(vecs)]
+            groq_rag.upsert_index(fid, entries)
+            file_ids.append(fid)
+        queries = [(np_rng.standard_normal(args.dim).astype(np.float32).tolist(), _text(rng, 5)) for _ in range(args.queries)]
+        groq_rag.search(file_ids, queries[0][0], query_text=queries[0][1])  # load + warm caches
+        total = per_file * args.files
+        for label, use_text in (("vector", False), ("hybrid", True)):
+            t0 = time.perf_counter()
+            for emb, text in queries:
+                groq_rag.search(file_ids, emb, top_k=6, query_text=text if use_text else None)
+            ms = 1000 * (time.perf_counter() - t0) / len(queries)
+            print(f"{total:7d} chunks  {label:6s}  {ms:8.2f} ms/query  {ms / (total / 1000):6.3f} ms per 1k chunks")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,31 +1,85 @@
-import pdfplumber
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Callable, Iterator, Optional, Tuple
 import os
+import hashlib
 
+import pdf_ingest
+import lexical
+from groq_rag import chunk_pages, ranked_chunks
+from llm_gateway import count_tokens
 
-def extract_texts_from_files(files: List) -> Dict[str, Dict[str, Any]]:
+# Token budget for the paper passages of a /chat-with-papers/ prompt, shared by all papers.
+CHAT_PROMPT_TOKENS = int(os.environ.get("CHAT_PROMPT_TOKENS", "4000"))
+# Passage size for papers that have no RAG index yet (indexed papers use their index chunks).
+CHAT_PASSAGE_TOKENS = int(os.environ.get("CHAT_PASSAGE_TOKENS", "200"))
+# How many passages in a row a paper may skip for not fitting the remaining budget before it stops
+# contributing; a shorter, less relevant passage further down can still fit.
+CHAT_PASSAGE_LOOKAHEAD = int(os.environ.get("CHAT_PASSAGE_LOOKAHEAD", "8"))
+# Analysis questions over papers larger than this (in total) are answered map-reduce: every section of
+# about MAP_SECTION_TOKENS is summarized on its own, then one call answers from the section summaries.
+MAP_REDUCE_MIN_TOKENS = int(os.environ.get("MAP_REDUCE_MIN_TOKENS", "6000"))
+MAP_SECTION_TOKENS = int(os.environ.get("MAP_SECTION_TOKENS", "3000"))
+MAP_SUMMARY_TOKENS = int(os.environ.get("MAP_SUMMARY_TOKENS", "300"))
+# Section summaries don't depend on the question and are cached by content hash; bump this when
+# the map prompt changes so old summaries aren't reused.
+MAP_PROMPT_VERSION = "1"
+
+
+def extract_texts_from_files(files: List, progress: Optional[Callable[[int, int, str], None]] = None,
+                             lazy: bool = True) -> Dict[str, Dict[str, Any]]:
     """
     Given a list of (file_id, file_path), extract text per page and return a dict:
     { file_id: { 'title': filename, 'pages': [page_text, ...] } }
     This function is defensive: if a file can't be opened, it still returns a dict entry
     with an error message in the pages list.
+
+    By default the entries are pdf_ingest.Paper objects: only the page count is read here and each
+    page is extracted the first time it is read, so callers that use the first pages of a paper
+    don't pay for the rest. With lazy=False every page is extracted up front: pages come from the
+    per-document ingestion artifact (see pdf_ingest), which is cached on disk keyed by the SHA-256
+    of the PDF bytes, and papers that are not cached yet are extracted together on a process pool,
+    page ranges in parallel.
+
+    progress(done, total, file_id) is called as each file's text becomes available. For lazy
+    papers that is when pages are actually extracted, with the paper's extracted and total pages.
     """
     result: Dict[str, Dict[str, Any]] = {}
+    files = list(files or [])
+    if lazy:
+        for file_id, file_path in files:
+            on_extract = None
+            if progress is not None:
+                on_extract = (lambda done, total, file_id=file_id: progress(done, total, file_id))
+            try:
+                result[file_id] = pdf_ingest.Paper(os.path.basename(str(file_path)), str(file_path), on_extract)
+            except Exception as e:
+                result[file_id] = {"title": os.path.basename(str(file_path)), "pages": [f"[Error extracting text: {e}]"]}
+        return result
+    on_done: Optional[Callable[[str, Any], None]] = None
+    if progress is not None:
+        ids_by_path: Dict[str, List[str]] = {}
+        for file_id, file_path in files:
+            ids_by_path.setdefault(str(file_path), []).append(file_id)
+        done = [0]
+
+        def report_done(path: str, _artifact: Any) -> None:
+            for file_id in ids_by_path.get(path, []):
+                done[0] += 1
+                try:
+                    progress(done[0], len(files), file_id)
+                except Exception as e:
+                    print("progress callback failed:", e)
+        on_done = report_done
+    try:
+        artifacts = pdf_ingest.load_or_ingest_many([str(file_path) for _, file_path in files], on_done=on_done)
+    except Exception as e:
+        artifacts = {str(file_path): e for _, file_path in files}
     for file_id, file_path in files:
-        try:
-            pages: List[str] = []
-            title = os.path.basename(file_path)
-            with pdfplumber.open(file_path) as pdf:
-                for page in pdf.pages:
-                    try:
-                        text = page.extract_text() or ""
-                    except Exception:
-                        text = ""
-                    pages.append(text)
-            result[file_id] = {"title": title, "pages": pages}
-        except Exception as e:
+        artifact = artifacts.get(str(file_path))
+        if isinstance(artifact, dict):
+            result[file_id] = {"title": os.path.basename(file_path), "pages": artifact.get("pages", [])}
+        else:
             # Always return a dict so callers can safely do info.get(...)
-            result[file_id] = {"title": os.path.basename(str(file_path)), "pages": [f"[Error extracting text: {e}]"]}
+            result[file_id] = {"title": os.path.basename(str(file_path)), "pages": [f"[Error extracting text: {artifact}]"]}
     return result
 
 
@@ -42,9 +96,14 @@ def build_ieee_reference_prompt(paper_texts: Dict[str, Any], user_query: str, ma
         if isinstance(info, dict):
             title = info.get("title", file_id)
             pages = info.get("pages", []) or []
-            if not isinstance(pages, list):
-                pages = [str(pages)]
-            full_text = "\n\n".join([str(p or "") for p in pages])
+            if isinstance(pages, str):
+                pages = [pages]
+            # pages are read only until the excerpt is full, so lazy papers stop extracting there
+            full_text = ""
+            for n, p in enumerate(pages):
+                full_text += ("\n\n" if n else "") + str(p or "")
+                if len(full_text) > max_chars_per_paper:
+                    break
         else:
             # if info is a string or other type, coerce to string
             title = str(file_id)
@@ -53,7 +112,10 @@ def build_ieee_reference_prompt(paper_texts: Dict[str, Any], user_query: str, ma
         excerpt = (full_text[:max_chars_per_paper] + "...") if len(full_text) > max_chars_per_paper else full_text
         numbered_parts.append(f"[{i+1}] {title}:\n{excerpt}")
 
-    refs = "\n\n".join(numbered_parts)
+    return _ieee_prompt(user_query, "\n\n".join(numbered_parts))
+
+
+def _ieee_prompt(user_query: str, refs: str) -> str:
     prompt = f"""
 You are an academic assistant. Answer the user's question using ONLY the provided research papers below.
 When you use information from a paper, cite it in IEEE style as [n], where n is the paper number below.
@@ -67,3 +129,139 @@ Papers:
 Your answer (use short inline citations like [1], [2] referring to the papers above):
 """
     return prompt
+
+
+def _paper_passages(file_id: str, info: Any, user_query: str) -> Iterator[Dict[str, Any]]:
+    # chunks of the paper's RAG index when it has one, otherwise the extracted pages chunked here;
+    # either way ranked by BM25 against the question, unmatched chunks following in document order
+    try:
+        indexed = ranked_chunks(file_id, user_query)
+    except Exception as e:
+        print("reading index failed:", file_id, e)
+        indexed = None
+    if indexed is not None:
+        return indexed
+    if isinstance(info, dict):
+        pages = info.get("pages", []) or []
+        if isinstance(pages, str):
+            pages = [pages]
+    else:
+        pages = [str(info)]
+    chunks = list(chunk_pages(pages, max_tokens=CHAT_PASSAGE_TOKENS, overlap_tokens=0))
+    if not chunks:
+        return iter(())
+    order = lexical.query_order(lexical.LexicalIndex.build([c["text"] for c in chunks]), user_query)
+    return (chunks[i] for i in order)
+
+
+def _join_passages(passages: List[Dict[str, Any]]) -> str:
+    # document order, page-labelled; overlapping index chunks are trimmed so no text repeats
+    parts: List[str] = []
+    end = -1
+    for p in sorted(passages, key=lambda p: p.get("char_start", 0)):
+        text = p["text"]
+        start = p.get("char_start")
+        if start is not None and start < end:
+            text = text[end - start:]
+        if start is not None:
+            end = max(end, start + len(p["text"]))
+        if text.strip():
+            parts.append(f"(p. {p.get('page_start') or p.get('page', '?')}) {text.strip()}")
+    return "\n...\n".join(parts)
+
+
+def build_ieee_retrieval_prompt(paper_texts: Dict[str, Any], user_query: str, token_budget: int = CHAT_PROMPT_TOKENS) -> str:
+    """
+    Like build_ieee_reference_prompt, but each paper contributes the passages most relevant to the
+    query instead of its first characters. Papers take turns adding their next best passage that
+    fits in token_budget (counted in tokens, across all papers), so every paper gets a fair share and
+    the prompt size doesn't grow with the number of papers. A paper stops contributing when its
+    passages run out or CHAT_PASSAGE_LOOKAHEAD in a row didn't fit. Papers keep their [n] numbering.
+    """
+    papers = list((paper_texts or {}).items())
+    streams = [_paper_passages(file_id, info, user_query) for file_id, info in papers]
+    picked: List[List[Dict[str, Any]]] = [[] for _ in papers]
+    remaining = token_budget
+    active = list(range(len(papers)))
+    skipped = [0] * len(papers)  # passages in a row that didn't fit, per paper
+    while active and remaining > 0:
+        for i in list(active):
+            # the budget only shrinks, so a passage that doesn't fit now never will: skip past it
+            while skipped[i] < CHAT_PASSAGE_LOOKAHEAD:
+                passage = next(streams[i], None)
+                if passage is None:
+                    skipped[i] = CHAT_PASSAGE_LOOKAHEAD
+                    break
+                n = count_tokens(passage["text"])
+                if n <= remaining:
+                    picked[i].append(passage)
+                    remaining -= n
+                    skipped[i] = 0
+                    break
+                skipped[i] += 1
+            if skipped[i] >= CHAT_PASSAGE_LOOKAHEAD:
+                active.remove(i)
+
+    numbered_parts: List[str] = []
+    for i, ((file_id, info), passages) in enumerate(zip(papers, picked)):
+        title = info.get("title", file_id) if isinstance(info, dict) else str(file_id)
+        numbered_parts.append(f"[{i+1}] {title}:\n{_join_passages(passages)}")
+    return _ieee_prompt(user_query, "\n\n".join(numbered_parts))
+
+
+def needs_map_reduce(paper_texts: Dict[str, Any], max_chars_per_paper: int = 8000) -> bool:
+    """True when build_ieee_reference_prompt would drop text (a paper longer than its excerpt) or
+    the papers together exceed MAP_REDUCE_MIN_TOKENS."""
+    total = 0
+    for info in (paper_texts or {}).values():
+        pages = (info.get("pages", []) or []) if isinstance(info, dict) else [str(info)]
+        # stops reading a paper as soon as it is known to be longer than its excerpt
+        text: List[str] = []
+        length = 0
+        for p in pages:
+            text.append(str(p or ""))
+            length += len(text[-1]) + (2 if len(text) > 1 else 0)
+            if length > max_chars_per_paper:
+                return True
+        total += count_tokens("\n\n".join(text))
+    return total > MAP_REDUCE_MIN_TOKENS
+
+
+def paper_sections(info: Any) -> List[Dict[str, Any]]:
+    """Consecutive sections of a paper (chunk_pages chunks of MAP_SECTION_TOKENS, no overlap), each
+    with its page range and the SHA-256 of its text as a cache key."""
+    pages = (info.get("pages", []) or []) if isinstance(info, dict) else [str(info)]
+    sections = []
+    for chunk in chunk_pages(pages, max_tokens=MAP_SECTION_TOKENS, overlap_tokens=0):
+        if chunk["text"].strip():
+            chunk["sha256"] = hashlib.sha256(chunk["text"].encode("utf-8")).hexdigest()
+            sections.append(chunk)
+    return sections
+
+
+def build_section_summary_prompt(section_text: str) -> str:
+    """Map step: a question-independent summary of one paper section."""
+    return f"""
+Summarize the following section of a research paper for a reader who will answer questions about the paper later.
+Keep the problem, methods, datasets, numbers, results and conclusions it states; leave out references and boilerplate.
+Use at most 150 words and do not add information that is not in the section.
+
+Section:
+{section_text}
+
+Summary:
+"""
+
+
+def build_ieee_reduce_prompt(papers: List[Tuple[str, List[Tuple[Dict[str, Any], str]]]], user_query: str) -> str:
+    """Reduce step: the IEEE prompt over section summaries. papers is [(title, [(section, summary), ...])]
+    in reference order, so papers keep their [n] numbering."""
+    numbered_parts: List[str] = []
+    for i, (title, summaries) in enumerate(papers):
+        lines = []
+        for section, summary in summaries:
+            first, last = section.get("page_start"), section.get("page_end")
+            where = f"p. {first}" if first == last else f"pp. {first}-{last}"
+            lines.append(f"({where}) {summary.strip()}")
+        numbered_parts.append(f"[{i+1}] {title} (section summaries):\n" + "\n".join(lines))
+    return _ieee_prompt(user_query, "\n\n".join(numbered_parts))
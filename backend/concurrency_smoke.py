@@ -0,0 +1,135 @@
+"""Check that the health endpoint stays responsive while many RAG chats are in flight.
+
+A local stub stands in for the Groq API and answers every embedding/generation call after a delay,
+so each chat spends its time waiting on HTTP like it would in production. While N chats run
+against the app, `/` is probed repeatedly and its latency is reported. The async transport
+(apost_json/amap_ordered) is then checked for ordering and its in-flight bound.
+
+    python concurrency_smoke.py --chats 20 --delay 2
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def _start_stub(delay: float) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            time.sleep(delay)
+            if "input" in body:
+                out = {"data": [{"embedding": [float(len(t) % 7), 1.0, 0.5]} for t in body["input"]]}
+            else:
+                out = {"output": "stub answer [1]"}
+            raw = json.dumps(out).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(raw)))
+            self.end_headers()
+            self.wfile.write(raw)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def _transport_check(base: str, delay: float) -> dict:
+    """Drive the async transport paths (apost_json, amap_ordered) against the stub: results must come
+    back in input order and at most HTTP_MAX_IN_FLIGHT calls may wait on the stub at once."""
+    import http_transport
+
+    n = 2 * http_transport.HTTP_MAX_IN_FLIGHT
+    url, headers = f"{base}/embeddings", {"Authorization": "Bearer stub"}
+    texts = ["x" * i for i in range(n)]
+    t0 = time.perf_counter()
+    resps = await asyncio.gather(*[http_transport.apost_json(url, headers, {"input": [t]}) for t in texts])
+    apost_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    mapped = await http_transport.amap_ordered(lambda t: http_transport.post_json(url, headers, {"input": [t]}), texts)
+    amap_s = time.perf_counter() - t0
+    expected = [float(len(t) % 7) for t in texts]
+    in_order = all([r.json()["data"][0]["embedding"][0] for r in rs] == expected for rs in (resps, mapped))
+    # n calls through an in-flight bound of n/2 take two rounds of the stub's delay
+    bounded = all(2 * delay <= s < 3 * delay for s in (apost_s, amap_s))
+    return {"transport_calls": n, "apost_wall_s": round(apost_s, 2), "amap_wall_s": round(amap_s, 2),
+            "transport_in_order": in_order, "transport_bounded": bounded}
+
+
+async def _run(chats: int, probe_interval: float) -> dict:
+    import httpx
+    import main
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://app", timeout=300) as client:
+        done = asyncio.Event()
+        latencies = []
+
+        async def probe():
+            while not done.is_set():
+                t0 = time.perf_counter()
+                r = await client.get("/")
+                latencies.append(time.perf_counter() - t0)
+                assert r.status_code == 200
+                await asyncio.sleep(probe_interval)
+
+        async def chat(i: int):
+            body = {"user_query": f"question {i} {time.time()}", "paper_files": {"none.pdf": "/tmp/none.pdf"}}
+            r = await client.post("/chat-with-papers-rag/", json=body)
+            return r.json()
+
+        prober = asyncio.create_task(probe())
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*[chat(i) for i in range(chats)])
+        elapsed = time.perf_counter() - t0
+        done.set()
+        await prober
+
+    errors = [r for r in results if "error" in r]
+    latencies.sort()
+    return {
+        "chats": chats,
+        "chat_errors": len(errors),
+        "chats_wall_s": round(elapsed, 2),
+        "probes": len(latencies),
+        "probe_p50_ms": round(1000 * latencies[len(latencies) // 2], 1) if latencies else None,
+        "probe_max_ms": round(1000 * latencies[-1], 1) if latencies else None,
+    }
+
+
+def main_cli() -> int:
+    p = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    p.add_argument("--chats", type=int, default=20)
+    p.add_argument("--delay", type=float, default=2.0, help="seconds the stub API takes per call")
+    p.add_argument("--probe-interval", type=float, default=0.05)
+    p.add_argument("--max-probe-ms", type=float, default=250.0, help="fail if any health probe is slower")
+    args = p.parse_args()
+
+    server = _start_stub(args.delay)
+    base = f"http://127.0.0.1:{server.server_address[1]}"
+    os.environ["GROQ_API_KEY"] = "stub"
+    os.environ["GROQ_EMBEDDING_URL"] = f"{base}/embeddings"
+    os.environ["GROQ_GENERATE_URL"] = f"{base}/generate"
+    # keep the run away from the real caches
+    os.environ["EMBED_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "embed_cache.sqlite3")
+
+    report = asyncio.run(_run(args.chats, args.probe_interval))
+    report.update(asyncio.run(_transport_check(base, args.delay)))
+    print(json.dumps(report, indent=2))
+    server.shutdown()
+    ok = report["chat_errors"] == 0 and report["probe_max_ms"] is not None and report["probe_max_ms"] <= args.max_probe_ms
+    ok = ok and report["transport_in_order"] and report["transport_bounded"]
+    print("OK" if ok else "FAIL: event loop was blocked, chats failed or the async transport misbehaved")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,121 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from array import array
+from typing import List, Dict, Any, Optional
+
+# Use /tmp for writable storage on container-based platforms like Hugging Face Spaces
+CACHE_PATH = os.environ.get("EMBED_CACHE_PATH", "/tmp/embed_cache.sqlite3")
+MAX_BYTES = int(os.environ.get("EMBED_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+
+_local = threading.local()
+_lock = threading.Lock()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+
+def _conn() -> sqlite3.Connection:
+    # one connection per thread; sqlite3 connections can't be shared across threads by default
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, vec BLOB NOT NULL,"
+            " nbytes INTEGER NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+def get_many(model: str, texts: List[str]) -> List[Optional[List[float]]]:
+    """Cached vectors for texts under a model key, None for misses. Hits are marked as recently used."""
+    hashes = [text_hash(t) for t in texts]
+    found: Dict[str, List[float]] = {}
+    conn = _conn()
+    unique = list(dict.fromkeys(hashes))
+    # stay under SQLite's bound-parameter limit
+    for i in range(0, len(unique), 500):
+        part = unique[i:i + 500]
+        marks = ",".join("?" * len(part))
+        rows = conn.execute(f"SELECT text_hash, vec FROM embeddings WHERE model = ? AND text_hash IN ({marks})", [model] + part).fetchall()
+        for h, blob in rows:
+            found[h] = array("f", blob).tolist()
+    if found:
+        now = time.time()
+        conn.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?", [(now, model, h) for h in found])
+        conn.commit()
+    out = [found.get(h) for h in hashes]
+    hits = sum(1 for v in out if v is not None)
+    with _lock:
+        _stats["hits"] += hits
+        _stats["misses"] += len(out) - hits
+    return out
+
+
+def put_many(model: str, texts: List[str], vectors: List[List[float]]) -> None:
+    now = time.time()
+    rows = []
+    for t, v in zip(texts, vectors):
+        blob = array("f", v).tobytes()
+        rows.append((model, text_hash(t), blob, len(blob), now))
+    if not rows:
+        return
+    conn = _conn()
+    conn.executemany("INSERT OR REPLACE INTO embeddings (model, text_hash, vec, nbytes, last_used) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    with _lock:
+        _stats["writes"] += len(rows)
+    evict()
+
+
+def evict() -> int:
+    """Delete least-recently-used vectors until the stored bytes fit MAX_BYTES."""
+    conn = _conn()
+    total = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+    if total <= MAX_BYTES:
+        return 0
+    removed = 0
+    excess = total - MAX_BYTES
+    while excess > 0:
+        rows = conn.execute("SELECT rowid, nbytes FROM embeddings ORDER BY last_used LIMIT 1000").fetchall()
+        if not rows:
+            break
+        doomed = []
+        for rowid, nbytes in rows:
+            if excess <= 0:
+                break
+            doomed.append((rowid,))
+            excess -= nbytes
+        conn.executemany("DELETE FROM embeddings WHERE rowid = ?", doomed)
+        removed += len(doomed)
+    conn.commit()
+    with _lock:
+        _stats["evictions"] += removed
+    return removed
+
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        out: Dict[str, Any] = dict(_stats)
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = (out["hits"] / lookups) if lookups else 0.0
+    try:
+        entries, total = _conn().execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()
+    except Exception:
+        entries, total = 0, 0
+    out["entries"] = entries
+    out["bytes"] = total
+    out["max_bytes"] = MAX_BYTES
+    out["path"] = CACHE_PATH
+    return out
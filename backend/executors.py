@@ -0,0 +1,80 @@
+import os
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import Any, Callable, Iterable, Iterator, Optional, Tuple, TypeVar
+
+# Async endpoints hand blocking work to these pools so the event loop keeps serving other requests.
+# IO pool: outbound HTTP (Groq/OpenAI), SQLite and file writes; mostly waiting, so it can be wide.
+BLOCKING_IO_WORKERS = int(os.environ.get("BLOCKING_IO_WORKERS", "32"))
+# CPU pool: PDF parsing and scoring; kept near the core count so parsing requests queue instead of
+# thrashing (pdf_ingest spreads each request's pages over its own process pool).
+BLOCKING_CPU_WORKERS = int(os.environ.get("BLOCKING_CPU_WORKERS", "0")) or (os.cpu_count() or 1)
+# Paper pool: analysis jobs run each paper's pipeline (extraction, heuristics, anchors) as one task here,
+# so papers overlap; the page parsing inside still goes to pdf_ingest's process pool.
+PAPER_WORKERS = int(os.environ.get("PAPER_WORKERS", "8"))
+
+R = TypeVar("R")
+
+_io: Optional[ThreadPoolExecutor] = None
+_cpu: Optional[ThreadPoolExecutor] = None
+_papers: Optional[ThreadPoolExecutor] = None
+_init_lock = threading.Lock()
+
+
+def _io_pool() -> ThreadPoolExecutor:
+    global _io
+    if _io is None:
+        with _init_lock:
+            if _io is None:
+                _io = ThreadPoolExecutor(max_workers=BLOCKING_IO_WORKERS, thread_name_prefix="blocking-io")
+    return _io
+
+
+def _cpu_pool() -> ThreadPoolExecutor:
+    global _cpu
+    if _cpu is None:
+        with _init_lock:
+            if _cpu is None:
+                _cpu = ThreadPoolExecutor(max_workers=BLOCKING_CPU_WORKERS, thread_name_prefix="blocking-cpu")
+    return _cpu
+
+
+def _paper_pool() -> ThreadPoolExecutor:
+    global _papers
+    if _papers is None:
+        with _init_lock:
+            if _papers is None:
+                _papers = ThreadPoolExecutor(max_workers=PAPER_WORKERS, thread_name_prefix="paper")
+    return _papers
+
+
+async def run_io(fn: Callable[..., R], *args: Any, **kwargs: Any) -> R:
+    """Run a blocking IO-bound call (HTTP, disk) on the IO pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_io_pool(), partial(fn, *args, **kwargs))
+
+
+async def run_cpu(fn: Callable[..., R], *args: Any, **kwargs: Any) -> R:
+    """Run a blocking CPU-bound call (PDF parsing, analysis) on the CPU pool and await its result."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_cpu_pool(), partial(fn, *args, **kwargs))
+
+
+def map_as_completed(fn: Callable[[Any], R], items: Iterable[Any]) -> Iterator[Tuple[int, R]]:
+    """Run fn(item) for every item on the paper pool from synchronous code (e.g. a job worker) and
+    yield (position, result) in completion order. An exception from fn is raised when it is reached."""
+    pool = _paper_pool()
+    futures = {pool.submit(fn, item): pos for pos, item in enumerate(items)}
+    for fut in as_completed(futures):
+        yield futures[fut], fut.result()
+
+
+def shutdown() -> None:
+    global _io, _cpu, _papers
+    with _init_lock:
+        for pool in (_io, _cpu, _papers):
+            if pool is not None:
+                pool.shutdown(wait=False)
+        _io, _cpu, _papers = None, None, None
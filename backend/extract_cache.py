@@ -0,0 +1,176 @@
+import os
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional, Tuple
+
+from anchors import AnchorTable
+
+# Bump whenever the extraction output changes shape or content so stale entries are ignored.
+EXTRACTOR_VERSION = "5"
+
+# Use /tmp for writable storage (next to /tmp/uploaded_pdfs used by main.UPLOAD_DIR)
+CACHE_DIR = os.environ.get("EXTRACT_CACHE_DIR", "/tmp/extract_cache")
+MAX_BYTES = int(os.environ.get("EXTRACT_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+MAX_ENTRIES = int(os.environ.get("EXTRACT_CACHE_MAX_ENTRIES", "5000"))
+os.makedirs(CACHE_DIR, exist_ok=True)
+
+_lock = threading.Lock()
+_stats: Dict[str, int] = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+# (path, size, mtime_ns) -> sha256, so repeated requests don't re-hash unchanged files;
+# least-recently-used first out beyond MAX_ENTRIES, like the entries on disk
+_hash_memo: "OrderedDict[Tuple[str, int, int], str]" = OrderedDict()
+
+
+def file_sha256(file_path: str) -> str:
+    """Return the hex SHA-256 of the file contents (memoized on path, size and mtime)."""
+    st = os.stat(file_path)
+    memo_key = (os.path.abspath(file_path), st.st_size, st.st_mtime_ns)
+    with _lock:
+        sha = _hash_memo.get(memo_key)
+        if sha:
+            _hash_memo.move_to_end(memo_key)
+            return sha
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    sha = h.hexdigest()
+    _memoize(memo_key, sha)
+    return sha
+
+
+def _memoize(memo_key: Tuple[str, int, int], sha: str) -> None:
+    with _lock:
+        _hash_memo[memo_key] = sha
+        _hash_memo.move_to_end(memo_key)
+        while len(_hash_memo) > MAX_ENTRIES:
+            _hash_memo.popitem(last=False)
+
+
+def remember_sha256(file_path: str, digest: str) -> None:
+    """Record a file's SHA-256 computed elsewhere (e.g. while an upload was written), so
+    file_sha256 doesn't read the file again while its size and mtime are unchanged."""
+    st = os.stat(file_path)
+    _memoize((os.path.abspath(file_path), st.st_size, st.st_mtime_ns), digest)
+
+
+def _entry_path(sha: str) -> str:
+    return os.path.join(CACHE_DIR, f"{sha}_v{EXTRACTOR_VERSION}.json")
+
+
+def _anchors_path(sha: str) -> str:
+    # anchors are stored next to the entry as columnar arrays (see anchors.AnchorTable)
+    return os.path.join(CACHE_DIR, f"{sha}_v{EXTRACTOR_VERSION}.anchors.npz")
+
+
+def get_anchors(sha: str) -> Optional[AnchorTable]:
+    """Return only the cached anchors for a content hash, or None."""
+    return AnchorTable.load(_anchors_path(sha))
+
+
+def get(sha: str) -> Optional[Dict[str, Any]]:
+    """Return the cached extraction for a content hash, or None. Counts a hit or a miss."""
+    path = _entry_path(sha)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("anchors") == "columnar":
+            data["anchors"] = get_anchors(sha)
+            if data["anchors"] is None:
+                raise FileNotFoundError(_anchors_path(sha))
+        # touch the entry so LRU eviction sees it as recently used
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+    except Exception:
+        with _lock:
+            _stats["misses"] += 1
+        return None
+    with _lock:
+        _stats["hits"] += 1
+    return data
+
+
+def put(sha: str, data: Dict[str, Any]) -> None:
+    """Store an extraction result for a content hash, then evict if over budget."""
+    path = _entry_path(sha)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        if isinstance(data.get("anchors"), AnchorTable):
+            # written first, so an entry whose JSON exists always has its anchors
+            data["anchors"].save(_anchors_path(sha))
+            data = dict(data, anchors="columnar")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print("extract cache write failed:", e)
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        return
+    with _lock:
+        _stats["writes"] += 1
+    evict()
+
+
+def _scan():
+    # one entry per extraction: its JSON plus the anchors sidecar, evicted together
+    groups: Dict[str, list] = {}
+    for name in os.listdir(CACHE_DIR):
+        if not name.endswith((".json", ".npz")):
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        group = groups.setdefault(name.split(".", 1)[0], [0.0, 0, []])
+        group[0] = max(group[0], st.st_mtime)
+        group[1] += st.st_size
+        group[2].append(path)
+    return [tuple(g) for g in groups.values()]
+
+
+def evict() -> int:
+    """Drop least-recently-used entries until the cache fits MAX_BYTES and MAX_ENTRIES."""
+    removed = 0
+    with _lock:
+        entries = _scan()
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        if total <= MAX_BYTES and count <= MAX_ENTRIES:
+            return 0
+        entries.sort(key=lambda e: e[0])
+        for _, size, paths in entries:
+            if total <= MAX_BYTES and count <= MAX_ENTRIES:
+                break
+            try:
+                # JSON first: without it the entry is a miss even if the sidecar removal fails
+                for path in sorted(paths, key=lambda p: not p.endswith(".json")):
+                    os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            count -= 1
+            removed += 1
+        _stats["evictions"] += removed
+    return removed
+
+
+def stats() -> Dict[str, Any]:
+    entries = _scan()
+    with _lock:
+        out: Dict[str, Any] = dict(_stats)
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = (out["hits"] / lookups) if lookups else 0.0
+    out["entries"] = len(entries)
+    out["bytes"] = sum(size for _, size, _ in entries)
+    out["max_bytes"] = MAX_BYTES
+    out["max_entries"] = MAX_ENTRIES
+    out["extractor_version"] = EXTRACTOR_VERSION
+    return out
@@ -1,16 +1,56 @@
 import os
+import re
 import json
-import math
 import uuid
-from typing import List, Dict, Any
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple, Iterator
 
-import requests
+import numpy as np
+
+import ann
+from anchors import AnchorTable, PAGE_SEP
+import lexical
+import embed_cache
+import http_transport
+import llm_cache
+from llm_gateway import gateway, estimate_tokens
 
 ROOT = os.path.dirname(__file__)
 # Use /tmp for writable storage on container-based platforms like Hugging Face Spaces
 INDEX_DIR = "/tmp/index"
 os.makedirs(INDEX_DIR, exist_ok=True)
 
+# Loaded indexes are kept in memory, least-recently-used first out once over budget.
+INDEX_CACHE_MAX_BYTES = int(os.environ.get("INDEX_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# file_id -> ((inode, mtime_ns, size) of the vector file, loaded index)
+_index_cache: "OrderedDict[str, Tuple[Tuple[int, int, int], Dict[str, Any]]]" = OrderedDict()
+_index_cache_lock = threading.Lock()
+_index_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "resident_bytes": 0}
+
+# IVF indexes built for large file sets, keyed by the (file_id, stamp) of every file they cover.
+ANN_CACHE_ENTRIES = int(os.environ.get("ANN_CACHE_ENTRIES", "4"))
+_ann_cache: "OrderedDict[tuple, ann.IVFIndex]" = OrderedDict()
+_ann_lock = threading.Lock()
+# file set key -> Future of an IVF build in progress, shared by the queries waiting for it
+_ann_builds: Dict[tuple, Future] = {}
+
+# Hybrid retrieval: each leg contributes its best HYBRID_CANDIDATES rows to reciprocal rank fusion.
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "50"))
+RRF_K = int(os.environ.get("RRF_K", "60"))
+
+# chunk_pages budget. Tokens are estimated as characters / CHARS_PER_TOKEN (close enough for English
+# prose with subword tokenizers, and free to compute).
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.environ.get("CHUNK_OVERLAP_TOKENS", "50"))
+CHARS_PER_TOKEN = 4
+# Bump when chunk_pages output changes for the same parameters, so manifests stop matching.
+CHUNKER_VERSION = "2"
+# paragraph breaks, or whitespace after sentence-ending punctuation
+_BOUNDARY_RE = re.compile(r"\n\s*\n|(?<=[.!?])\s+")
+_SPACE_RE = re.compile(r"\s")
+
 
 def chunk_text(text: str, chunk_size: int = 800, overlap: int = 200) -> List[str]:
     text = text or ""
@@ -26,6 +66,107 @@ def chunk_text(text: str, chunk_size: int = 800, overlap: int = 200) -> List[str
     return chunks
 
 
+def _split_unit(text: str, start: int, end: int, budget: int) -> Iterator[Tuple[int, int]]:
+    # trim surrounding whitespace; pieces over budget are cut at the last whitespace that fits
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    while end - start > budget:
+        cut = start + budget
+        ws = None
+        for m in _SPACE_RE.finditer(text, start + 1, cut + 1):
+            ws = m.start()
+        if ws is not None:
+            cut = ws
+        yield start, cut
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if end > start:
+        yield start, end
+
+
+def _page_units(text: str, budget: int) -> Iterator[Tuple[int, int]]:
+    """(start, end) of the sentence/paragraph units of a page, none longer than budget characters."""
+    start = 0
+    for m in _BOUNDARY_RE.finditer(text):
+        yield from _split_unit(text, start, m.start(), budget)
+        start = m.end()
+    yield from _split_unit(text, start, len(text), budget)
+
+
+def chunk_pages(pages, anchors: Optional[AnchorTable] = None, max_tokens: int = CHUNK_MAX_TOKENS,
+                overlap_tokens: int = CHUNK_OVERLAP_TOKENS) -> Iterator[Dict[str, Any]]:
+    """Split a document into retrieval chunks, page by page, keeping provenance.
+
+    Sentences and paragraphs are packed into chunks of at most max_tokens (estimated); consecutive
+    chunks share up to overlap_tokens of trailing sentences, and only a sentence longer than the
+    budget is split, at whitespace. Each chunk is
+    { text, char_start, char_end, page_start, page_end, anchor_ids }, where offsets index the
+    document as PAGE_SEP.join(pages) (text == that slice), pages are 1-based, and anchor_ids are the
+    anchors (from the ingestion artifact) whose words overlap the chunk. `pages` may be any iterable.
+    """
+    budget = max(1, max_tokens * CHARS_PER_TOKEN)
+    overlap = max(0, overlap_tokens * CHARS_PER_TOKEN)
+    # page -> (char_start, char_end, id) arrays; anchors without text offsets (legacy anchor files) are skipped
+    lookup = anchors.span_lookup() if anchors is not None else {}
+    texts: Dict[int, str] = {}
+    offsets: Dict[int, int] = {}
+    buf: List[Tuple[int, int, int]] = []  # (page index, start, end) of the units in the open chunk
+
+    def doc_pos(p: int, c: int) -> int:
+        return offsets[p] + c
+
+    def emit() -> Dict[str, Any]:
+        p0, s0, _ = buf[0]
+        p1, _, e1 = buf[-1]
+        if p0 == p1:
+            text = texts[p0][s0:e1]
+        else:
+            text = PAGE_SEP.join([texts[p0][s0:]] + [texts[p] for p in range(p0 + 1, p1)] + [texts[p1][:e1]])
+        anchor_ids: List[int] = []
+        for p in range(p0, p1 + 1):
+            if p + 1 not in lookup:
+                continue
+            starts, ends, ids = lookup[p + 1]
+            lo = s0 if p == p0 else 0
+            hi = e1 if p == p1 else len(texts[p])
+            anchor_ids.extend(ids[(starts < hi) & (ends > lo)].tolist())
+        return {"text": text, "char_start": offsets[p0] + s0, "char_end": offsets[p1] + e1,
+                "page_start": p0 + 1, "page_end": p1 + 1, "anchor_ids": anchor_ids}
+
+    offset = 0
+    for p, text in enumerate(pages):
+        text = text or ""
+        texts[p] = text
+        offsets[p] = offset
+        offset += len(text) + len(PAGE_SEP)
+        for s, e in _page_units(text, budget):
+            # a chunk is the document slice from its first unit to its last, so the text between
+            # units (and PAGE_SEP at a page change) counts towards the budget and the overlap
+            end = doc_pos(p, e)
+            if buf and end - doc_pos(buf[0][0], buf[0][1]) > budget:
+                yield emit()
+                # carry the trailing sentences that fit in the overlap into the next chunk
+                last_end = doc_pos(buf[-1][0], buf[-1][2])
+                keep: List[Tuple[int, int, int]] = []
+                for unit in reversed(buf):
+                    if last_end - doc_pos(unit[0], unit[1]) > overlap:
+                        break
+                    keep.append(unit)
+                buf = keep[::-1]
+                if buf and end - doc_pos(buf[0][0], buf[0][1]) > budget:
+                    buf = []
+                # only pages still referenced by the open chunk are kept
+                first = buf[0][0] if buf else p
+                for old in [q for q in texts if q < first]:
+                    del texts[old]
+            buf.append((p, s, e))
+    if buf:
+        yield emit()
+
+
 def _call_groq_embeddings(texts: List[str]) -> List[List[float]]:
     key = os.environ.get("GROQ_API_KEY")
     if not key:
@@ -34,7 +175,7 @@ def _call_groq_embeddings(texts: List[str]) -> List[List[float]]:
     url = os.environ.get("GROQ_EMBEDDING_URL", "https://api.groq.com/v1/embeddings")
     headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
     payload = {"input": texts}
-    resp = requests.post(url, headers=headers, json=payload, timeout=30)
+    resp = http_transport.post_json(url, headers, payload, timeout=30)
     resp.raise_for_status()
     data = resp.json()
     # try common response shapes
@@ -52,15 +193,55 @@ def _call_groq_embeddings(texts: List[str]) -> List[List[float]]:
     return embeddings
 
 
-def _call_groq_generate(prompt: str) -> str:
+def _embedding_model_key() -> str:
+    """Cache namespace for embeddings: vectors from different endpoints/models (or the offline fallback) never mix."""
+    if not os.environ.get("GROQ_API_KEY"):
+        return "local-dummy"
+    return os.environ.get("GROQ_EMBEDDING_URL", "https://api.groq.com/v1/embeddings")
+
+
+def embed_texts(texts: List[str], batch_size: int = 64) -> List[List[float]]:
+    """Embed texts through the on-disk embedding cache: only texts not seen before under the current
+    model are sent to _call_groq_embeddings (deduplicated, in batches that run concurrently over the
+    pooled transport), and their vectors are stored."""
+    model = _embedding_model_key()
+    try:
+        vectors = embed_cache.get_many(model, texts)
+    except Exception as e:
+        print("embedding cache read failed:", e)
+        vectors = [None] * len(texts)
+    missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+    if missing:
+        batches = [missing[i : i + batch_size] for i in range(0, len(missing), batch_size)]
+        fresh: Dict[str, List[float]] = {}
+        for batch, embs in zip(batches, http_transport.map_ordered(_call_groq_embeddings, batches)):
+            fresh.update(zip(batch, embs))
+        try:
+            embed_cache.put_many(model, missing, [fresh[t] for t in missing])
+        except Exception as e:
+            print("embedding cache write failed:", e)
+        vectors = [v if v is not None else fresh[t] for t, v in zip(texts, vectors)]
+    return vectors
+
+
+def _call_groq_generate(prompt: str, bypass_cache: bool = False) -> str:
+    """Generate an answer for a prompt. Responses are cached by endpoint and prompt (llm_cache) and
+    identical concurrent prompts share one request; bypass_cache forces a fresh call."""
     key = os.environ.get("GROQ_API_KEY")
     if not key:
         # fallback to a local generator that returns an extractive summary of the prompt/snippets
         return _dummy_generate(prompt)
     url = os.environ.get("GROQ_GENERATE_URL", "https://api.groq.com/v1/generate")
+    params = {"url": url, "prompt": prompt, "max_tokens": 512}
+    return llm_cache.cached_call("groq-generate", params, lambda: _groq_generate_request(url, key, prompt), bypass=bypass_cache)
+
+
+def _groq_generate_request(url: str, key: str, prompt: str) -> str:
     headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json"}
     payload = {"prompt": prompt, "max_tokens": 512}
-    resp = requests.post(url, headers=headers, json=payload, timeout=60)
+    # queued behind the gateway's Groq concurrency and tokens-per-minute limits
+    with gateway.limit("groq", estimate_tokens(prompt, 512)):
+        resp = http_transport.post_json(url, headers, payload, timeout=60)
     resp.raise_for_status()
     data = resp.json()
     # normalize response
@@ -76,6 +257,63 @@ def _call_groq_generate(prompt: str) -> str:
     return json.dumps(data)
 
 
+def _delta_text(data: Any) -> str:
+    """Text carried by one streamed event, for the common provider shapes."""
+    if not isinstance(data, dict):
+        return ""
+    for key in ("output", "text", "token"):
+        if isinstance(data.get(key), str):
+            return data[key]
+    choices = data.get("choices")
+    if isinstance(choices, list) and choices and isinstance(choices[0], dict):
+        first = choices[0]
+        return first.get("text") or (first.get("delta") or {}).get("content") or ""
+    return ""
+
+
+def _stream_groq_generate(prompt: str, bypass_cache: bool = False) -> Iterator[str]:
+    """Yield the generated answer piece by piece as the provider streams it (Server-Sent Events).
+    Offline, the extractive _dummy_generate answer is yielded word by word. Shares the response
+    cache with _call_groq_generate: a cached answer is yielded at once."""
+    key = os.environ.get("GROQ_API_KEY")
+    if not key:
+        for i, word in enumerate(_dummy_generate(prompt).split(" ")):
+            yield word if i == 0 else " " + word
+        return
+    url = os.environ.get("GROQ_GENERATE_URL", "https://api.groq.com/v1/generate")
+    params = {"url": url, "prompt": prompt, "max_tokens": 512}
+    yield from llm_cache.cached_stream("groq-generate", params, lambda: _groq_stream_request(url, key, prompt), bypass=bypass_cache)
+
+
+def _groq_stream_request(url: str, key: str, prompt: str) -> Iterator[str]:
+    headers = {"Authorization": f"Bearer {key}", "Content-Type": "application/json", "Accept": "text/event-stream"}
+    payload = {"prompt": prompt, "max_tokens": 512, "stream": True}
+    # the Groq slot is held until the stream is consumed or closed
+    with gateway.limit("groq", estimate_tokens(prompt, 512)):
+        resp = http_transport.post_json(url, headers, payload, timeout=60, stream=True)
+        try:
+            resp.raise_for_status()
+            if "text/event-stream" not in resp.headers.get("Content-Type", ""):
+                # provider ignored the stream flag: hand back the whole answer at once
+                data = resp.json()
+                yield _delta_text(data) or json.dumps(data)
+                return
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                body = line[len("data:"):].strip()
+                if body == "[DONE]":
+                    break
+                try:
+                    piece = _delta_text(json.loads(body))
+                except ValueError:
+                    piece = body
+                if piece:
+                    yield piece
+        finally:
+            resp.close()
+
+
 def _dummy_embeddings(texts: List[str], dim: int = 64) -> List[List[float]]:
     """Deterministic lightweight embedding: hash-based vectors for offline testing."""
     import hashlib
@@ -118,68 +356,473 @@ def _dummy_generate(prompt: str, max_len: int = 512) -> str:
     return prompt[:max_len]
 
 
+def _index_paths(file_id: str, generation: str = "") -> Dict[str, str]:
+    """Files making up one file's index: a float32 vector matrix and its row norms (.npy, memory-mappable),
+    chunk id/text/meta as JSON lines in a blob addressed by a byte-offset array, and the BM25 postings.
+
+    Each upsert writes these under a new generation (<file_id>.<generation>.*) and then points
+    <file_id>.current at it, so a reader always gets files of one generation. Generation '' names
+    the files of indexes written before generations existed."""
+    base = os.path.join(INDEX_DIR, file_id)
+    stem = f"{base}.{generation}" if generation else base
+    return {
+        "vectors": f"{stem}.vec.npy",
+        "norms": f"{stem}.norm.npy",
+        "offsets": f"{stem}.off.npy",
+        "blob": f"{stem}.blob.jsonl",
+        "lexical": f"{stem}.bm25.npz",
+        "current": f"{base}.current",
+        "legacy": f"{base}.json",
+        "manifest": f"{base}.manifest.json",
+    }
+
+
+def _current_generation(file_id: str) -> Optional[str]:
+    """The index generation readers should use, '' for a pre-generation index, None if there is none."""
+    paths = _index_paths(file_id)
+    try:
+        with open(paths["current"], "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        pass
+    return "" if os.path.exists(paths["vectors"]) else None
+
+
+def _remove_generations(file_id: str, keep: Tuple[Optional[str], ...] = ()) -> None:
+    # index files of this file's generations other than `keep`
+    pattern = re.compile(re.escape(file_id) + r"\.(?:([0-9a-f]{12})\.)?(?:vec\.npy|norm\.npy|off\.npy|blob\.jsonl|bm25\.npz)")
+    try:
+        names = os.listdir(INDEX_DIR)
+    except OSError:
+        return
+    for name in names:
+        m = pattern.fullmatch(name)
+        if m and (m.group(1) or "") not in keep:
+            try:
+                os.remove(os.path.join(INDEX_DIR, name))
+            except OSError:
+                pass
+
+
+def _save_npy(path: str, arr: np.ndarray) -> None:
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, arr)
+    os.replace(tmp, path)
+
+
 def upsert_index(file_id: str, entries: List[Dict[str, Any]]) -> int:
-    """Write index entries for a file as JSON. entries is list of {'id','vector','text','meta'}"""
-    path = os.path.join(INDEX_DIR, f"{file_id}.json")
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(entries, f, ensure_ascii=False)
+    """Write index entries for a file to the binary store. entries is list of {'id','vector','text','meta'}"""
+    previous = _current_generation(file_id)
+    generation = uuid.uuid4().hex[:12]
+    paths = _index_paths(file_id, generation)
+    entries = [e for e in entries if isinstance(e.get("vector"), list) and e.get("vector")]
+    dim = len(entries[0]["vector"]) if entries else 0
+    entries = [e for e in entries if len(e["vector"]) == dim]
+    vectors = np.asarray([e["vector"] for e in entries], dtype=np.float32).reshape(len(entries), dim)
+    norms = np.linalg.norm(vectors, axis=1).astype(np.float32)
+    offsets = np.zeros(len(entries) + 1, dtype=np.int64)
+    # the new generation's files are not visible to readers until .current names it
+    with open(paths["blob"], "wb") as f:
+        for i, e in enumerate(entries):
+            f.write(json.dumps({"id": e.get("id"), "text": e.get("text"), "meta": e.get("meta")}, ensure_ascii=False).encode("utf-8") + b"\n")
+            offsets[i + 1] = f.tell()
+    lexical.LexicalIndex.build([e.get("text") or "" for e in entries]).save(paths["lexical"])
+    _save_npy(paths["offsets"], offsets)
+    _save_npy(paths["norms"], norms)
+    _save_npy(paths["vectors"], vectors)
+    tmp = f"{paths['current']}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp, paths["current"])
+    _invalidate_index(file_id)
+    # the previous generation stays for readers that loaded it before the switch; older ones go
+    _remove_generations(file_id, keep=(generation, previous))
+    if os.path.exists(paths["legacy"]):
+        try:
+            os.remove(paths["legacy"])
+        except OSError:
+            pass
     return len(entries)
 
 
+def has_index(file_id: str) -> bool:
+    """Whether a file has an index on disk (possibly a legacy JSON one, migrated on first read)."""
+    return _current_generation(file_id) is not None or os.path.exists(_index_paths(file_id)["legacy"])
+
+
+def remove_index(file_id: str) -> None:
+    """Delete a file's index (every generation, and a legacy JSON index), so it is no longer searched."""
+    paths = _index_paths(file_id)
+    for path in (paths["current"], paths["legacy"]):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    _remove_generations(file_id)
+    _invalidate_index(file_id)
+
+
+def _migrate_json_index(file_id: str) -> bool:
+    """Convert a legacy <file_id>.json index into the binary store. Returns True if one was migrated."""
+    legacy = _index_paths(file_id)["legacy"]
+    if not os.path.exists(legacy):
+        return False
+    try:
+        with open(legacy, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        upsert_index(file_id, data if isinstance(data, list) else [])
+        return True
+    except Exception as e:
+        print("index migration failed:", file_id, e)
+        return False
+
+
+def _load_index_arrays(file_id: str, mmap: bool = True) -> Optional[Dict[str, Any]]:
+    """Load a file's vectors, norms and blob offsets (memory-mapped unless mmap=False), migrating a
+    legacy JSON index first if needed. Returns None when the file has no (complete) index."""
+    generation = _current_generation(file_id)
+    if generation is None:
+        if not _migrate_json_index(file_id):
+            return None
+        generation = _current_generation(file_id)
+        if generation is None:
+            return None
+    paths = _index_paths(file_id, generation)
+    mode = "r" if mmap else None
+    try:
+        vectors = np.load(paths["vectors"], mmap_mode=mode)
+        norms = np.load(paths["norms"], mmap_mode=mode)
+        offsets = np.load(paths["offsets"])
+    except Exception:
+        return None
+    if vectors.ndim != 2 or len(norms) != len(vectors) or len(offsets) != len(vectors) + 1:
+        return None
+    nbytes = int(vectors.nbytes + norms.nbytes + offsets.nbytes)
+    return {"file_id": file_id, "generation": generation, "vectors": vectors, "norms": norms, "offsets": offsets,
+            "blob": paths["blob"], "nbytes": nbytes}
+
+
+def _load_lexical(index: Dict[str, Any]) -> lexical.LexicalIndex:
+    """The file's BM25 postings; rebuilt from the blob when missing or out of step with the vectors
+    (indexes written before lexical search existed)."""
+    path = _index_paths(index["file_id"], index["generation"])["lexical"]
+    lex = lexical.LexicalIndex.load(path)
+    if lex is None or len(lex) != len(index["vectors"]):
+        with open(index["blob"], "rb") as f:
+            texts = [json.loads(line.decode("utf-8")).get("text") or "" for line in f]
+        lex = lexical.LexicalIndex.build(texts[:len(index["vectors"])])
+        try:
+            lex.save(path)
+        except OSError as e:
+            print("saving lexical index failed:", index["file_id"], e)
+    return lex
+
+
+def _index_stamp(file_id: str) -> Optional[Tuple[int, int, int]]:
+    # upsert_index replaces the .current pointer, so the inode changes even if mtime/size happen to match
+    paths = _index_paths(file_id)
+    try:
+        st = os.stat(paths["current"])
+    except OSError:
+        try:
+            st = os.stat(paths["vectors"])
+        except OSError:
+            return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def _invalidate_index(file_id: str) -> None:
+    with _index_cache_lock:
+        cached = _index_cache.pop(file_id, None)
+        if cached is not None:
+            _index_cache_stats["invalidations"] += 1
+            _index_cache_stats["resident_bytes"] -= cached[1]["nbytes"]
+
+
+def load_index_arrays(file_id: str) -> Optional[Dict[str, Any]]:
+    """Return a file's index from the in-process LRU cache, reloading it when the generation pointer's
+    inode/mtime/size no longer matches (e.g. another worker re-indexed it)."""
+    stamp = _index_stamp(file_id)
+    with _index_cache_lock:
+        cached = _index_cache.get(file_id)
+        if cached is not None and stamp is not None and cached[0] == stamp:
+            _index_cache.move_to_end(file_id)
+            _index_cache_stats["hits"] += 1
+            return cached[1]
+        _index_cache_stats["misses"] += 1
+    if cached is not None:
+        _invalidate_index(file_id)
+    index = _load_index_arrays(file_id, mmap=False)
+    if index is None:
+        return None
+    try:
+        index["lexical"] = _load_lexical(index)
+        index["nbytes"] += index["lexical"].nbytes
+    except Exception as e:
+        print("lexical index unavailable:", file_id, e)
+        index["lexical"] = None
+    stamp = _index_stamp(file_id)
+    index["stamp"] = stamp
+    if stamp is None or index["nbytes"] > INDEX_CACHE_MAX_BYTES:
+        return index
+    with _index_cache_lock:
+        previous = _index_cache.pop(file_id, None)
+        if previous is not None:
+            _index_cache_stats["resident_bytes"] -= previous[1]["nbytes"]
+        _index_cache[file_id] = (stamp, index)
+        _index_cache_stats["resident_bytes"] += index["nbytes"]
+        while _index_cache_stats["resident_bytes"] > INDEX_CACHE_MAX_BYTES and len(_index_cache) > 1:
+            _, (_, evicted) = _index_cache.popitem(last=False)
+            _index_cache_stats["resident_bytes"] -= evicted["nbytes"]
+            _index_cache_stats["evictions"] += 1
+    return index
+
+
+def index_cache_stats() -> Dict[str, Any]:
+    with _index_cache_lock:
+        out: Dict[str, Any] = dict(_index_cache_stats)
+        out["entries"] = len(_index_cache)
+    lookups = out["hits"] + out["misses"]
+    out["hit_rate"] = (out["hits"] / lookups) if lookups else 0.0
+    out["max_bytes"] = INDEX_CACHE_MAX_BYTES
+    return out
+
+
+def _read_entries(index: Dict[str, Any], rows: List[int]) -> List[Dict[str, Any]]:
+    """Read only the requested rows' id/text/meta from the blob."""
+    offsets = index["offsets"]
+    out: List[Dict[str, Any]] = []
+    with open(index["blob"], "rb") as f:
+        for r in rows:
+            f.seek(int(offsets[r]))
+            out.append(json.loads(f.read(int(offsets[r + 1] - offsets[r])).decode("utf-8")))
+    return out
+
+
 def load_index_for_files(file_ids: List[str]) -> List[Dict[str, Any]]:
     out: List[Dict[str, Any]] = []
     for fid in file_ids:
-        path = os.path.join(INDEX_DIR, f"{fid}.json")
-        if not os.path.exists(path):
+        index = load_index_arrays(fid)
+        if index is None:
             continue
         try:
-            with open(path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                out.extend(data)
+            entries = _read_entries(index, list(range(len(index["vectors"]))))
         except Exception:
             continue
+        for e, vec in zip(entries, index["vectors"]):
+            e["vector"] = vec.tolist()
+            out.append(e)
     return out
 
 
-def _cosine(a: List[float], b: List[float]) -> float:
-    if not a or not b:
-        return 0.0
-    dot = sum(x * y for x, y in zip(a, b))
-    na = math.sqrt(sum(x * x for x in a))
-    nb = math.sqrt(sum(y * y for y in b))
-    if na == 0 or nb == 0:
-        return 0.0
-    return dot / (na * nb)
+def _get_ann_index(indexes: List[Dict[str, Any]]) -> ann.IVFIndex:
+    """IVF index over the concatenation of the given file indexes, built once per file set and version."""
+    key = tuple((idx["file_id"], idx.get("stamp")) for idx in indexes)
+    with _ann_lock:
+        ivf = _ann_cache.get(key)
+        if ivf is not None:
+            _ann_cache.move_to_end(key)
+            return ivf
+        build = _ann_builds.get(key)
+        leader = build is None
+        if leader:
+            build = _ann_builds[key] = Future()
+    if not leader:
+        # the same corpus is being built by another query: share its result
+        return build.result()
+    # built outside the global lock, so queries over other file sets (and cache hits) aren't held up
+    try:
+        ivf = ann.IVFIndex(np.concatenate([np.asarray(idx["vectors"]) for idx in indexes]))
+    except BaseException as e:
+        with _ann_lock:
+            _ann_builds.pop(key, None)
+        build.set_exception(e)
+        raise
+    with _ann_lock:
+        _ann_cache[key] = ivf
+        while len(_ann_cache) > ANN_CACHE_ENTRIES:
+            _ann_cache.popitem(last=False)
+        _ann_builds.pop(key, None)
+    build.set_result(ivf)
+    return ivf
+
+
+def _ranks(scores: np.ndarray, k: int, positive: bool = False) -> np.ndarray:
+    # row ids of the k best scores, best first
+    if positive:
+        candidates = np.flatnonzero(scores > 0)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        return candidates[np.argsort(-scores[candidates], kind="stable")]
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    rows = np.argpartition(-scores, k - 1)[:k]
+    return rows[np.argsort(-scores[rows], kind="stable")]
 
 
-def search(file_ids: List[str], query_embedding: List[float], top_k: int = 5) -> List[Dict[str, Any]]:
-    candidates = load_index_for_files(file_ids)
-    scored = []
-    for c in candidates:
-        vec = c.get("vector")
-        if not isinstance(vec, list):
+def search(file_ids: List[str], query_embedding: List[float], top_k: int = 5, nprobe: Optional[int] = None,
+           query_text: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Top-k chunks over the requested files.
+
+    Vector leg: small corpora are scored exactly (one matrix-vector product per file against the
+    precomputed norms, argpartition over all scores); once the files hold ann.ANN_MIN_CHUNKS chunks or
+    more, an IVF index probing `nprobe` lists is used instead.
+
+    With query_text, a BM25 leg over the per-file inverted indexes runs too and the two rankings are
+    merged with reciprocal rank fusion (score = sum of 1 / (RRF_K + rank)) over the top
+    HYBRID_CANDIDATES of each. The offline hash embeddings carry no meaning, so without an embedding
+    API the ranking is BM25 only. Only the hits are read from the blobs.
+    """
+    q = np.asarray(query_embedding or [], dtype=np.float32)
+    qn = float(np.linalg.norm(q)) if q.size else 0.0
+    indexes = []
+    for fid in file_ids:
+        index = load_index_arrays(fid)
+        if index is None or len(index["vectors"]) == 0 or index["vectors"].shape[1] != q.size:
             continue
-        score = _cosine(query_embedding, vec)
-        scored.append((score, c))
-    scored.sort(key=lambda x: x[0], reverse=True)
+        indexes.append(index)
+    if not indexes or top_k <= 0:
+        return []
+    starts = np.cumsum([0] + [len(idx["vectors"]) for idx in indexes])
+    hybrid = bool(query_text) and all(idx.get("lexical") is not None for idx in indexes)
+    depth = max(top_k, HYBRID_CANDIDATES) if hybrid else top_k
+    lex_rows = np.empty(0, dtype=np.int64)
+    if hybrid:
+        bm25 = lexical.bm25_scores([idx["lexical"] for idx in indexes], starts, query_text)
+        lex_rows = _ranks(bm25, depth, positive=True)
+    # offline hash vectors only serve as a fallback when no chunk shares a term with the query
+    use_vectors = not hybrid or _embedding_model_key() != "local-dummy" or len(lex_rows) == 0
+
+    vec_rows = np.empty(0, dtype=np.int64)
+    vec_scores = np.empty(0, dtype=np.float32)
+    if use_vectors:
+        if starts[-1] >= ann.ANN_MIN_CHUNKS:
+            vec_rows, vec_scores = _get_ann_index(indexes).search(q, depth, nprobe)
+        else:
+            scores = []
+            for index in indexes:
+                denom = index["norms"] * qn
+                scores.append(np.divide(index["vectors"] @ q, denom, out=np.zeros(len(denom), dtype=np.float32), where=denom > 0))
+            all_scores = np.concatenate(scores)
+            vec_rows = _ranks(all_scores, depth)
+            vec_scores = all_scores[vec_rows]
+
+    if hybrid:
+        fused = np.zeros(int(starts[-1]), dtype=np.float64)
+        fused[vec_rows] += 1.0 / (RRF_K + 1 + np.arange(len(vec_rows)))
+        fused[lex_rows] += 1.0 / (RRF_K + 1 + np.arange(len(lex_rows)))
+        rows = _ranks(fused, top_k, positive=True)
+        top_scores = fused[rows]
+    else:
+        rows, top_scores = vec_rows[:top_k], vec_scores[:top_k]
+    owners = np.searchsorted(starts, rows, side="right") - 1
     results = []
-    for s, c in scored[:top_k]:
-        results.append({"score": s, "id": c.get("id"), "text": c.get("text"), "meta": c.get("meta")})
+    for pos, owner, score in zip(rows, owners, top_scores):
+        index = indexes[owner]
+        c = _read_entries(index, [int(pos - starts[owner])])[0]
+        results.append({"score": float(score), "id": c.get("id"), "text": c.get("text"), "meta": c.get("meta")})
     return results
 
 
-def index_file_chunks(file_id: str, chunks: List[str], metas: List[Dict[str, Any]]) -> int:
+def ranked_chunks(file_id: str, query_text: str) -> Optional[Iterator[Dict[str, Any]]]:
+    """A file's indexed chunks for query_text, BM25 matches first and the rest in document order, as
+    {text, **meta} dicts read from the blob as the iterator advances. None if the file isn't indexed."""
+    index = load_index_arrays(file_id)
+    if index is None or index.get("lexical") is None:
+        return None
+    order = lexical.query_order(index["lexical"], query_text or "")
+
+    def read() -> Iterator[Dict[str, Any]]:
+        for row in order:
+            entry = _read_entries(index, [int(row)])[0]
+            yield dict(entry.get("meta") or {}, text=entry.get("text") or "")
+    return read()
+
+
+def index_manifest(content_hash: str, max_tokens: int, overlap_tokens: int, extractor_version: str = "") -> Dict[str, Any]:
+    """What an index was built from. A file whose stored manifest equals this one needs no re-indexing."""
+    return {
+        "content_hash": content_hash,
+        "extractor_version": extractor_version,
+        "chunker": {"name": "chunk_pages", "version": CHUNKER_VERSION, "max_tokens": max_tokens, "overlap_tokens": overlap_tokens},
+        "embedding_model": _embedding_model_key(),
+    }
+
+
+def read_manifest(file_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(_index_paths(file_id)["manifest"], "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else None
+    except (OSError, ValueError):
+        return None
+
+
+def matching_manifest(file_id: str, manifest: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """The stored manifest if the file's index was built from exactly `manifest` and is still on disk, else None."""
+    stored = read_manifest(file_id)
+    if not stored or any(stored.get(k) != v for k, v in manifest.items()):
+        return None
+    if _current_generation(file_id) is None:
+        return None
+    return stored
+
+
+def _write_manifest(file_id: str, manifest: Dict[str, Any]) -> None:
+    path = _index_paths(file_id)["manifest"]
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f)
+    os.replace(tmp, path)
+
+
+def _reusable_vectors(file_id: str, texts: List[str]) -> Dict[str, List[float]]:
+    # vectors already in this file's index for chunks that are unchanged, when built with the same embedding model
+    stored = read_manifest(file_id)
+    if not stored or stored.get("embedding_model") != _embedding_model_key():
+        return {}
+    index = _load_index_arrays(file_id)
+    if index is None:
+        return {}
+    wanted = set(texts)
+    out: Dict[str, List[float]] = {}
+    try:
+        with open(index["blob"], "rb") as f:
+            for row, line in enumerate(f):
+                text = json.loads(line.decode("utf-8")).get("text")
+                if text in wanted and text not in out:
+                    out[text] = index["vectors"][row].tolist()
+    except Exception as e:
+        print("reading previous index failed:", file_id, e)
+        return {}
+    return out
+
+
+def index_file_chunks(file_id: str, chunks: List[str], metas: List[Dict[str, Any]], manifest: Optional[Dict[str, Any]] = None) -> int:
+    """Embed and store a file's chunks. Chunks whose text is already in the file's index keep their
+    vector; only new text is embedded (through the embedding cache). With a manifest (see index_manifest)
+    the result is recorded so an unchanged file can be skipped next time."""
+    paths = _index_paths(file_id)
+    previous = _reusable_vectors(file_id, chunks) if chunks else {}
+    # drop the manifest first: if the rewrite below is interrupted, the file is simply re-indexed later
+    try:
+        os.remove(paths["manifest"])
+    except OSError:
+        pass
     if not chunks:
+        # nothing to index any more: the previous chunks must not keep answering for this file
+        remove_index(file_id)
         return 0
-    # call embeddings in batches
-    B = 64
-    embeddings: List[List[float]] = []
-    for i in range(0, len(chunks), B):
-        batch = chunks[i : i + B]
-        embs = _call_groq_embeddings(batch)
-        embeddings.extend(embs)
+    missing = [ch for ch in chunks if ch not in previous]
+    fresh = dict(zip(missing, embed_texts(missing))) if missing else {}
     entries = []
-    for i, (ch, emb, meta) in enumerate(zip(chunks, embeddings, metas)):
+    for i, (ch, meta) in enumerate(zip(chunks, metas)):
+        emb = previous.get(ch) or fresh.get(ch)
         entries.append({"id": f"{file_id}_{i}", "vector": emb, "text": ch, "meta": meta})
-    upsert_index(file_id, entries)
-    return len(entries)
+    count = upsert_index(file_id, entries)
+    if manifest is not None:
+        _write_manifest(file_id, dict(manifest, chunks=count, reused=len(chunks) - len(missing)))
+    return count
+
@@ -0,0 +1,114 @@
+import os
+import time
+import random
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+from typing import List, Dict, Any, Callable, Optional, TypeVar
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Shared keep-alive transport for the Groq/LLM HTTP calls.
+HTTP_POOL_SIZE = int(os.environ.get("HTTP_POOL_SIZE", "16"))
+# Requests (e.g. embedding batches) allowed in flight at once through map_ordered/amap_ordered.
+HTTP_MAX_IN_FLIGHT = int(os.environ.get("HTTP_MAX_IN_FLIGHT", "4"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "4"))
+HTTP_BACKOFF_BASE = float(os.environ.get("HTTP_BACKOFF_BASE", "0.5"))
+HTTP_BACKOFF_MAX = float(os.environ.get("HTTP_BACKOFF_MAX", "20"))
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+_session: Optional[requests.Session] = None
+_executor: Optional[ThreadPoolExecutor] = None
+_init_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Process-wide requests.Session with a connection pool, so calls reuse TCP+TLS connections."""
+    global _session
+    if _session is None:
+        with _init_lock:
+            if _session is None:
+                s = requests.Session()
+                adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+                s.mount("https://", adapter)
+                s.mount("http://", adapter)
+                _session = s
+    return _session
+
+
+def _executor_for_batches() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        with _init_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=HTTP_MAX_IN_FLIGHT, thread_name_prefix="http")
+    return _executor
+
+
+def _backoff(attempt: int, resp: Optional[requests.Response]) -> float:
+    # honour Retry-After when the server sends seconds; otherwise full-jitter exponential backoff
+    if resp is not None:
+        retry_after = resp.headers.get("Retry-After")
+        if retry_after:
+            try:
+                return min(HTTP_BACKOFF_MAX, float(retry_after))
+            except ValueError:
+                pass
+    return random.uniform(0, min(HTTP_BACKOFF_MAX, HTTP_BACKOFF_BASE * (2 ** attempt)))
+
+
+def post_json(url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: float = 30, **kwargs: Any) -> requests.Response:
+    """POST JSON over the pooled session, retrying 429/5xx responses and connection errors with jittered
+    backoff. Returns the last response; callers still call raise_for_status()."""
+    session = get_session()
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        try:
+            resp = session.post(url, headers=headers, json=payload, timeout=timeout, **kwargs)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt >= HTTP_MAX_RETRIES:
+                raise
+            time.sleep(_backoff(attempt, None))
+            continue
+        if resp.status_code not in RETRY_STATUS or attempt >= HTTP_MAX_RETRIES:
+            return resp
+        resp.close()
+        time.sleep(_backoff(attempt, resp))
+    return resp
+
+
+async def apost_json(url: str, headers: Dict[str, str], payload: Dict[str, Any], timeout: float = 30, **kwargs: Any) -> requests.Response:
+    """post_json for async code: runs on the transport's worker threads, so the event loop isn't
+    blocked and async callers share the HTTP_MAX_IN_FLIGHT bound with map_ordered/amap_ordered."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor_for_batches(), partial(post_json, url, headers, payload, timeout, **kwargs))
+
+
+def map_ordered(fn: Callable[[T], R], items: List[T], progress: Optional[Callable[[int, int], None]] = None) -> List[R]:
+    """Apply fn to items with at most HTTP_MAX_IN_FLIGHT calls running at once; results keep the
+    input order and the first exception is re-raised. progress(done, total) is called from the
+    calling thread as each call finishes (so job progress reporting works from it)."""
+    if len(items) <= 1 or HTTP_MAX_IN_FLIGHT <= 1:
+        results = []
+        for item in items:
+            results.append(fn(item))
+            if progress is not None:
+                progress(len(results), len(items))
+        return results
+    futures = [_executor_for_batches().submit(fn, item) for item in items]
+    if progress is not None:
+        for done, _ in enumerate(as_completed(futures), start=1):
+            progress(done, len(items))
+    return [f.result() for f in futures]
+
+
+async def amap_ordered(fn: Callable[[T], R], items: List[T]) -> List[R]:
+    """Async counterpart of map_ordered."""
+    loop = asyncio.get_running_loop()
+    executor = _executor_for_batches()
+    return list(await asyncio.gather(*[loop.run_in_executor(executor, fn, item) for item in items]))
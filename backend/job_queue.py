@@ -1,28 +1,475 @@
+import os
+import json
+import queue
+import socket
+import sqlite3
 import threading
+import importlib
+import itertools
 import time
 import uuid
-from typing import Dict, Any, Callable
+from typing import Dict, Any, Callable, Iterator, Optional, Tuple, List
+
+# Job scheduler: a fixed pool of worker threads pulls jobs from a bounded priority queue.
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_MAX = int(os.environ.get("JOB_QUEUE_MAX", "100"))
+# Finished jobs are dropped after JOB_TTL_SECONDS, or earlier (oldest first) once their
+# results take more than JOB_RESULTS_MAX_BYTES.
+JOB_TTL_SECONDS = float(os.environ.get("JOB_TTL_SECONDS", "3600"))
+JOB_RESULTS_MAX_BYTES = int(os.environ.get("JOB_RESULTS_MAX_BYTES", str(256 * 1024 * 1024)))
+
+# Job state lives in memory by default. JOB_STORE=sqlite keeps it in a SQLite file shared by all
+# worker processes (uvicorn --workers N), with results offloaded to JOB_RESULTS_DIR.
+JOB_STORE = os.environ.get("JOB_STORE", "memory").lower()
+# Use /tmp for writable storage on container-based platforms like Hugging Face Spaces
+JOB_DB_PATH = os.environ.get("JOB_DB_PATH", "/tmp/jobs.sqlite3")
+JOB_RESULTS_DIR = os.environ.get("JOB_RESULTS_DIR", "/tmp/job_results")
+# Each process refreshes a heartbeat; unfinished jobs of a process silent for JOB_STALE_SECONDS are re-queued.
+JOB_HEARTBEAT_SECONDS = float(os.environ.get("JOB_HEARTBEAT_SECONDS", "10"))
+JOB_STALE_SECONDS = float(os.environ.get("JOB_STALE_SECONDS", "60"))
+# Event streams send a keep-alive after this many idle seconds; jobs run by another process are
+# followed by re-reading the store every JOB_EVENTS_POLL_SECONDS.
+JOB_EVENTS_KEEPALIVE = float(os.environ.get("JOB_EVENTS_KEEPALIVE", "15"))
+JOB_EVENTS_POLL_SECONDS = float(os.environ.get("JOB_EVENTS_POLL_SECONDS", "1"))
+
+# Lower runs first: interactive requests jump ahead of queued bulk analysis.
+PRIORITIES = {"interactive": 0, "bulk": 10}
+DEFAULT_PRIORITY = "bulk"
+
+FINISHED = ("completed", "failed")
+# Fields left out of the compact status returned by default.
+LARGE_FIELDS = ("result", "traceback")
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a job is submitted while the queue already holds JOB_QUEUE_MAX pending jobs."""
+
+
+def _result_size(value: Any) -> int:
+    try:
+        return len(json.dumps(value, default=str))
+    except Exception:
+        return 0
+
+
+class MemoryJobStore:
+    """Job records in a process-local dict (the module-level `jobs`)."""
+
+    def __init__(self, records: Dict[str, Dict[str, Any]]):
+        self.jobs = records
+
+    def create(self, job_id: str, record: Dict[str, Any]) -> None:
+        # target/args are only needed for restart recovery, which a process-local store can't offer
+        self.jobs[job_id] = {k: v for k, v in record.items() if k not in ("target", "args", "kwargs")}
+        self.jobs[job_id].update(result=None, error=None, progress=None)
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            job.update(fields)
+
+    def set_result(self, job_id: str, result: Any) -> None:
+        self.update(job_id, result=result, result_bytes=_result_size(result))
+
+    def get(self, job_id: str, full: bool = False) -> Optional[Dict[str, Any]]:
+        job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        out = dict(job)
+        if not full:
+            for k in LARGE_FIELDS:
+                out.pop(k, None)
+            out["has_result"] = job.get("result") is not None
+        return out
+
+    def delete(self, job_id: str) -> None:
+        self.jobs.pop(job_id, None)
+
+    def finished(self) -> List[Tuple[float, str, int]]:
+        return [(j.get("finished_at") or 0, jid, j.get("result_bytes", 0)) for jid, j in list(self.jobs.items()) if j.get("status") in FINISHED]
+
+    def heartbeat(self) -> None:
+        pass
+
+    def claim_stale(self) -> List[Dict[str, Any]]:
+        return []
+
+
+class SQLiteJobStore:
+    """Job records in a SQLite table shared by every worker process; results are JSON files on disk.
+
+    Each process registers an owner id with a heartbeat. Jobs still pending/running under an owner
+    whose heartbeat went stale (a crashed or restarted process) can be claimed and re-queued.
+    """
+
+    COLUMNS = ("job_id", "status", "priority", "target", "args", "kwargs", "owner", "created_at", "started_at",
+               "finished_at", "error", "traceback", "result_path", "result_bytes", "progress")
+
+    def __init__(self, path: str, results_dir: str):
+        self.path = path
+        self.results_dir = results_dir
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._local = threading.local()
+        os.makedirs(results_dir, exist_ok=True)
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " job_id TEXT PRIMARY KEY, status TEXT NOT NULL, priority TEXT, target TEXT, args TEXT, kwargs TEXT,"
+            " owner TEXT, created_at REAL, started_at REAL, finished_at REAL, error TEXT, traceback TEXT,"
+            " result_path TEXT, result_bytes INTEGER DEFAULT 0, progress TEXT)"
+        )
+        try:
+            # databases created before progress reporting
+            conn.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+        except sqlite3.OperationalError:
+            pass
+        conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status)")
+        conn.execute("CREATE TABLE IF NOT EXISTS owners (owner TEXT PRIMARY KEY, heartbeat REAL NOT NULL)")
+        conn.commit()
+        self.heartbeat()
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, job_id: str, record: Dict[str, Any]) -> None:
+        try:
+            args = json.dumps(record.get("args", []))
+            kwargs = json.dumps(record.get("kwargs", {}))
+        except (TypeError, ValueError):
+            # not JSON-serializable: the job still runs but can't be recovered after a restart
+            args, kwargs = None, None
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO jobs (job_id, status, priority, target, args, kwargs, owner, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, record["status"], record.get("priority"), record.get("target"), args, kwargs, self.owner, record.get("created_at")),
+        )
+        conn.commit()
+
+    def update(self, job_id: str, **fields: Any) -> None:
+        fields = {k: v for k, v in fields.items() if k in self.COLUMNS and k != "job_id"}
+        if not fields:
+            return
+        if "progress" in fields:
+            fields["progress"] = json.dumps(fields["progress"], default=str)
+        conn = self._conn()
+        conn.execute(f"UPDATE jobs SET {', '.join(f'{k} = ?' for k in fields)} WHERE job_id = ?", list(fields.values()) + [job_id])
+        conn.commit()
+
+    def set_result(self, job_id: str, result: Any) -> None:
+        path = os.path.join(self.results_dir, f"{job_id}.json")
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, default=str)
+        os.replace(tmp, path)
+        self.update(job_id, result_path=path, result_bytes=os.path.getsize(path))
+
+    def get(self, job_id: str, full: bool = False) -> Optional[Dict[str, Any]]:
+        row = self._conn().execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        out: Dict[str, Any] = {k: row[k] for k in ("status", "priority", "created_at", "started_at", "finished_at", "error", "result_bytes")}
+        out["progress"] = json.loads(row["progress"]) if row["progress"] else None
+        result_path = row["result_path"]
+        if full:
+            out["traceback"] = row["traceback"]
+            out["result"] = None
+            if result_path and os.path.exists(result_path):
+                with open(result_path, "r", encoding="utf-8") as f:
+                    out["result"] = json.load(f)
+        else:
+            out["has_result"] = bool(result_path)
+        return out
+
+    def delete(self, job_id: str) -> None:
+        conn = self._conn()
+        row = conn.execute("SELECT result_path FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        if row is not None and row["result_path"]:
+            try:
+                os.remove(row["result_path"])
+            except OSError:
+                pass
+        conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+        conn.commit()
+
+    def finished(self) -> List[Tuple[float, str, int]]:
+        rows = self._conn().execute("SELECT finished_at, job_id, result_bytes FROM jobs WHERE status IN ('completed', 'failed')").fetchall()
+        return [(r["finished_at"] or 0, r["job_id"], r["result_bytes"] or 0) for r in rows]
+
+    def heartbeat(self) -> None:
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO owners (owner, heartbeat) VALUES (?, ?)", (self.owner, time.time()))
+        conn.commit()
+
+    def claim_stale(self) -> List[Dict[str, Any]]:
+        """Take over unfinished jobs whose owner stopped heartbeating; returns the claimed records."""
+        conn = self._conn()
+        cutoff = time.time() - JOB_STALE_SECONDS
+        rows = conn.execute(
+            "SELECT j.* FROM jobs j LEFT JOIN owners o ON o.owner = j.owner"
+            " WHERE j.status IN ('pending', 'running') AND (o.heartbeat IS NULL OR o.heartbeat < ?)"
+            " ORDER BY j.created_at",
+            (cutoff,),
+        ).fetchall()
+        claimed = []
+        for row in rows:
+            # compare-and-set on the old owner so only one process wins each job
+            cur = conn.execute("UPDATE jobs SET owner = ?, status = 'pending' WHERE job_id = ? AND owner IS ?", (self.owner, row["job_id"], row["owner"]))
+            conn.commit()
+            if cur.rowcount == 1:
+                claimed.append(dict(row))
+        conn.execute("DELETE FROM owners WHERE heartbeat < ?", (cutoff,))
+        conn.commit()
+        return claimed
+
 
-# Simple in-memory job queue for demo (not production safe)
 jobs: Dict[str, Dict[str, Any]] = {}
+store = SQLiteJobStore(JOB_DB_PATH, JOB_RESULTS_DIR) if JOB_STORE == "sqlite" else MemoryJobStore(jobs)
 
-def start_job(target: Callable, *args, **kwargs) -> str:
-    job_id = str(uuid.uuid4())
-    jobs[job_id] = {"status": "pending", "result": None, "error": None}
-    def run():
+_lock = threading.Lock()
+_seq = itertools.count()
+_queue: "queue.PriorityQueue[Tuple[int, int, str, Callable, tuple, dict]]" = queue.PriorityQueue(maxsize=JOB_QUEUE_MAX)
+_workers: list = []
+# Functions that may be re-run after a restart, by "module:qualname".
+_targets: Dict[str, Callable] = {}
+# Per-job event logs for jobs run by this process; an event's seq is its 1-based position in the log.
+_events: Dict[str, List[Dict[str, Any]]] = {}
+_events_cond = threading.Condition()
+# Which job the current worker thread is running, so targets can report progress without a job id.
+_current = threading.local()
+
+
+def _target_name(target: Callable) -> str:
+    return f"{getattr(target, '__module__', '')}:{getattr(target, '__qualname__', repr(target))}"
+
+
+def register_target(target: Callable) -> Callable:
+    """Allow jobs running `target` to be recovered after a restart (usable as a decorator)."""
+    _targets[_target_name(target)] = target
+    return target
+
+
+def _resolve_target(name: str) -> Optional[Callable]:
+    if name in _targets:
+        return _targets[name]
+    module_name, _, qualname = (name or "").partition(":")
+    try:
+        obj: Any = importlib.import_module(module_name)
+        for part in qualname.split("."):
+            obj = getattr(obj, part)
+    except Exception:
+        return None
+    # only functions registered by their module are re-run
+    return obj if _targets.get(name) is obj else None
+
+
+def _evict_finished() -> None:
+    now = time.time()
+    with _lock:
+        finished = sorted(store.finished())
+        total = sum(size for _, _, size in finished)
+        for finished_at, jid, size in finished:
+            if now - finished_at <= JOB_TTL_SECONDS and total <= JOB_RESULTS_MAX_BYTES:
+                break
+            store.delete(jid)
+            total -= size
+            with _events_cond:
+                _events.pop(jid, None)
+
+
+def _publish(job_id: str, event: str, data: Dict[str, Any]) -> None:
+    with _events_cond:
+        log = _events.setdefault(job_id, [])
+        log.append({"seq": len(log) + 1, "event": event, "data": data})
+        _events_cond.notify_all()
+
+
+def report_progress(stage: str, current: Optional[int] = None, total: Optional[int] = None, **extra: Any) -> None:
+    """Record the running job's stage (e.g. 'extracting', 2, 5) and push it to event listeners.
+    A no-op outside a job worker, so job targets can also be called directly."""
+    job_id = getattr(_current, "job_id", None)
+    if job_id is None:
+        return
+    progress = {"stage": stage, "current": current, "total": total, **extra}
+    store.update(job_id, progress=progress)
+    _publish(job_id, "progress", progress)
+
+
+def report_partial(data: Dict[str, Any]) -> None:
+    """Push a partial result (e.g. one finished paper) of the running job to event listeners.
+    Partial results are not stored; the final result still carries everything."""
+    job_id = getattr(_current, "job_id", None)
+    if job_id is not None:
+        _publish(job_id, "partial", data)
+
+
+def _run(job_id: str, target: Callable, args: tuple, kwargs: dict) -> None:
+    _current.job_id = job_id
+    try:
+        store.update(job_id, status="running", started_at=time.time())
+        _publish(job_id, "status", {"status": "running"})
+        result = target(*args, **kwargs)
+        store.set_result(job_id, result)
+        store.update(job_id, status="completed", finished_at=time.time())
+        # the result itself isn't copied into the event log; listeners read it from the store
+        _publish(job_id, "status", {"status": "completed"})
+    except Exception as e:
+        import traceback as _tb
+        store.update(job_id, status="failed", error=str(e), traceback=_tb.format_exc(), finished_at=time.time())
+        _publish(job_id, "status", {"status": "failed", "error": str(e)})
+    finally:
+        _current.job_id = None
+    _evict_finished()
+
+
+def _worker() -> None:
+    while True:
+        _, _, job_id, target, args, kwargs = _queue.get()
         try:
-            jobs[job_id]["status"] = "running"
-            result = target(*args, **kwargs)
-            jobs[job_id]["result"] = result
-            jobs[job_id]["status"] = "completed"
+            _run(job_id, target, args, kwargs)
         except Exception as e:
-            import traceback as _tb
-            jobs[job_id]["error"] = str(e)
-            jobs[job_id]["traceback"] = _tb.format_exc()
-            jobs[job_id]["status"] = "failed"
-    thread = threading.Thread(target=run)
-    thread.start()
+            print("job worker error:", job_id, e)
+        finally:
+            _queue.task_done()
+
+
+def _heartbeat_loop() -> None:
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        try:
+            store.heartbeat()
+            recover_jobs()
+        except Exception as e:
+            print("job heartbeat error:", e)
+
+
+def _ensure_workers() -> None:
+    with _lock:
+        if _workers:
+            return
+        for i in range(JOB_WORKERS):
+            t = threading.Thread(target=_worker, name=f"job-worker-{i}", daemon=True)
+            t.start()
+            _workers.append(t)
+        if isinstance(store, SQLiteJobStore):
+            threading.Thread(target=_heartbeat_loop, name="job-heartbeat", daemon=True).start()
+
+
+def _enqueue(job_id: str, target: Callable, args: tuple, kwargs: dict, priority: str) -> None:
+    _queue.put_nowait((PRIORITIES.get(priority, PRIORITIES[DEFAULT_PRIORITY]), next(_seq), job_id, target, tuple(args), dict(kwargs or {})))
+
+
+def recover_jobs() -> int:
+    """Re-queue unfinished jobs left behind by a crashed or restarted process (SQLite store only).
+    Jobs whose target isn't registered, or whose arguments couldn't be stored, are marked failed."""
+    _ensure_workers()
+    recovered = 0
+    for row in store.claim_stale():
+        target = _resolve_target(row.get("target"))
+        if target is None or row.get("args") is None:
+            store.update(row["job_id"], status="failed", error="interrupted by a restart and not recoverable", finished_at=time.time())
+            continue
+        try:
+            _publish(row["job_id"], "status", {"status": "pending"})
+            _enqueue(row["job_id"], target, tuple(json.loads(row["args"])), json.loads(row.get("kwargs") or "{}"), row.get("priority") or DEFAULT_PRIORITY)
+            recovered += 1
+        except queue.Full:
+            # leave it pending under this owner; it runs when a later restart recovers it again
+            break
+    return recovered
+
+
+def submit_job(target: Callable, args: tuple = (), kwargs: Optional[dict] = None, priority: str = DEFAULT_PRIORITY) -> str:
+    """Queue target(*args, **kwargs) with a priority class from PRIORITIES and return its job id.
+    Raises QueueFullError instead of queueing when JOB_QUEUE_MAX jobs are already waiting."""
+    _ensure_workers()
+    _evict_finished()
+    if _queue.full():
+        raise QueueFullError(f"job queue is full ({JOB_QUEUE_MAX} pending jobs)")
+    job_id = str(uuid.uuid4())
+    store.create(job_id, {"status": "pending", "priority": priority, "created_at": time.time(),
+                          "target": _target_name(target), "args": list(args), "kwargs": dict(kwargs or {})})
+    _publish(job_id, "status", {"status": "pending"})
+    try:
+        _enqueue(job_id, target, args, kwargs or {}, priority)
+    except queue.Full:
+        store.delete(job_id)
+        with _events_cond:
+            _events.pop(job_id, None)
+        raise QueueFullError(f"job queue is full ({JOB_QUEUE_MAX} pending jobs)")
     return job_id
 
-def get_job_status(job_id: str) -> Dict[str, Any]:
-    return jobs.get(job_id, {"status": "not_found"})
+
+def start_job(target: Callable, *args, **kwargs) -> str:
+    return submit_job(target, args, kwargs)
+
+
+def get_job_status(job_id: str, full: bool = False) -> Dict[str, Any]:
+    """Compact job status (without result and traceback) unless full=True."""
+    return store.get(job_id, full=full) or {"status": "not_found"}
+
+
+def _poll_store_events(job_id: str) -> Iterator[Optional[Dict[str, Any]]]:
+    # job owned by another process (shared SQLite store) or no longer in the event log: follow the stored status
+    last = None
+    idle = 0.0
+    while True:
+        job = store.get(job_id)
+        if job is None:
+            yield {"seq": None, "event": "status", "data": {"status": "not_found"}}
+            return
+        state = (job.get("status"), json.dumps(job.get("progress"), sort_keys=True, default=str))
+        if state != last:
+            if job.get("progress") and (last is None or state[1] != last[1]):
+                yield {"seq": None, "event": "progress", "data": job["progress"]}
+            if last is None or state[0] != last[0]:
+                data = {"status": job["status"]}
+                if job.get("error"):
+                    data["error"] = job["error"]
+                yield {"seq": None, "event": "status", "data": data}
+            last = state
+            idle = 0.0
+        if job.get("status") in FINISHED:
+            return
+        time.sleep(JOB_EVENTS_POLL_SECONDS)
+        idle += JOB_EVENTS_POLL_SECONDS
+        if idle >= JOB_EVENTS_KEEPALIVE:
+            idle = 0.0
+            yield None
+
+
+def iter_job_events(job_id: str, after: int = 0) -> Iterator[Optional[Dict[str, Any]]]:
+    """Yield {seq, event, data} events of a job as they happen, starting after event number `after`
+    (e.g. a reconnecting client's Last-Event-ID). Events are 'status' (pending/running/completed/failed),
+    'progress' and 'partial'. Yields None as a keep-alive after JOB_EVENTS_KEEPALIVE idle seconds and
+    stops after the job has finished. Blocks, so run it on a worker thread.
+    """
+    while True:
+        deadline = time.monotonic() + JOB_EVENTS_KEEPALIVE
+        with _events_cond:
+            log = _events.get(job_id)
+            # the condition is shared by all jobs: keep waiting through other jobs' notifications
+            while log is not None and len(log) <= after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                _events_cond.wait(remaining)
+                log = _events.get(job_id)
+            new = log[after:] if log is not None else None
+        if new is None:
+            yield from _poll_store_events(job_id)
+            return
+        if not new:
+            yield None
+            continue
+        for ev in new:
+            yield ev
+            after = ev["seq"]
+            if ev["event"] == "status" and ev["data"].get("status") in FINISHED:
+                return
@@ -0,0 +1,128 @@
+import os
+import re
+import hashlib
+from collections import Counter
+from typing import List, Optional
+
+import numpy as np
+
+# Okapi BM25 parameters.
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+
+# Lower-cased alphanumeric runs; inner dots, dashes and underscores are kept so identifiers like
+# "il-6", "brca1", "eq. 3.2" -> "3.2" or "resnet_50" stay single terms.
+_TOKEN_RE = re.compile(r"[0-9a-z]+(?:[._\-][0-9a-z]+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall((text or "").lower())
+
+
+def term_hash(term: str) -> int:
+    # terms are stored as 64-bit hashes, so the vocabulary is one sorted integer array
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class LexicalIndex:
+    """Inverted index over one file's chunks, in CSR form.
+
+    `vocab` holds the sorted term hashes; the postings of vocab[i] are rows[offsets[i]:offsets[i+1]]
+    with term frequencies in tf. doc_len is the token count of every chunk.
+    """
+
+    def __init__(self, vocab: np.ndarray, offsets: np.ndarray, rows: np.ndarray, tf: np.ndarray, doc_len: np.ndarray):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.rows = rows
+        self.tf = tf
+        self.doc_len = doc_len
+
+    @classmethod
+    def build(cls, texts: List[str]) -> "LexicalIndex":
+        hashes: List[int] = []
+        rows: List[int] = []
+        tfs: List[int] = []
+        doc_len = np.zeros(len(texts), dtype=np.int32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_len[row] = len(tokens)
+            for term, count in Counter(tokens).items():
+                hashes.append(term_hash(term))
+                rows.append(row)
+                tfs.append(count)
+        h = np.asarray(hashes, dtype=np.uint64)
+        r = np.asarray(rows, dtype=np.int32)
+        t = np.minimum(np.asarray(tfs, dtype=np.int64), np.iinfo(np.uint16).max).astype(np.uint16)
+        order = np.lexsort((r, h))
+        h, r, t = h[order], r[order], t[order]
+        vocab, first = np.unique(h, return_index=True)
+        offsets = np.append(first, len(h)).astype(np.int64)
+        return cls(vocab, offsets, r, t, doc_len)
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.vocab.nbytes + self.offsets.nbytes + self.rows.nbytes + self.tf.nbytes + self.doc_len.nbytes)
+
+    def postings(self, h: int):
+        i = int(np.searchsorted(self.vocab, np.uint64(h)))
+        if i >= len(self.vocab) or int(self.vocab[i]) != h:
+            return None
+        a, b = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.rows[a:b], self.tf[a:b]
+
+    def save(self, path: str) -> None:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, vocab=self.vocab, offsets=self.offsets, rows=self.rows, tf=self.tf, doc_len=self.doc_len)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["LexicalIndex"]:
+        try:
+            with np.load(path) as data:
+                return cls(data["vocab"], data["offsets"], data["rows"], data["tf"], data["doc_len"])
+        except Exception:
+            return None
+
+
+def bm25_scores(indexes: List[LexicalIndex], starts: np.ndarray, query: str) -> np.ndarray:
+    """BM25 score of every chunk across several files for a query, as one array laid out like the
+    concatenation of the files (file i's rows start at starts[i]). Collection statistics (N, average
+    length, document frequencies) are computed over all the given files together."""
+    total = int(starts[-1])
+    scores = np.zeros(total, dtype=np.float32)
+    terms = list(dict.fromkeys(tokenize(query)))
+    if not terms or total == 0:
+        return scores
+    doc_len = np.concatenate([idx.doc_len for idx in indexes]).astype(np.float32)
+    avgdl = float(doc_len.mean()) or 1.0
+    norm = BM25_K1 * (1.0 - BM25_B + BM25_B * doc_len / avgdl)
+    for term in terms:
+        h = term_hash(term)
+        parts = []
+        for idx, start in zip(indexes, starts):
+            hit = idx.postings(h)
+            if hit is not None:
+                parts.append((hit[0].astype(np.int64) + int(start), hit[1]))
+        if not parts:
+            continue
+        rows = np.concatenate([p[0] for p in parts])
+        tf = np.concatenate([p[1] for p in parts]).astype(np.float32)
+        df = len(rows)
+        idf = np.log1p((total - df + 0.5) / (df + 0.5))
+        # each row appears once per term, so plain fancy-index accumulation is safe
+        scores[rows] += idf * tf * (BM25_K1 + 1.0) / (tf + norm[rows])
+    return scores
+
+
+def query_order(index: LexicalIndex, query: str) -> np.ndarray:
+    """Row order of one index for a query: chunks matching it by BM25 score, best first, followed by
+    the unmatched ones in document order."""
+    scores = bm25_scores([index], np.array([0, len(index)]), query)
+    hits = np.flatnonzero(scores > 0)
+    hits = hits[np.argsort(-scores[hits], kind="stable")]
+    return np.concatenate([hits, np.flatnonzero(scores <= 0)])
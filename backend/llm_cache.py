@@ -0,0 +1,283 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
+
+# Responses are cached in memory (LRU by entry count) and in SQLite (LRU by bytes); both expire after the TTL.
+# Use /tmp for writable storage on container-based platforms like Hugging Face Spaces
+CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "/tmp/llm_cache.sqlite3")
+TTL_SECONDS = float(os.environ.get("LLM_CACHE_TTL_SECONDS", str(24 * 3600)))
+MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MEMORY_ENTRIES", "512"))
+MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# LLM_CACHE=0 turns caching off (single-flight still applies).
+ENABLED = os.environ.get("LLM_CACHE", "1") != "0"
+
+_local = threading.local()
+_lock = threading.Lock()
+_memory: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+_stats: Dict[str, int] = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "bypassed": 0,
+                          "writes": 0, "evictions": 0, "expired": 0}
+
+
+class _Flight:
+    """One upstream call that identical concurrent requests wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        # pieces received so far when the upstream call is streamed, replayed to the followers
+        self.parts: List[str] = []
+        self._cond = threading.Condition()
+
+    def publish(self, piece: str) -> None:
+        with self._cond:
+            self.parts.append(piece)
+            self._cond.notify_all()
+
+    def finish(self) -> None:
+        with self._cond:
+            self.done.set()
+            self._cond.notify_all()
+
+    def follow(self) -> Iterator[str]:
+        """Yield the leader's pieces as they arrive (those already received first), then end or
+        raise as the leader did. A non-streamed leader's response is yielded in one piece."""
+        sent = 0
+        while True:
+            with self._cond:
+                while len(self.parts) <= sent and not self.done.is_set():
+                    self._cond.wait()
+                new = self.parts[sent:]
+                finished = self.done.is_set()
+            for piece in new:
+                yield piece
+            sent += len(new)
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                if not sent and self.value:
+                    yield self.value
+                return
+
+
+_flights: Dict[str, _Flight] = {}
+
+
+def _conn() -> sqlite3.Connection:
+    # one connection per thread; sqlite3 connections can't be shared across threads by default
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_PATH, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, nbytes INTEGER NOT NULL,"
+            " created_at REAL NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+
+def cache_key(provider: str, params: Dict[str, Any]) -> str:
+    """Hash of everything that determines the response: provider/endpoint, model, prompt and options."""
+    raw = json.dumps({"provider": provider, **params}, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _count(name: str, n: int = 1) -> None:
+    with _lock:
+        _stats[name] += n
+
+
+def get(key: str) -> Optional[str]:
+    """Cached response for a key from memory, then disk (promoted to memory); None if absent or expired."""
+    now = time.time()
+    with _lock:
+        hit = _memory.get(key)
+        if hit is not None:
+            if now - hit[0] <= TTL_SECONDS:
+                _memory.move_to_end(key)
+                _stats["memory_hits"] += 1
+                return hit[1]
+            del _memory[key]
+            _stats["expired"] += 1
+    try:
+        conn = _conn()
+        row = conn.execute("SELECT value, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if now - row[1] > TTL_SECONDS:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            conn.commit()
+            _count("expired")
+            return None
+        conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (now, key))
+        conn.commit()
+    except Exception as e:
+        print("llm cache read failed:", e)
+        return None
+    _remember(key, row[1], row[0])
+    _count("disk_hits")
+    return row[0]
+
+
+def _remember(key: str, created_at: float, value: str) -> None:
+    with _lock:
+        _memory[key] = (created_at, value)
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+
+
+def put(key: str, value: str) -> None:
+    now = time.time()
+    _remember(key, now, value)
+    try:
+        conn = _conn()
+        conn.execute("INSERT OR REPLACE INTO responses (key, value, nbytes, created_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                     (key, value, len(value.encode("utf-8")), now, now))
+        conn.commit()
+        evict()
+    except Exception as e:
+        print("llm cache write failed:", e)
+        return
+    _count("writes")
+
+
+def evict() -> int:
+    """Drop expired responses, then least-recently-used ones until the stored bytes fit MAX_BYTES."""
+    conn = _conn()
+    removed = conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - TTL_SECONDS,)).rowcount
+    total = conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM responses").fetchone()[0]
+    excess = total - MAX_BYTES
+    while excess > 0:
+        rows = conn.execute("SELECT key, nbytes FROM responses ORDER BY last_used LIMIT 1000").fetchall()
+        if not rows:
+            break
+        doomed = []
+        for key, nbytes in rows:
+            if excess <= 0:
+                break
+            doomed.append((key,))
+            excess -= nbytes
+        conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+        removed += len(doomed)
+    conn.commit()
+    if removed:
+        _count("evictions", removed)
+    return removed
+
+
+def cached_call(provider: str, params: Dict[str, Any], fn: Callable[[], str], bypass: bool = False,
+                cacheable: Callable[[str], bool] = bool) -> str:
+    """Return fn()'s response for (provider, params), served from the cache when possible.
+
+    Concurrent calls with the same key share one fn() call (single-flight), also when bypassing.
+    bypass=True skips the lookup and refreshes the entry. Only responses passing `cacheable`
+    (by default: non-empty) are stored, so errors aren't replayed.
+    """
+    key = cache_key(provider, params)
+    if bypass:
+        _count("bypassed")
+    elif ENABLED:
+        value = get(key)
+        if value is not None:
+            return value
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+        else:
+            _stats["coalesced"] += 1
+    if not leader:
+        flight.done.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+    try:
+        if not bypass:
+            _count("misses")
+        flight.value = fn()
+        if ENABLED and flight.value and cacheable(flight.value):
+            put(key, flight.value)
+        return flight.value
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            _flights.pop(key, None)
+        flight.finish()
+
+
+def cached_stream(provider: str, params: Dict[str, Any], fn: Callable[[], Iterator[str]], bypass: bool = False) -> Iterator[str]:
+    """Streaming counterpart of cached_call: a cached response is yielded in one piece; otherwise
+    fn()'s pieces are passed through and the full response is stored once the stream completes.
+    Concurrent streams with the same key share one fn() call: the others replay its pieces as they
+    arrive, and fail if the leading stream fails or is abandoned before it completes."""
+    key = cache_key(provider, params)
+    if bypass:
+        _count("bypassed")
+    elif ENABLED:
+        value = get(key)
+        if value is not None:
+            yield value
+            return
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+        else:
+            _stats["coalesced"] += 1
+    if not leader:
+        yield from flight.follow()
+        return
+    try:
+        if not bypass:
+            _count("misses")
+        for piece in fn():
+            flight.publish(piece)
+            yield piece
+        flight.value = "".join(flight.parts)
+        if ENABLED and flight.value:
+            put(key, flight.value)
+    except GeneratorExit:
+        # the leader's client went away mid-stream; its followers only have part of the response
+        flight.error = RuntimeError("streamed LLM call was abandoned before it completed")
+        raise
+    except BaseException as e:
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            _flights.pop(key, None)
+        flight.finish()
+
+def stats() -> Dict[str, Any]:
+    with _lock:
+        out: Dict[str, Any] = dict(_stats)
+        out["memory_entries"] = len(_memory)
+        out["in_flight"] = len(_flights)
+    hits = out["memory_hits"] + out["disk_hits"]
+    lookups = hits + out["misses"]
+    out["hit_rate"] = (hits / lookups) if lookups else 0.0
+    try:
+        entries, total = _conn().execute("SELECT COUNT(*), COALESCE(SUM(nbytes), 0) FROM responses").fetchone()
+    except Exception:
+        entries, total = 0, 0
+    out["disk_entries"] = entries
+    out["disk_bytes"] = total
+    out["max_bytes"] = MAX_BYTES
+    out["ttl_seconds"] = TTL_SECONDS
+    out["path"] = CACHE_PATH
+    return out
@@ -0,0 +1,197 @@
+import os
+import re
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+import openai
+
+# Per provider ("openai", "groq"): at most LLM_MAX_CONCURRENCY requests in flight, and requests wait
+# for budget once the estimated tokens of the last minute reach LLM_TOKENS_PER_MINUTE (0 = no limit).
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", "8"))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get("LLM_TOKENS_PER_MINUTE", "60000"))
+
+try:
+    import tiktoken
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:  # optional: fall back to the approximation below
+    _encoding = None
+
+# Without tiktoken, text is split the way BPE vocabularies roughly do: letter runs in pieces of up to
+# 8, digits in groups of 3, every other non-space character on its own.
+_PIECE_RE = re.compile(r"[^\W\d_]{1,8}|\d{1,3}|[^\w\s]|_")
+
+
+def count_tokens(text: str) -> int:
+    """Token count of text: exact with tiktoken installed, otherwise a close estimate."""
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(_PIECE_RE.findall(text))
+
+
+def estimate_tokens(prompt: str, max_tokens: int = 0) -> int:
+    """Budget a request by its prompt tokens plus the completion it may produce."""
+    return count_tokens(prompt) + max_tokens
+
+
+class Limiter:
+    """Concurrency slots plus a token bucket refilled continuously at tokens_per_minute."""
+
+    def __init__(self, name: str, concurrency: int, tokens_per_minute: int):
+        self.name = name
+        self.concurrency = max(1, concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self._slots = threading.BoundedSemaphore(self.concurrency)
+        self._lock = threading.Lock()
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._active = 0
+        self.stats: Dict[str, Any] = {"calls": 0, "tokens": 0, "queued": 0, "wait_seconds": 0.0}
+
+    def _take(self, n: int) -> float:
+        if self.tokens_per_minute <= 0:
+            return 0.0
+        # a single request larger than the whole budget only waits for a full bucket
+        n = min(n, self.tokens_per_minute)
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._updated) * self.tokens_per_minute / 60.0)
+                self._updated = now
+                if self._tokens >= n:
+                    self._tokens -= n
+                    return waited
+                delay = (n - self._tokens) * 60.0 / self.tokens_per_minute
+            time.sleep(delay)
+            waited += delay
+
+    @contextmanager
+    def acquire(self, tokens: int):
+        """Hold one concurrency slot and `tokens` of budget for the duration of a request."""
+        t0 = time.monotonic()
+        self._take(tokens)
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["queued"] += 1
+            self._slots.acquire()
+        with self._lock:
+            self._active += 1
+            self.stats["calls"] += 1
+            self.stats["tokens"] += tokens
+            self.stats["wait_seconds"] += time.monotonic() - t0
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active -= 1
+            self._slots.release()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            out = dict(self.stats)
+            out["active"] = self._active
+            out["available_tokens"] = round(self._tokens) if self.tokens_per_minute > 0 else None
+        out["concurrency"] = self.concurrency
+        out["tokens_per_minute"] = self.tokens_per_minute
+        return out
+
+
+def _choice_text(resp: Any) -> str:
+    # normalize dict-like and object-like responses from old and new clients
+    if isinstance(resp, dict):
+        choices = resp.get('choices', [])
+    else:
+        choices = getattr(resp, 'choices', None) or []
+    if not choices:
+        return ''
+    choice = choices[0]
+    if isinstance(choice, dict):
+        msg = choice.get('message')
+        if isinstance(msg, dict) and msg.get('content'):
+            return msg.get('content', '')
+        return choice.get('text', '') or ''
+    msg = getattr(choice, 'message', None)
+    if isinstance(msg, dict) and msg.get('content'):
+        return msg.get('content', '')
+    if hasattr(msg, 'content'):
+        return getattr(msg, 'content', '') or ''
+    return getattr(choice, 'text', '') or ''
+
+
+class LLMGateway:
+    """Process-wide access to the LLM providers.
+
+    The OpenAI client is built once (and again only if OPENAI_API_KEY changes) and its chat surface is
+    resolved once by inspecting the client, so calls don't probe for methods by trial and error. Every
+    call, from the analysis jobs, /chat-with-papers/ or the RAG path, goes through the provider's Limiter.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client: Any = None
+        self._client_key: Optional[str] = None
+        self._create: Optional[Callable[..., Any]] = None
+        self.limiters = {name: Limiter(name, LLM_MAX_CONCURRENCY, LLM_TOKENS_PER_MINUTE) for name in ("openai", "groq")}
+
+    def _openai_create(self) -> Optional[Callable[..., Any]]:
+        key = os.environ.get("OPENAI_API_KEY")
+        if not key or not hasattr(openai, 'OpenAI'):
+            return None
+        with self._lock:
+            if self._client is None or self._client_key != key:
+                self._client = openai.OpenAI(api_key=key)
+                self._client_key = key
+                chat = getattr(self._client, 'chat', None)
+                completions = getattr(chat, 'completions', None)
+                self._create = getattr(completions, 'create', None) or getattr(chat, 'create', None)
+            return self._create
+
+    def warm(self) -> bool:
+        """Build the client and resolve the API surface up front (called at startup). No network calls."""
+        return self._openai_create() is not None
+
+    def openai_chat(self, messages: List[Dict[str, str]], model: str, max_tokens: int) -> str:
+        """Chat completion text; '' when no key/client is available. API errors propagate."""
+        create = self._openai_create()
+        if create is None:
+            return ''
+        tokens = estimate_tokens("".join(m.get("content", "") for m in messages), max_tokens)
+        with self.limiters["openai"].acquire(tokens):
+            return _choice_text(create(model=model, messages=messages, max_tokens=max_tokens))
+
+    def openai_chat_stream(self, messages: List[Dict[str, str]], model: str, max_tokens: int) -> Iterator[str]:
+        """Streamed chat completion pieces; yields nothing when no key/client is available."""
+        create = self._openai_create()
+        if create is None:
+            return
+        tokens = estimate_tokens("".join(m.get("content", "") for m in messages), max_tokens)
+        # the slot is held until the stream is consumed or closed
+        with self.limiters["openai"].acquire(tokens):
+            for chunk in create(model=model, messages=messages, max_tokens=max_tokens, stream=True):
+                choices = getattr(chunk, 'choices', None) or []
+                if not choices:
+                    continue
+                delta = getattr(choices[0], 'delta', None)
+                piece = getattr(delta, 'content', None) if delta is not None else None
+                if piece:
+                    yield piece
+
+    @contextmanager
+    def limit(self, provider: str, tokens: int):
+        """Run a provider call issued elsewhere (e.g. Groq over http_transport) under the gateway's limits."""
+        with self.limiters[provider].acquire(tokens):
+            yield
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "openai_client": self._client is not None,
+            "openai_surface": getattr(self._create, '__qualname__', None) if self._create else None,
+            "limits": {name: lim.snapshot() for name, lim in self.limiters.items()},
+        }
+
+
+gateway = LLMGateway()
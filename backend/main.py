@@ -1,28 +1,33 @@
 import os
 from dotenv import load_dotenv
-import uuid
 import json
-import shutil
 import traceback
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Sequence
 
 import os
-import uuid
 import json
-import shutil
 from typing import Dict, Any, List, Optional
 
-from fastapi import FastAPI, UploadFile, File, HTTPException, Body, Request
+from fastapi import FastAPI, HTTPException, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, PlainTextResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
 from starlette.staticfiles import StaticFiles
 
-import pdfplumber
 import openai
 
-from job_queue import start_job, get_job_status
-from chat_utils import extract_texts_from_files, build_ieee_reference_prompt
-from groq_rag import chunk_text, index_file_chunks, _call_groq_embeddings, search, _call_groq_generate
+import extract_cache
+from anchors import AnchorTable
+import pdf_ingest
+from job_queue import submit_job, get_job_status, QueueFullError, PRIORITIES, register_target, recover_jobs, report_progress, report_partial, iter_job_events
+from chat_utils import extract_texts_from_files, build_ieee_reference_prompt, build_ieee_retrieval_prompt, needs_map_reduce, paper_sections, build_section_summary_prompt, build_ieee_reduce_prompt, MAP_SUMMARY_TOKENS, MAP_PROMPT_VERSION
+import embed_cache
+import llm_cache
+import http_transport
+from llm_gateway import gateway
+import executors
+import uploads
+from executors import run_io, run_cpu
+from groq_rag import chunk_pages, CHUNK_MAX_TOKENS, CHARS_PER_TOKEN, index_file_chunks, index_manifest, matching_manifest, has_index, embed_texts, search, _call_groq_generate, _stream_groq_generate, index_cache_stats
 
 
 app = FastAPI()
@@ -48,109 +53,166 @@ app.mount("/uploaded_pdfs", StaticFiles(directory=UPLOAD_DIR), name="uploaded_pd
 
 load_dotenv(os.path.join(ROOT, '.env'))
 
-# Root endpoint for health checks (required by Hugging Face Spaces)
+@app.on_event("startup")
+def _recover_interrupted_jobs():
+    # with JOB_STORE=sqlite, pick up jobs left pending/running by a crashed or restarted worker
+    try:
+        recovered = recover_jobs()
+        if recovered:
+            print("recovered jobs:", recovered)
+    except Exception as e:
+        print("job recovery failed:", e)
+
+
+@app.on_event("startup")
+def _warm_llm_gateway():
+    # build the OpenAI client and resolve its chat API once, before the first request needs it
+    try:
+        gateway.warm()
+    except Exception as e:
+        print("llm gateway warm-up failed:", e)
+
+
+@app.on_event("shutdown")
+def _shutdown_executors():
+    executors.shutdown()
+
+
+# Root endpoint for health checks (required by Hugging Face Spaces); async and trivial, so it is
+# answered straight from the event loop while blocking work runs on the executors.
 @app.get("/")
-def read_root():
+async def read_root():
     return {"status": "ok", "message": "Backend is running"}
 
 
-def call_openai_chat(prompt: str) -> str:
+def _openai_params(prompt: str) -> Dict[str, Any]:
+    # everything that determines the answer, used as the response cache key
+    return {"model": os.environ.get("OPENAI_MODEL", "gpt-4o"), "system": "You are an academic assistant.",
+            "prompt": prompt, "max_tokens": 1500}
+
+
+def call_openai_chat(prompt: str, bypass_cache: bool = False) -> str:
     """Small wrapper that supports old and new openai python clients and returns text.
     Returns an empty string when no API key is set, or a string starting with
     '[OpenAI error:' on exception.
+
+    Answers are cached by model and prompt (llm_cache, errors excluded) and identical concurrent
+    prompts share one request; bypass_cache forces a fresh call.
     """
-    openai_key = os.environ.get("OPENAI_API_KEY")
-    if not openai_key:
+    if not os.environ.get("OPENAI_API_KEY"):
         return ""
-    # construct modern v1 client explicitly with api key and call the chat completions API
-    try:
-        if not hasattr(openai, 'OpenAI'):
-            return ""
-        try:
-            client = openai.OpenAI(api_key=openai_key)
-        except Exception:
-            client = openai.OpenAI()
+    return llm_cache.cached_call("openai-chat", _openai_params(prompt), lambda: _openai_chat(prompt), bypass=bypass_cache,
+                                 cacheable=lambda answer: not answer.startswith('[OpenAI error:'))
 
-        # prefer client.chat.create, fallback to client.chat.completions.create
-        resp = None
-        try:
-            resp = client.chat.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o"),
-                messages=[{"role": "system", "content": "You are an academic assistant."}, {"role": "user", "content": prompt}],
-                max_tokens=1500,
-            )
-        except Exception:
-            resp = client.chat.completions.create(
-                model=os.environ.get("OPENAI_MODEL", "gpt-4o"),
-                messages=[{"role": "system", "content": "You are an academic assistant."}, {"role": "user", "content": prompt}],
-                max_tokens=1500,
-            )
-
-        # normalize choices
-        choices = None
-        if isinstance(resp, dict):
-            choices = resp.get('choices', [])
-        else:
-            choices = getattr(resp, 'choices', None) or []
-
-        if not choices:
-            return ''
-        choice = choices[0]
-        # extract content robustly
-        if isinstance(choice, dict):
-            msg = choice.get('message')
-            if isinstance(msg, dict) and msg.get('content'):
-                return msg.get('content', '')
-            if choice.get('text'):
-                return choice.get('text', '')
-        else:
-            # object-like access
-            msg = getattr(choice, 'message', None)
-            if isinstance(msg, dict) and msg.get('content'):
-                return msg.get('content', '')
-            if hasattr(msg, 'content'):
-                return getattr(msg, 'content', '') or ''
-            if hasattr(choice, 'text'):
-                return getattr(choice, 'text', '') or ''
-        return ''
+
+def _openai_messages(prompt: str) -> List[Dict[str, str]]:
+    return [{"role": "system", "content": _openai_params(prompt)["system"]}, {"role": "user", "content": prompt}]
+
+
+def _openai_chat(prompt: str) -> str:
+    # the gateway owns the long-lived client and applies the shared concurrency/TPM limits
+    try:
+        params = _openai_params(prompt)
+        return gateway.openai_chat(_openai_messages(prompt), model=params["model"], max_tokens=params["max_tokens"])
     except Exception as e:
         return f"[OpenAI error: {e}]"
 
 
-def build_page_anchors_for_file(file_path: str, max_pages_per_file: int = 20) -> List[Dict[str, Any]]:
-    anchors: List[Dict[str, Any]] = []
+def stream_openai_chat(prompt: str, bypass_cache: bool = False):
+    """Streaming counterpart of call_openai_chat: yields answer text pieces as they arrive.
+    Yields nothing when no API key is set or the client is too old; raises on API errors.
+    A cached answer (shared with call_openai_chat) is yielded in one piece.
+    """
+    if not os.environ.get("OPENAI_API_KEY") or not hasattr(openai, 'OpenAI'):
+        return
+    yield from llm_cache.cached_stream("openai-chat", _openai_params(prompt), lambda: _openai_chat_stream(prompt), bypass=bypass_cache)
+
+
+def _openai_chat_stream(prompt: str):
+    params = _openai_params(prompt)
+    return gateway.openai_chat_stream(_openai_messages(prompt), model=params["model"], max_tokens=params["max_tokens"])
+
+
+def _sse(event: str, data: Any) -> str:
+    """Format one Server-Sent Event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_answer(pieces, fallback) -> Any:
+    """Forward generated pieces as 'token' events; if generation fails before producing anything,
+    send fallback() as a single token instead. Returns the full answer via StopIteration.value."""
+    parts: List[str] = []
     try:
-        with pdfplumber.open(file_path) as pdf:
-            for i, page in enumerate(pdf.pages[:max_pages_per_file]):
-                try:
-                    words = page.extract_words()
-                except Exception:
-                    words = []
-                if not words:
-                    continue
-                # create multiple anchors by grouping consecutive words to improve precision
-                page_width = float(getattr(page, 'width', 1.0)) or 1.0
-                page_height = float(getattr(page, 'height', 1.0)) or 1.0
-                group_size = 6
-                for g in range(0, len(words), group_size):
-                    group = words[g:g+group_size]
-                    try:
-                        x0 = min(float(w.get("x0", 0)) for w in group)
-                        x1 = max(float(w.get("x1", 0)) for w in group)
-                        top = min(float(w.get("top", 0)) for w in group)
-                        bottom = max(float(w.get("bottom", 0)) for w in group)
-                    except Exception:
-                        continue
-                    anchors.append({
-                        "id": len(anchors),
-                        "page": i + 1,
-                        "bbox": {"x0": x0, "y0": top, "x1": x1, "y1": bottom},
-                        "page_dim": {"width": page_width, "height": page_height},
-                        "bbox_norm": {"x0": x0 / page_width, "y0": top / page_height, "x1": x1 / page_width, "y1": bottom / page_height},
-                    })
+        for piece in pieces:
+            parts.append(piece)
+            yield _sse("token", {"text": piece})
+    except Exception as e:
+        if parts:
+            yield _sse("error", {"error": str(e)})
+        else:
+            print("streaming generation failed, using fallback:", e)
+    answer = "".join(parts)
+    if not answer:
+        answer = fallback()
+        if answer:
+            yield _sse("token", {"text": answer})
+    return answer
+
+
+def build_page_anchors_for_file(file_path: str) -> Optional[AnchorTable]:
+    """Return the word-group anchors for a PDF from its ingestion artifact (see pdf_ingest); anchors
+    exist for the first pdf_ingest.MAX_ANCHOR_PAGES pages."""
+    try:
+        return pdf_ingest.load_or_ingest(file_path).get("anchors")
     except Exception as e:
         print("build anchors error:", e)
-    return anchors
+        return None
+
+
+def _load_anchors(file_id: str) -> Optional[AnchorTable]:
+    """Anchors for an uploaded file: the cached columnar anchors first (without reading the page
+    text), then the legacy anchors_<file_id>.json written by older uploads. Returns None when neither exists.
+    """
+    table = pdf_ingest.load_anchor_table(os.path.join(UPLOAD_DIR, file_id))
+    if table is not None:
+        return table
+    anchors_path = os.path.join(UPLOAD_DIR, f"anchors_{file_id}.json")
+    if os.path.exists(anchors_path):
+        with open(anchors_path, "r", encoding="utf-8") as f:
+            return AnchorTable.from_dicts((json.load(f) or {}).get("anchors") or [])
+    return None
+
+
+def _anchors_etag(file_id: str, page: Optional[int]) -> Optional[str]:
+    # anchors are derived from the PDF bytes and the extractor version only
+    try:
+        sha = extract_cache.file_sha256(os.path.join(UPLOAD_DIR, file_id))
+    except OSError:
+        return None
+    return f'"{sha[:32]}-v{extract_cache.EXTRACTOR_VERSION}-p{page or 0}"'
+
+
+def _cited_anchors(table: Optional[AnchorTable], start: int, end: int, page: Optional[int] = None) -> Dict[str, Any]:
+    """{anchor_id, anchor_range} of the anchors covering a cited text range, given in document offsets
+    or, with page, in that page's text. Empty when there are no anchors or the range can't be located."""
+    if table is None:
+        return {}
+    span = table.covering_page(page, start, end) if page is not None else table.covering(start, end)
+    if span is None:
+        return {}
+    return {"anchor_id": span[0], "anchor_range": [span[0], span[1]]}
+
+
+def _try_load_anchors(file_id: str, info: Any = None) -> Optional[AnchorTable]:
+    try:
+        table = _load_anchors(file_id)
+    except Exception:
+        table = None
+    pages = info.get('pages') if isinstance(info, dict) else None
+    if table is None and isinstance(pages, pdf_ingest.LazyPages):
+        # not ingested as a whole yet: the anchors of the pages read so far
+        table = pages.anchor_table()
+    return table
 
 
 def _ensure_paper_texts_dict(paper_texts: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
@@ -162,6 +224,10 @@ def _ensure_paper_texts_dict(paper_texts: Dict[str, Any]) -> Dict[str, Dict[str,
         if isinstance(info, dict):
             title = info.get('title', fid)
             pages = info.get('pages', []) or []
+            if isinstance(pages, pdf_ingest.LazyPages):
+                # already strings; keep them lazy so only the pages that are read get extracted
+                normalized[fid] = {'title': title, 'pages': pages}
+                continue
             # ensure pages is a list of strings
             if not isinstance(pages, list):
                 pages = [str(pages)]
@@ -173,9 +239,11 @@ def _ensure_paper_texts_dict(paper_texts: Dict[str, Any]) -> Dict[str, Dict[str,
     return normalized
 
 
-def _pages_from_info(info: Any) -> List[str]:
+def _pages_from_info(info: Any) -> Sequence[str]:
     if isinstance(info, dict):
         pages = info.get('pages', []) or []
+        if isinstance(pages, pdf_ingest.LazyPages):
+            return pages
         if not isinstance(pages, list):
             return [str(pages)]
         return [str(p or '') for p in pages]
@@ -188,9 +256,11 @@ def _safe_title(info: Any, fallback: str = '') -> str:
     return str(fallback or info)
 
 
-def _safe_pages(info: Any) -> List[str]:
-    # reuse _pages_from_info semantics but ensure list of strings
+def _safe_pages(info: Any) -> Sequence[str]:
+    # reuse _pages_from_info semantics but ensure list of strings (lazy pages are returned as they are)
     pages = _pages_from_info(info)
+    if isinstance(pages, pdf_ingest.LazyPages):
+        return pages
     if not isinstance(pages, list):
         return [str(pages)]
     return [str(p or '') for p in pages]
@@ -250,57 +320,51 @@ def _normalize_files_list(files: Any) -> List[tuple]:
     return normalized
 
 
-@app.post("/upload/")
-async def upload_file(file: UploadFile = File(...)):
+@app.post("/upload/", openapi_extra={"requestBody": uploads.OPENAPI_REQUEST_BODY})
+async def upload_file(request: Request):
+    """Multipart upload with a `file` field. The PDF is streamed to disk under its SHA-256, so the
+    size limit is enforced while receiving and a duplicate upload returns the existing file id."""
     try:
-        ext = os.path.splitext(file.filename)[1] or ".pdf"
-        # Basic server-side validation
-        if ext.lower() != ".pdf" or (hasattr(file, 'content_type') and file.content_type and 'pdf' not in file.content_type.lower()):
-            raise HTTPException(status_code=400, detail="PDF files only, max 50MB each")
-
-        filename = f"{uuid.uuid4().hex}{ext}"
-        dest_path = os.path.join(UPLOAD_DIR, filename)
-        # Stream save to disk
-        with open(dest_path, "wb") as out_f:
-            shutil.copyfileobj(file.file, out_f)
-
-        # Enforce max size (50 MB)
-        try:
-            size = os.path.getsize(dest_path)
-            if size > 50 * 1024 * 1024:
-                try:
-                    os.remove(dest_path)
-                except Exception:
-                    pass
-                raise HTTPException(status_code=400, detail="PDF files only, max 50MB each")
-        except OSError:
-            # if size can't be determined, allow for now
-            pass
-
-        # build anchors and save
         try:
-            anchors = build_page_anchors_for_file(dest_path)
-            anchors_path = os.path.join(UPLOAD_DIR, f"anchors_{filename}.json")
-            with open(anchors_path, "w", encoding="utf-8") as af:
-                json.dump({"anchors": anchors}, af)
-        except Exception as e:
-            print("anchors save failed:", e)
+            saved = await uploads.receive_pdf(request, UPLOAD_DIR)
+        except uploads.UploadRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=str(e))
+        dest_path = saved["file_path"]
+        filename = saved["file_id"]
+
+        # single ingestion pass: page text and anchors are saved together as one cached artifact;
+        # a duplicate upload already has one, so only new content is ingested
+        if not (saved["duplicate"] and await run_io(pdf_ingest.load_artifact, dest_path) is not None):
+            try:
+                await run_cpu(pdf_ingest.load_or_ingest, dest_path)
+            except Exception as e:
+                print("ingestion failed:", e)
 
         public_url = f"/uploaded_pdfs/{filename}"
-        return {"file_path": dest_path, "public_url": public_url, "file_id": filename}
+        return {"file_path": dest_path, "public_url": public_url, "file_id": filename, "duplicate": saved["duplicate"]}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/anchors/{file_id}")
-async def get_anchors(file_id: str):
-    anchors_path = os.path.join(UPLOAD_DIR, f"anchors_{file_id}.json")
-    if not os.path.exists(anchors_path):
-        return {"anchors": []}
+async def get_anchors(file_id: str, request: Request, page: Optional[int] = None):
+    """Anchors of a file, or only of one page with ?page=N (what the viewer draws). Responses carry an
+    ETag; a matching If-None-Match gets 304 Not Modified."""
     try:
-        with open(anchors_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        return data
+        etag = await run_io(_anchors_etag, file_id, page)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+        if etag and etag in request.headers.get("if-none-match", ""):
+            return Response(status_code=304, headers=headers)
+        table = await run_io(_load_anchors, file_id)
+        if table is None:
+            pdf_path = os.path.join(UPLOAD_DIR, file_id)
+            if not os.path.exists(pdf_path):
+                return {"anchors": []}
+            table = await run_cpu(build_page_anchors_for_file, pdf_path)
+        anchors = table.to_dicts(page) if table is not None else []
+        return JSONResponse({"anchors": anchors}, headers=headers)
     except Exception as e:
         return {"anchors": [], "error": str(e)}
 
@@ -343,7 +407,7 @@ async def viewer_page(file_id: str):
         const ctx = canvas.getContext('2d');
         await page.render({canvasContext: ctx, viewport}).promise;
                 try {
-                    const res = await fetch(`/anchors/${fileId}`);
+                    const res = await fetch(`/anchors/${fileId}?page=${pageNumber}`);
                     const data = await res.json();
                     const anchors = data.anchors || [];
                     // read anchor query param
@@ -385,196 +449,268 @@ async def viewer_page(file_id: str):
     return HTMLResponse(content=html, status_code=200)
 
 
-def analyze_papers_job(files, links, user_query=None):
+def _keyword_excerpts(pages: Sequence[str], keyword_groups: List[List[str]], length: int = 600) -> List[str]:
+    """For each group of keywords (in order of preference), the `length` characters of
+    '\n\n'.join(pages) starting at the first occurrence of the first keyword that occurs, or ''.
+    Pages are read only until every group's preferred keyword has been found with `length`
+    characters after it, so with lazy pages most papers are not extracted to the end."""
+    text = ''
+    low = ''
+    found = [-1] * len(keyword_groups)
+    for n, page in enumerate(pages):
+        part = ('\n\n' if n else '') + page
+        scanned = len(low)
+        text += part
+        low += part.lower()
+        for g, keywords in enumerate(keyword_groups):
+            if found[g] < 0:
+                found[g] = low.find(keywords[0], max(0, scanned - len(keywords[0]) + 1))
+        if all(start >= 0 and len(text) >= start + length for start in found):
+            break
+    excerpts = []
+    for keywords in keyword_groups:
+        excerpt = ''
+        for kw in keywords:
+            start = low.find(kw)
+            if start >= 0:
+                excerpt = text[start:start+length].replace('\n', ' ').strip()
+                break
+        excerpts.append(excerpt)
+    return excerpts
+
+
+def _summarize_paper(fid: str, info: Any) -> Dict[str, Any]:
+    """Heuristic summary of one extracted paper: { text, reference, summary }."""
+    public_url = f"/uploaded_pdfs/{fid}"
+    pages = _safe_pages(info)
+    first_page = (pages[0] or '').strip() if pages else ''
+    # Improved heuristics:
+    # - Title: look for lines in the first page that are likely title (longer than 3 words and uppercase/capitalized)
+    # - Authors: lines after title up to a line that contains 'abstract' or is short/contains affiliation keywords
+    # - Abstract: locate 'abstract' token and take the paragraph after it
+    lines = [ln.strip() for ln in first_page.splitlines() if ln.strip()]
+    title = ''
+    authors = ''
+    abstract = ''
+    # find candidate title lines: prefer centered/capitalized lines (heuristic)
+    for idx_ln, ln in enumerate(lines[:8]):
+        words = ln.split()
+        if len(words) >= 3 and sum(1 for w in words if w[0].isupper()) / max(1, len(words)) > 0.5:
+            title = ln
+            title_idx = idx_ln
+            break
+    if not title and lines:
+        title = lines[0]
+        title_idx = 0
+
+    # authors: take following 1-3 lines until an 'abstract' marker or a long dash or affiliation keywords
+    author_lines = []
+    for ln in lines[title_idx+1:title_idx+6]:
+        lowln = ln.lower()
+        if any(k in lowln for k in ['abstract', 'introduction', 'keywords']):
+            break
+        if len(ln) < 200 and (',' in ln or ' and ' in ln or any(k in lowln for k in ['university', 'institute', 'lab', 'department', 'school'])):
+            author_lines.append(ln)
+        elif len(author_lines) == 0 and 2 <= len(ln.split()) <= 6:
+            # possible author line even without commas
+            author_lines.append(ln)
+        else:
+            # stop on long non-author content
+            if len(author_lines) > 0:
+                break
+    authors = '; '.join(author_lines)
+
+    # abstract: search 'abstract' token and extract following paragraph
+    lowfull = first_page.lower()
+    if 'abstract' in lowfull:
+        aidx = lowfull.find('abstract')
+        # take substring after the word 'abstract'
+        aft = first_page[aidx:]
+        # remove the header 'abstract' word and any colon
+        aft = aft.split('\n', 1)[-1] if '\n' in aft else aft
+        # heuristically take up to 1000 chars or until 'introduction'
+        cut = aft
+        li = cut.lower().find('introduction')
+        if li >= 0:
+            cut = cut[:li]
+        abstract = cut.replace('\n', ' ').strip()[:1200]
+    else:
+        # attempt to find an abstract-like paragraph within first 2 pages
+        joined = '\n\n'.join(pages[:2])
+        lowj = joined.lower()
+        if 'abstract' in lowj:
+            aidx = lowj.find('abstract')
+            cut = joined[aidx:]
+            li = cut.lower().find('introduction')
+            if li >= 0:
+                cut = cut[:li]
+            abstract = cut.replace('\n', ' ').strip()[:1200]
+
+    # create lightweight local summary from first page text
+    one_sentence = ''
+    if first_page:
+        # pick first 2 sentences as short summary
+        sents = first_page.replace('\n', ' ').split('.')
+        sents = [s.strip() for s in sents if s.strip()]
+        if sents:
+            one_sentence = (sents[0] + ('.' if not sents[0].endswith('.') else ''))
+            if len(sents) > 1:
+                one_sentence = one_sentence + ' ' + sents[1][:200] + ('.' if not sents[1].endswith('.') else '')
+
+    # look for simple keywords for methods/findings in the whole pages text
+    methods, findings = _keyword_excerpts(pages, [['methods', 'methodology', 'materials and methods', 'approach'],
+                                                  ['results', 'findings', 'conclusion', 'conclusions']])
+
+    # construct formatted summary for this paper
+    part_lines = []
+    part_lines.append(f"Title: {title}")
+    if authors:
+        part_lines.append(f"Authors: {authors}")
+    if abstract:
+        part_lines.append(f"Abstract (excerpt): {abstract[:800]}")
+    if one_sentence:
+        part_lines.append(f"One-line summary: {one_sentence}")
+    if methods:
+        part_lines.append(f"Methods (excerpt): {methods[:500]}")
+    if findings:
+        part_lines.append(f"Key findings (excerpt): {findings[:500]}")
+    part_lines.append(f"Link: {public_url}")
+    formatted = "\n".join(part_lines)
+
+    snippet = (pages[0] or '')[:250]
+    # look up the document's anchors and include nearest anchor id for better navigation
+    table = _try_load_anchors(fid, info)
+    # first anchor on page 1, straight from the page offsets
+    anchor_id = table.first_id(1) if table is not None else None
+
+    ref_entry = {"file_id": fid, "public_url": public_url,
+                 "pages": [{"page": 1, "snippet": snippet, **_cited_anchors(table, 0, len(snippet), page=1)}]}
+    if anchor_id is not None:
+        ref_entry['anchor_id'] = anchor_id
+    return {"text": formatted, "reference": ref_entry,
+            "summary": {"title": title, "authors": authors, "abstract": abstract, "one_line": one_sentence}}
+
+
+def _summarize_paper_file(item: tuple) -> Dict[str, Any]:
+    # the whole per-paper pipeline, run as one task: extraction (cached artifact or the shared
+    # process pool), heuristics and anchor lookup
+    fid, path = item
+    try:
+        paper_texts = extract_texts_from_files([(fid, path)])
+    except Exception as e:
+        paper_texts = {fid: {"title": fid, "pages": [f"[Error extracting file: {e}]"]}}
+    info = _ensure_paper_texts_dict(paper_texts).get(fid) or {"title": fid, "pages": [""]}
+    return _summarize_paper(fid, info)
+
+
+def _summarize_papers(files: List[tuple]) -> Dict[str, Any]:
+    """Summary branch of analyze_papers_job. Papers run through their pipelines concurrently on the
+    executors paper pool, so a job takes about as long as its slowest paper; each one is reported as
+    it finishes and the result is assembled in the original (IEEE) order."""
+    papers = list(dict(files).items())
+    entries: List[Optional[Dict[str, Any]]] = [None] * len(papers)
+    for done, (pos, entry) in enumerate(executors.map_as_completed(_summarize_paper_file, papers), start=1):
+        entries[pos] = entry
+        fid = papers[pos][0]
+        report_progress("summarizing", done, len(papers), file_id=fid)
+        # listeners on /job-events get each paper as soon as it is summarized
+        report_partial({"index": pos + 1, "file_id": fid, "text": entry["text"], "reference": entry["reference"], "summary": entry["summary"]})
+    refs = {i + 1: entry["reference"] for i, entry in enumerate(entries)}
+    summaries = {fid: entry["summary"] for (fid, _), entry in zip(papers, entries)}
+    formatted_text = "\n\n-----\n\n".join(entry["text"] for entry in entries)
+    return {"text": formatted_text, "references": refs, "summaries": summaries}
+
+
+def _summarize_section(text: str, sha256: str, no_cache: bool = False) -> str:
+    """Map step: question-independent summary of one paper section, cached by the section's content
+    hash, so later questions over the same papers reuse it. Errors come back as '[OpenAI error: ...]'."""
+    params = {"model": os.environ.get("OPENAI_MODEL", "gpt-4o"), "version": MAP_PROMPT_VERSION,
+              "section_sha256": sha256, "max_tokens": MAP_SUMMARY_TOKENS}
+
+    def call() -> str:
+        try:
+            return gateway.openai_chat(_openai_messages(build_section_summary_prompt(text)), model=params["model"], max_tokens=MAP_SUMMARY_TOKENS)
+        except Exception as e:
+            return f"[OpenAI error: {e}]"
+    return llm_cache.cached_call("openai-map", params, call, bypass=no_cache,
+                                 cacheable=lambda summary: not summary.startswith('[OpenAI error:'))
+
+
+def _map_reduce_prompt(paper_texts: Dict[str, Dict[str, Any]], user_query: str, no_cache: bool = False) -> str:
+    """Summarize every section of every paper (at most HTTP_MAX_IN_FLIGHT calls at once, within the
+    gateway's limits) and build the cited reduce prompt from the summaries. A section whose summary
+    failed is represented by the start of its text instead."""
+    for info in paper_texts.values():
+        pages = info.get('pages') if isinstance(info, dict) else None
+        if isinstance(pages, pdf_ingest.LazyPages):
+            # every section is summarized: extract whatever hasn't been read yet in one pooled pass
+            pages.load()
+    sections = [(pos, section) for pos, info in enumerate(paper_texts.values()) for section in paper_sections(info)]
+    report_progress("mapping", 0, len(sections))
+    summaries = http_transport.map_ordered(lambda item: _summarize_section(item[1]["text"], item[1]["sha256"], no_cache), sections,
+                                           progress=lambda done, total: report_progress("mapping", done, total))
+    papers = [(_safe_title(info, fid), []) for fid, info in paper_texts.items()]
+    for (pos, section), summary in zip(sections, summaries):
+        if not summary or summary.startswith('[OpenAI error:'):
+            summary = section["text"][:MAP_SUMMARY_TOKENS * CHARS_PER_TOKEN].replace('\n', ' ') + '...'
+        papers[pos][1].append((section, summary))
+    return build_ieee_reduce_prompt(papers, user_query)
+
+
+def analyze_papers_job(files, links, user_query=None, no_cache=False):
     # files: list of (file_id, file_path)
     files = _normalize_files_list(files)
+    if not user_query:
+        return _summarize_papers(files)
     try:
-        paper_texts = extract_texts_from_files(files)
+        paper_texts = extract_texts_from_files(files, progress=lambda i, n, fid: report_progress("extracting", i, n, file_id=fid))
     except Exception as e:
         # defensive: if extractor fails, build minimal dict entries so callers can use .get safely
         paper_texts = {fid: {"title": fid, "pages": [f"[Error extracting file: {e}]"]} for fid, _ in files}
     paper_texts = _ensure_paper_texts_dict(paper_texts)
-    combined = []
-    for fid, info in paper_texts.items():
-        # use safe accessors to avoid AttributeError when info is a string
-        title = _safe_title(info, '')
-        pages = _safe_pages(info)
-        combined.append(f"[{fid}] {title}: " + " ".join(pages[:3]))
-    all_text = "\n\n".join(combined)
 
-    # set OpenAI key if provided
-    openai_key = os.environ.get("OPENAI_API_KEY")
-    # note: v1 client is constructed inside call_openai_chat with api_key
-
-    # use module-level call_openai_chat
-
-    if user_query:
-        prompt = build_ieee_reference_prompt(paper_texts, user_query)
-        answer = call_openai_chat(prompt)
-        if not answer or answer.startswith('[OpenAI error:'):
-            # fallback to local snippet summary
-            snippets = []
-            for fid, info in paper_texts.items():
-                if isinstance(info, dict):
-                    first = (_safe_pages(info)[0] or '').strip()
-                else:
-                    first = str(info)[:400]
-                snippets.append(f"[{fid}] " + (first[:400] + ('...' if len(first) > 400 else '')))
-            answer = "\n\n".join(snippets) or "[No text available]"
-
-        refs = {}
-        for i, (fid, info) in enumerate(paper_texts.items()):
-            public_url = f"/uploaded_pdfs/{fid}"
-            page_snippets = []
-            pages_iter = _safe_pages(info)
-            for pi, page_text in enumerate(pages_iter):
-                if not page_text:
-                    continue
-                snippet = str(page_text).strip().replace('\n',' ')[:250]
-                page_snippets.append({"page": pi+1, "snippet": snippet})
-                if len(page_snippets) >= 3:
-                    break
-            refs[i+1] = {"file_id": fid, "public_url": public_url, "pages": page_snippets}
-        return {"answer": answer, "references": refs}
+    if os.environ.get("OPENAI_API_KEY") and needs_map_reduce(paper_texts):
+        # too long for one prompt without cutting papers short: answer from section summaries
+        prompt = _map_reduce_prompt(paper_texts, user_query, no_cache)
     else:
-        refs = {}
-        summaries = {}
-        formatted_parts = []
-        for i, (fid, info) in enumerate(paper_texts.items()):
-            public_url = f"/uploaded_pdfs/{fid}"
-            pages = _safe_pages(info)
-            first_page = (pages[0] or '').strip() if pages else ''
-            # Improved heuristics:
-            # - Title: look for lines in the first page that are likely title (longer than 3 words and uppercase/capitalized)
-            # - Authors: lines after title up to a line that contains 'abstract' or is short/contains affiliation keywords
-            # - Abstract: locate 'abstract' token and take the paragraph after it
-            lines = [ln.strip() for ln in first_page.splitlines() if ln.strip()]
-            title = ''
-            authors = ''
-            abstract = ''
-            # find candidate title lines: prefer centered/capitalized lines (heuristic)
-            for idx_ln, ln in enumerate(lines[:8]):
-                words = ln.split()
-                if len(words) >= 3 and sum(1 for w in words if w[0].isupper()) / max(1, len(words)) > 0.5:
-                    title = ln
-                    title_idx = idx_ln
-                    break
-            if not title and lines:
-                title = lines[0]
-                title_idx = 0
-
-            # authors: take following 1-3 lines until an 'abstract' marker or a long dash or affiliation keywords
-            author_lines = []
-            for ln in lines[title_idx+1:title_idx+6]:
-                lowln = ln.lower()
-                if any(k in lowln for k in ['abstract', 'introduction', 'keywords']):
-                    break
-                if len(ln) < 200 and (',' in ln or ' and ' in ln or any(k in lowln for k in ['university', 'institute', 'lab', 'department', 'school'])):
-                    author_lines.append(ln)
-                elif len(author_lines) == 0 and 2 <= len(ln.split()) <= 6:
-                    # possible author line even without commas
-                    author_lines.append(ln)
-                else:
-                    # stop on long non-author content
-                    if len(author_lines) > 0:
-                        break
-            authors = '; '.join(author_lines)
-
-            # abstract: search 'abstract' token and extract following paragraph
-            lowfull = first_page.lower()
-            if 'abstract' in lowfull:
-                aidx = lowfull.find('abstract')
-                # take substring after the word 'abstract'
-                aft = first_page[aidx:]
-                # remove the header 'abstract' word and any colon
-                aft = aft.split('\n', 1)[-1] if '\n' in aft else aft
-                # heuristically take up to 1000 chars or until 'introduction'
-                cut = aft
-                li = cut.lower().find('introduction')
-                if li >= 0:
-                    cut = cut[:li]
-                abstract = cut.replace('\n', ' ').strip()[:1200]
+        prompt = build_ieee_reference_prompt(paper_texts, user_query)
+    report_progress("answering")
+    answer = call_openai_chat(prompt, bypass_cache=no_cache)
+    if not answer or answer.startswith('[OpenAI error:'):
+        # fallback to local snippet summary
+        snippets = []
+        for fid, info in paper_texts.items():
+            if isinstance(info, dict):
+                first = (_safe_pages(info)[0] or '').strip()
             else:
-                # attempt to find an abstract-like paragraph within first 2 pages
-                joined = '\n\n'.join(pages[:2])
-                lowj = joined.lower()
-                if 'abstract' in lowj:
-                    aidx = lowj.find('abstract')
-                    cut = joined[aidx:]
-                    li = cut.lower().find('introduction')
-                    if li >= 0:
-                        cut = cut[:li]
-                    abstract = cut.replace('\n', ' ').strip()[:1200]
-
-            # create lightweight local summary from first page text
-            one_sentence = ''
-            if first_page:
-                # pick first 2 sentences as short summary
-                sents = first_page.replace('\n', ' ').split('.')
-                sents = [s.strip() for s in sents if s.strip()]
-                if sents:
-                    one_sentence = (sents[0] + ('.' if not sents[0].endswith('.') else ''))
-                    if len(sents) > 1:
-                        one_sentence = one_sentence + ' ' + sents[1][:200] + ('.' if not sents[1].endswith('.') else '')
-
-            methods = ''
-            findings = ''
-            # look for simple keywords for methods/findings in the whole pages text
-            full_text = '\n\n'.join(pages)
-            lowfull = full_text.lower()
-            for kw in ['methods', 'methodology', 'materials and methods', 'approach']:
-                if kw in lowfull:
-                    start = lowfull.find(kw)
-                    methods = full_text[start:start+600].replace('\n', ' ').strip()
-                    break
-            for kw in ['results', 'findings', 'conclusion', 'conclusions']:
-                if kw in lowfull:
-                    start = lowfull.find(kw)
-                    findings = full_text[start:start+600].replace('\n', ' ').strip()
-                    break
-
-            # construct formatted summary for this paper
-            part_lines = []
-            part_lines.append(f"Title: {title}")
-            if authors:
-                part_lines.append(f"Authors: {authors}")
-            if abstract:
-                part_lines.append(f"Abstract (excerpt): {abstract[:800]}")
-            if one_sentence:
-                part_lines.append(f"One-line summary: {one_sentence}")
-            if methods:
-                part_lines.append(f"Methods (excerpt): {methods[:500]}")
-            if findings:
-                part_lines.append(f"Key findings (excerpt): {findings[:500]}")
-            part_lines.append(f"Link: {public_url}")
-            formatted = "\n".join(part_lines)
-            formatted_parts.append(formatted)
-
-            snippet = (pages[0] or '')[:250]
-            # try to find anchors file and include nearest anchor id for better navigation
-            anchors_path = os.path.join(UPLOAD_DIR, f"anchors_{fid}.json")
-            anchor_id = None
-            try:
-                if os.path.exists(anchors_path):
-                    with open(anchors_path, 'r', encoding='utf-8') as af:
-                        data = json.load(af)
-                        anchors_list = data.get('anchors') or []
-                        # pick first anchor on page 1 if present
-                        for a in anchors_list:
-                            if a.get('page') == 1:
-                                anchor_id = a.get('id')
-                                break
-            except Exception:
-                anchor_id = None
+                first = str(info)[:400]
+            snippets.append(f"[{fid}] " + (first[:400] + ('...' if len(first) > 400 else '')))
+        answer = "\n\n".join(snippets) or "[No text available]"
+
+    refs = {}
+    for i, (fid, info) in enumerate(paper_texts.items()):
+        public_url = f"/uploaded_pdfs/{fid}"
+        page_snippets = []
+        starts = []
+        pages_iter = _safe_pages(info)
+        for pi, page_text in enumerate(pages_iter):
+            if not page_text:
+                continue
+            page_text = str(page_text)
+            snippet = page_text.strip().replace('\n',' ')[:250]
+            page_snippets.append({"page": pi+1, "snippet": snippet})
+            # where the snippet starts in the page text, for the anchors it covers
+            starts.append(len(page_text) - len(page_text.lstrip()))
+            if len(page_snippets) >= 3:
+                break
+        table = _try_load_anchors(fid, info)
+        for entry, start in zip(page_snippets, starts):
+            entry.update(_cited_anchors(table, start, start + len(entry["snippet"]), page=entry["page"]))
+        refs[i+1] = {"file_id": fid, "public_url": public_url, "pages": page_snippets}
+    return {"answer": answer, "references": refs}
 
-            ref_entry = {"file_id": fid, "public_url": public_url, "pages": [{"page": 1, "snippet": snippet}]}
-            if anchor_id is not None:
-                ref_entry['anchor_id'] = anchor_id
-            refs[i+1] = ref_entry
-            summaries[fid] = {"title": title, "authors": authors, "abstract": abstract, "one_line": one_sentence}
 
-        formatted_text = "\n\n-----\n\n".join(formatted_parts) if formatted_parts else all_text
-        return {"text": formatted_text, "references": refs, "summaries": summaries}
+register_target(analyze_papers_job)
 
 
 @app.post("/start-analysis-job/")
@@ -591,7 +727,16 @@ async def start_analysis_job(req: Dict = Body(...)):
     # files expected as {file_id: file_path}
     # normalize files into list of tuples before starting job
     job_files = _normalize_files_list(files)
-    job_id = start_job(analyze_papers_job, job_files, links, user_query)
+    # questions are interactive and run ahead of queued bulk summaries unless the client says otherwise
+    priority = req.get('priority')
+    if priority not in PRIORITIES:
+        priority = 'interactive' if user_query else 'bulk'
+    try:
+        # no_cache: skip cached LLM answers for this request (they are refreshed instead)
+        kwargs = {"no_cache": True} if req.get('no_cache') else {}
+        job_id = submit_job(analyze_papers_job, (job_files, links, user_query), kwargs, priority=priority)
+    except QueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
     return {"job_id": job_id}
 
 
@@ -607,7 +752,7 @@ async def start_analysis_job_sync(req: Dict = Body(...)):
     links = req.get('links', [])
     user_query = req.get('user_query')
     try:
-        res = analyze_papers_job(_normalize_files_list(files), links, user_query)
+        res = await run_cpu(analyze_papers_job, _normalize_files_list(files), links, user_query, bool(req.get('no_cache')))
         return {"status": "ok", "result": res}
     except Exception as e:
         import traceback as _tb
@@ -615,19 +760,115 @@ async def start_analysis_job_sync(req: Dict = Body(...)):
 
 
 @app.get("/job-status/{job_id}")
-async def job_status(job_id: str):
-    return get_job_status(job_id)
+async def job_status(job_id: str, full: bool = False):
+    """Compact job status by default; ?full=1 includes the (possibly large) result."""
+    return await run_io(get_job_status, job_id, full=full)
+
+
+def _job_event_stream(job_id: str, after: int):
+    for ev in iter_job_events(job_id, after=after):
+        if ev is None:
+            # SSE comment line keeps proxies from closing an idle stream
+            yield ": keep-alive\n\n"
+            continue
+        status = ev["data"].get("status") if ev["event"] == "status" else None
+        prefix = f"id: {ev['seq']}\n" if ev.get("seq") else ""
+        yield prefix + _sse(ev["event"], ev["data"])
+        if status == "completed":
+            # the final result is sent once, read from the job store rather than kept in the event log
+            yield _sse("result", get_job_status(job_id, full=True).get("result"))
+
+
+@app.get("/job-events/{job_id}")
+async def job_events(job_id: str, request: Request):
+    """Server-Sent Events for a job, instead of polling /job-status: 'status' (pending/running/completed/failed),
+    'progress' ({stage, current, total, file_id}) and 'partial' (one paper's summary as it finishes), then
+    'result' with the final result once the job completes. Reconnecting clients resume via Last-Event-ID."""
+    try:
+        after = int(request.headers.get("last-event-id") or 0)
+    except ValueError:
+        after = 0
+    return StreamingResponse(_job_event_stream(job_id, after), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @app.get("/debug/job/{job_id}")
 async def debug_job(job_id: str):
     """Development-only endpoint to return the raw job dict including traceback."""
-    import job_queue
-    return job_queue.jobs.get(job_id, {"status": "not_found"})
+    return await run_io(get_job_status, job_id, full=True)
+
+
+@app.get("/debug/extract-cache")
+async def debug_extract_cache():
+    """Development-only endpoint reporting page-text cache hit/miss counters and size."""
+    return await run_io(extract_cache.stats)
+
+
+@app.get("/debug/index-cache")
+async def debug_index_cache():
+    """Development-only endpoint reporting the loaded-index cache hit rate and resident bytes."""
+    return index_cache_stats()
+
+
+@app.get("/debug/llm-cache")
+async def debug_llm_cache():
+    """Development-only endpoint reporting LLM response cache hits (memory/disk), misses, coalesced calls and size."""
+    return await run_io(llm_cache.stats)
+
+
+@app.get("/debug/llm-gateway")
+async def debug_llm_gateway():
+    """Development-only endpoint reporting the LLM gateway's client state and per-provider queueing."""
+    return gateway.stats()
+
+
+@app.get("/debug/embedding-cache")
+async def debug_embedding_cache():
+    """Development-only endpoint reporting embedding cache hits, misses and size."""
+    return await run_io(embed_cache.stats)
+
+
+def _fallback_answer(paper_texts: Dict[str, Any]) -> str:
+    snippets = []
+    for fid, info in paper_texts.items():
+        first = (_safe_pages(info)[0] or '').strip()
+        snippets.append(f"[{fid}] " + (first[:400] + ('...' if len(first) > 400 else '')))
+    return "\n\n".join(snippets)
+
+
+def _chat_refs(paper_files: Any) -> Dict[int, Dict[str, Any]]:
+    refs = {}
+    for i, fid in enumerate(paper_files.keys()):
+        refs[i+1] = {"file_id": fid, "public_url": f"/uploaded_pdfs/{fid}", "pages": [{"page": 1}]}
+    return refs
+
+
+def _chat_paper_texts(files_for_extraction: List[tuple]) -> Dict[str, Dict[str, Any]]:
+    """Paper texts for /chat-with-papers/. Indexed papers stay lazy, since their passages come from
+    the index. Unindexed ones get chunked page by page for retrieval, so all of their pages are
+    extracted up front, together on the process pool."""
+    unindexed = [(fid, path) for fid, path in files_for_extraction if not has_index(fid)]
+    texts = extract_texts_from_files([(fid, path) for fid, path in files_for_extraction if (fid, path) not in unindexed])
+    texts.update(extract_texts_from_files(unindexed, lazy=False))
+    # keep the request's order, which the [n] references follow
+    return _ensure_paper_texts_dict({fid: texts[fid] for fid, _ in files_for_extraction if fid in texts})
+
+
+def _stream_chat_with_papers(user_query: str, paper_files: Any, files_for_extraction: List[tuple], no_cache: bool = False):
+    # references only depend on the request, so the UI can render citations before any extraction
+    refs = _chat_refs(paper_files)
+    yield _sse("refs", {"references": refs})
+    paper_texts = _chat_paper_texts(files_for_extraction)
+    prompt = build_ieee_retrieval_prompt(paper_texts, user_query)
+    answer = yield from _stream_answer(stream_openai_chat(prompt, bypass_cache=no_cache), lambda: _fallback_answer(paper_texts))
+    yield _sse("done", {"answer": answer, "references": refs})
 
 
 @app.post("/chat-with-papers/")
 async def chat_with_papers(req: Dict = Body(...)):
+    """Body: { user_query: str, paper_files: {file_id: path}, stream?: bool, no_cache?: bool }. With stream=true
+    the answer is sent as Server-Sent Events: 'refs' first, then 'token' events, then 'done' with the full answer.
+    no_cache=true skips the LLM response cache (the cached answer is refreshed)."""
     # coerce body to mapping to avoid AttributeError when clients send malformed bodies
     if not isinstance(req, dict):
         try:
@@ -636,65 +877,140 @@ async def chat_with_papers(req: Dict = Body(...)):
             req = {}
     user_query = req.get('user_query', '')
     paper_files = req.get('paper_files', {})
+    no_cache = bool(req.get('no_cache'))
     # Normalize incoming paper_files (accepts public URLs like '/uploaded_pdfs/x.pdf' or http(s) URLs)
     files_for_extraction = _normalize_files_list(paper_files)
+    if req.get('stream'):
+        return StreamingResponse(_stream_chat_with_papers(user_query, paper_files, files_for_extraction, no_cache), media_type="text/event-stream")
 
-    paper_texts = extract_texts_from_files(files_for_extraction)
-    paper_texts = _ensure_paper_texts_dict(paper_texts)
-    prompt = build_ieee_reference_prompt(paper_texts, user_query)
+    paper_texts = await run_cpu(_chat_paper_texts, files_for_extraction)
+    # the passages most relevant to the question, within a shared token budget
+    prompt = await run_cpu(build_ieee_retrieval_prompt, paper_texts, user_query)
 
     openai_key = os.environ.get("OPENAI_API_KEY")
     if openai_key:
         openai.api_key = openai_key
 
     # call the module-level OpenAI wrapper
-    answer = call_openai_chat(prompt)
+    answer = await run_io(call_openai_chat, prompt, no_cache)
     if not answer or answer.startswith('[OpenAI error:'):
-        snippets = []
-        for fid, info in paper_texts.items():
-            first = (_safe_pages(info)[0] or '').strip()
-            snippets.append(f"[{fid}] " + (first[:400] + ('...' if len(first) > 400 else '')))
-        answer = "\n\n".join(snippets) or answer
+        answer = _fallback_answer(paper_texts) or answer
 
-    refs = {}
-    for i, fid in enumerate(paper_files.keys()):
-        refs[i+1] = {"file_id": fid, "public_url": f"/uploaded_pdfs/{fid}", "pages": [{"page": 1}]}
+    return {"answer": answer, "references": _chat_refs(paper_files)}
 
-    return {"answer": answer, "references": refs}
+
+def _index_paper(fid: str, info: Any, max_tokens: int, manifest: Optional[Dict[str, Any]] = None) -> int:
+    pages = _safe_pages(info)
+    if any(str(p).startswith("[Error extracting") for p in pages[:1]):
+        # don't record a manifest for a failed extraction, so the file is retried next time
+        manifest = None
+    # sentence-aligned chunks that remember their pages, text offsets and overlapping anchors
+    chunks = list(chunk_pages(pages, _load_anchors(fid), max_tokens=max_tokens, overlap_tokens=max_tokens // 4))
+    title = _safe_title(info, fid)
+    metas = [{"file_id": fid, "page": c["page_start"], "page_start": c["page_start"], "page_end": c["page_end"],
+              "char_start": c["char_start"], "char_end": c["char_end"], "anchor_ids": c["anchor_ids"],
+              "source": fid, "title": title} for c in chunks]
+    return index_file_chunks(fid, [c["text"] for c in chunks], metas, manifest=manifest)
+
+
+def _index_manifest_for(path: str, max_tokens: int) -> Optional[Dict[str, Any]]:
+    # the content hash is memoized per (path, size, mtime), so checking an unchanged file is cheap
+    try:
+        sha = extract_cache.file_sha256(path)
+    except Exception:
+        return None
+    return index_manifest(sha, max_tokens, max_tokens // 4, extract_cache.EXTRACTOR_VERSION)
+
+
+def _current_index(fid: str, path: str, max_tokens: int):
+    manifest = _index_manifest_for(path, max_tokens)
+    stored = matching_manifest(fid, manifest) if manifest else None
+    return manifest, stored
 
 
 @app.post("/index-papers/")
 async def index_papers(req: Dict = Body(...)):
-    """Index uploaded papers for RAG. Body: { files: {file_id: file_path}, chunk_size?:int }"""
+    """Index uploaded papers for RAG. Body: { files: {file_id: file_path}, chunk_tokens?: int, chunk_size?: int }
+    chunk_size (characters, legacy) is converted to a token budget when chunk_tokens isn't given.
+    Files whose content, chunking parameters and embedding model match their index manifest are skipped."""
     if not isinstance(req, dict):
         try:
             req = json.loads(req) if isinstance(req, str) else dict(req)
         except Exception:
             req = {}
     files = req.get('files', {})
-    chunk_size = int(req.get('chunk_size') or 800)
+    chunk_tokens = int(req.get('chunk_tokens') or 0) or (int(req.get('chunk_size') or 0) // CHARS_PER_TOKEN) or CHUNK_MAX_TOKENS
     files_list = _normalize_files_list(files)
-    # extract texts
-    paper_texts = extract_texts_from_files(files_list)
-    paper_texts = _ensure_paper_texts_dict(paper_texts)
     results = {}
+    manifests = {}
+    todo = []
+    for fid, path in files_list:
+        manifest, stored = await run_io(_current_index, fid, str(path), chunk_tokens)
+        if stored is not None:
+            results[fid] = {"chunks_indexed": stored.get("chunks", 0), "unchanged": True}
+        else:
+            manifests[fid] = manifest
+            todo.append((fid, path))
+    if not todo:
+        return {"status": "ok", "results": results}
+    # extract texts (only for files that need indexing)
+    # chunking reads every page, so extract them all up front (pooled across files)
+    paper_texts = await run_cpu(extract_texts_from_files, todo, lazy=False)
+    paper_texts = _ensure_paper_texts_dict(paper_texts)
     for fid, info in paper_texts.items():
-        pages = _safe_pages(info)
-        # join pages into a single text for chunking, but keep page metadata
-        joined = '\n\n'.join([p for p in pages if p])
-        chunks = chunk_text(joined, chunk_size=chunk_size, overlap=int(chunk_size*0.25))
-        metas = [{"file_id": fid, "page": None, "source": fid, "title": _safe_title(info, fid)} for _ in chunks]
         try:
-            count = index_file_chunks(fid, chunks, metas)
+            # chunking is cheap next to the embedding calls, so the whole step runs on the IO pool
+            count = await run_io(_index_paper, fid, info, chunk_tokens, manifests.get(fid))
             results[fid] = {"chunks_indexed": count}
         except Exception as e:
             results[fid] = {"error": str(e)}
     return {"status": "ok", "results": results}
 
 
+def _rag_prompt_and_refs(user_query: str, file_ids: List[str], nprobe: Optional[int] = None):
+    """Embed the query, retrieve the top chunks and build the cited RAG prompt. Returns (prompt, ref_map)."""
+    query_emb = embed_texts([user_query])[0]
+    # hybrid vector + BM25 search (nprobe only matters once the corpus is large enough for the IVF index)
+    hits = search(file_ids, query_emb, top_k=6, nprobe=nprobe, query_text=user_query)
+    # build prompt
+    snippets = []
+    ref_map = {}
+    tables: Dict[str, Optional[AnchorTable]] = {}
+    for i, h in enumerate(hits, start=1):
+        meta = h.get('meta') or {}
+        fid = meta.get('file_id') or meta.get('source') or 'unknown'
+        # RAG prompt has a max length, so we truncate the snippets
+        # and remove newlines for better formatting.
+        text_snippet = (h.get('text') or '')[:400].replace('\n', ' ')
+        snippets.append(f"[{i}] {fid}: \"{text_snippet}\"")
+        ref_map[i] = {"file_id": fid, "meta": meta}
+        if meta.get('char_start') is not None and meta.get('char_end') is not None:
+            # the chunk's offsets in the document text -> the anchors to highlight for this citation
+            if fid not in tables:
+                tables[fid] = _try_load_anchors(fid)
+            ref_map[i].update(_cited_anchors(tables[fid], int(meta['char_start']), int(meta['char_end'])))
+    prompt = "You are an assistant. Use only the snippets below to answer the user's question. Cite snippets using numbered brackets like [1].\n\nSnippets:\n" + "\n".join(snippets) + f"\n\nUser question: {user_query}\n\nAnswer concisely and include citation brackets."
+    return prompt, ref_map
+
+
+def _stream_chat_with_papers_rag(user_query: str, file_ids: List[str], nprobe: Optional[int], no_cache: bool = False):
+    try:
+        prompt, ref_map = _rag_prompt_and_refs(user_query, file_ids, nprobe)
+    except Exception as e:
+        yield _sse("error", {"error": f"Embedding error: {e}"})
+        return
+    # the reference map is known before generation starts, so citations can render immediately
+    yield _sse("refs", {"references": ref_map})
+    answer = yield from _stream_answer(_stream_groq_generate(prompt, bypass_cache=no_cache), lambda: "")
+    yield _sse("done", {"answer": answer, "references": ref_map})
+
+
 @app.post("/chat-with-papers-rag/")
 async def chat_with_papers_rag(req: Dict = Body(...)):
-    """RAG-based chat using Groq embeddings and generation. Body: { user_query: str, paper_files: {file_id: path} }"""
+    """RAG-based chat using Groq embeddings and generation.
+    Body: { user_query: str, paper_files: {file_id: path}, nprobe?: int, stream?: bool, no_cache?: bool }. With
+    stream=true the answer is sent as Server-Sent Events: 'refs' first, then 'token' events, then 'done' with the
+    full answer. no_cache=true skips the LLM response cache (the cached answer is refreshed)."""
     if not isinstance(req, dict):
         try:
             req = json.loads(req) if isinstance(req, str) else dict(req)
@@ -704,27 +1020,16 @@ async def chat_with_papers_rag(req: Dict = Body(...)):
     paper_files = req.get('paper_files', {})
     files_list = _normalize_files_list(paper_files)
     file_ids = [fid for fid, _ in files_list]
-    # embed query
+    nprobe = int(req.get('nprobe') or 0) or None
+    no_cache = bool(req.get('no_cache'))
+    if req.get('stream'):
+        return StreamingResponse(_stream_chat_with_papers_rag(user_query, file_ids, nprobe, no_cache), media_type="text/event-stream")
     try:
-        query_emb = _call_groq_embeddings([user_query])[0]
+        prompt, ref_map = await run_io(_rag_prompt_and_refs, user_query, file_ids, nprobe)
     except Exception as e:
         return {"error": f"Embedding error: {e}"}
-    # search
-    hits = search(file_ids, query_emb, top_k=6)
-    # build prompt
-    snippets = []
-    ref_map = {}
-    for i, h in enumerate(hits, start=1):
-        meta = h.get('meta') or {}
-        fid = meta.get('file_id') or meta.get('source') or 'unknown'
-        # RAG prompt has a max length, so we truncate the snippets
-        # and remove newlines for better formatting.
-        text_snippet = (h.get('text') or '')[:400].replace('\n', ' ')
-        snippets.append(f"[{i}] {fid}: \"{text_snippet}\"")
-        ref_map[i] = {"file_id": fid, "meta": meta}
-    prompt = "You are an assistant. Use only the snippets below to answer the user's question. Cite snippets using numbered brackets like [1].\n\nSnippets:\n" + "\n".join(snippets) + f"\n\nUser question: {user_query}\n\nAnswer concisely and include citation brackets."
     try:
-        answer = _call_groq_generate(prompt)
+        answer = await run_io(_call_groq_generate, prompt, no_cache)
     except Exception as e:
         return {"error": f"Generation error: {e}", "refs": ref_map}
     return {"answer": answer, "references": ref_map}
@@ -0,0 +1,423 @@
+import os
+import threading
+import multiprocessing
+from collections.abc import Sequence
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Callable, Optional, Tuple
+
+import pdfplumber
+from pdfplumber.utils import cluster_objects
+
+import anchors
+import extract_cache
+
+# Anchors are only built for the first pages, matching what the viewer links to.
+MAX_ANCHOR_PAGES = 20
+ANCHOR_GROUP_SIZE = 6
+
+# Page extraction is CPU-bound pure Python, so it is spread over a process pool.
+# EXTRACT_WORKERS=1 disables the pool; 0/unset uses one worker per core.
+EXTRACT_WORKERS = int(os.environ.get("EXTRACT_WORKERS", "0")) or (os.cpu_count() or 1)
+# Pages handled per pool task; each task re-opens the PDF, so very small ranges waste time on parsing the page tree.
+EXTRACT_PAGES_PER_TASK = max(1, int(os.environ.get("EXTRACT_PAGES_PER_TASK", "4")))
+# 'spawn' avoids forking a process that already runs server and job threads.
+EXTRACT_MP_START = os.environ.get("EXTRACT_MP_START", "spawn")
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()
+
+
+def _page_text_and_spans(words: List[Dict[str, Any]], y_tolerance: float = 3.0) -> Tuple[str, Dict[int, Tuple[int, int]]]:
+    """Rebuild page text from extract_words() output the same way page.extract_text() does by default:
+    consecutive words whose 'top' falls in the same cluster (within y_tolerance) form a line, words
+    are joined with spaces and lines with newlines. Word order is kept as extract_words returns it.
+
+    Also returns {word index: (char_start, char_end)} locating each word in the text.
+    """
+    indexed = [(i, w) for i, w in enumerate(words) if w.get("text")]
+    if not indexed:
+        return "", {}
+    lines = cluster_objects(indexed, lambda iw: iw[1]["top"], y_tolerance, preserve_order=True)
+    parts: List[str] = []
+    spans: Dict[int, Tuple[int, int]] = {}
+    pos = 0
+    for ln, line in enumerate(lines):
+        if ln:
+            parts.append("\n")
+            pos += 1
+        for wn, (i, w) in enumerate(line):
+            if wn:
+                parts.append(" ")
+                pos += 1
+            parts.append(w["text"])
+            spans[i] = (pos, pos + len(w["text"]))
+            pos += len(w["text"])
+    return "".join(parts), spans
+
+
+def _ingest_page_range(file_path: str, start: int, stop: Optional[int], max_anchor_pages: int = MAX_ANCHOR_PAGES) -> List[Tuple[str, Any, Any, Tuple[float, float]]]:
+    """Extract pages [start, stop) of a PDF and return (page_text, anchor boxes, anchor spans, (width, height))
+    per page, the anchor columns as built by anchors.group_words.
+    Runs in pool workers, so it only takes and returns picklable values.
+    """
+    out: List[Tuple[str, Any, Any, Tuple[float, float]]] = []
+    with pdfplumber.open(file_path) as pdf:
+        for i, page in enumerate(pdf.pages[start:stop], start=start):
+            try:
+                words = page.extract_words()
+            except Exception:
+                words = []
+            text, spans = _page_text_and_spans(words)
+            page_width = float(getattr(page, 'width', 1.0)) or 1.0
+            page_height = float(getattr(page, 'height', 1.0)) or 1.0
+            # create multiple anchors by grouping consecutive words to improve precision
+            boxes, anchor_spans = anchors.group_words(words if i < max_anchor_pages else [], spans, ANCHOR_GROUP_SIZE)
+            out.append((text, boxes, anchor_spans, (page_width, page_height)))
+    return out
+
+
+def _assemble(page_results: List[Tuple[str, Any, Any, Tuple[float, float]]]) -> Dict[str, Any]:
+    pages = [text for text, _, _, _ in page_results]
+    # page text lengths let citations map text offsets to anchors without the words (AnchorTable.covering)
+    table = anchors.AnchorTable.from_pages([(boxes, spans, dims) for _, boxes, spans, dims in page_results],
+                                           text_lengths=[len(text) for text in pages])
+    return {"pages": pages, "anchors": table}
+
+
+def ingest_pdf(file_path: str, max_anchor_pages: int = MAX_ANCHOR_PAGES) -> Dict[str, Any]:
+    """Run a single layout pass over a PDF and return the per-document artifact:
+    { 'pages': [page_text, ...], 'anchors': anchors.AnchorTable } where each anchor groups
+    ANCHOR_GROUP_SIZE words of the first max_anchor_pages pages, with its box and its span in the page text.
+
+    Each page's word list is computed once and used for both the page text and the anchors.
+    Raises if the file can't be opened; a page that fails to parse yields empty text and no anchors.
+    """
+    return _assemble(_ingest_page_range(file_path, 0, None, max_anchor_pages))
+
+
+def _page_count(file_path: str) -> int:
+    # only parses the page tree, no layout analysis
+    with pdfplumber.open(file_path) as pdf:
+        return len(pdf.pages)
+
+
+def page_count(file_path: str) -> int:
+    """Number of pages of a PDF without layout analysis: from its cached anchors when it was ingested
+    before, otherwise from the page tree. Raises if the file can't be opened."""
+    table = load_anchor_table(file_path)
+    if table is not None:
+        return table.page_count
+    return _page_count(file_path)
+
+
+def ingest_page_ranges(file_path: str, ranges: List[Tuple[int, int]]) -> List[Any]:
+    """_ingest_page_range for several (start, stop) ranges of one PDF, submitted to the process pool
+    together (in-process with EXTRACT_WORKERS=1) so the calling thread doesn't hold the GIL while
+    pages are parsed. Returns each range's page results in order, or the Exception it raised."""
+    results: Dict[int, Any] = {}
+    if EXTRACT_WORKERS > 1:
+        try:
+            pool = _get_pool(EXTRACT_WORKERS)
+            futures = [pool.submit(_ingest_page_range, file_path, start, stop) for start, stop in ranges]
+            for i, fut in enumerate(futures):
+                try:
+                    results[i] = fut.result()
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    results[i] = e
+        except BrokenProcessPool as e:
+            # keep the ranges that finished and read the rest in-process
+            print("extraction pool broken, falling back to serial:", e)
+            _reset_pool()
+    for i, (start, stop) in enumerate(ranges):
+        if i not in results:
+            try:
+                results[i] = _ingest_page_range(file_path, start, stop)
+            except Exception as e:
+                results[i] = e
+    return [results[i] for i in range(len(ranges))]
+
+
+def _get_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(EXTRACT_MP_START))
+            _pool_workers = workers
+        return _pool
+
+
+def _reset_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = None
+
+
+def ingest_many(file_paths: List[str], workers: Optional[int] = None, on_done: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+    """Ingest several PDFs, spreading page ranges of all files over the process pool.
+
+    Returns {file_path: artifact} with pages in their original order; a file that can't be
+    opened maps to the Exception instead, so callers can keep producing per-file error entries.
+    on_done(path, artifact_or_exception) is called as each file finishes.
+    """
+    workers = workers or EXTRACT_WORKERS
+    results: Dict[str, Any] = _NotifyingDict(on_done) if on_done else {}
+    page_counts: Dict[str, int] = {}
+    for path in file_paths:
+        if path in page_counts or path in results:
+            continue
+        try:
+            page_counts[path] = _page_count(path)
+        except Exception as e:
+            results[path] = e
+    total_pages = sum(page_counts.values())
+    if workers <= 1 or total_pages <= EXTRACT_PAGES_PER_TASK:
+        for path in page_counts:
+            try:
+                results[path] = ingest_pdf(path)
+            except Exception as e:
+                results[path] = e
+        return dict(results)
+
+    try:
+        pool = _get_pool(workers)
+        futures = {}
+        for path, n in page_counts.items():
+            futures[path] = [pool.submit(_ingest_page_range, path, s, min(s + EXTRACT_PAGES_PER_TASK, n))
+                             for s in range(0, n, EXTRACT_PAGES_PER_TASK)]
+        for path, path_futures in futures.items():
+            try:
+                page_results: List[Tuple[str, List[Dict[str, Any]]]] = []
+                for fut in path_futures:
+                    page_results.extend(fut.result())
+                results[path] = _assemble(page_results)
+            except BrokenProcessPool:
+                raise
+            except Exception as e:
+                results[path] = e
+    except BrokenProcessPool as e:
+        # a worker died (e.g. killed for memory); drop the pool and finish the remaining files in-process
+        print("extraction pool broken, falling back to serial:", e)
+        _reset_pool()
+        for path in page_counts:
+            if path in results:
+                continue
+            try:
+                results[path] = ingest_pdf(path)
+            except Exception as ex:
+                results[path] = ex
+    return dict(results)
+
+
+class _NotifyingDict(dict):
+    """Result dict that reports each file once, the first time its result is stored."""
+
+    def __init__(self, callback: Callable[[str, Any], None]):
+        super().__init__()
+        self.callback = callback
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        first = key not in self
+        super().__setitem__(key, value)
+        if first:
+            self.callback(key, value)
+
+
+def load_artifact(file_path: str) -> Optional[Dict[str, Any]]:
+    """Return the cached artifact for a PDF without ingesting it, or None."""
+    try:
+        return extract_cache.get(extract_cache.file_sha256(file_path))
+    except OSError:
+        return None
+
+
+def load_anchor_table(file_path: str) -> Optional["anchors.AnchorTable"]:
+    """Return the cached anchors of a PDF without reading its page text, or None."""
+    try:
+        return extract_cache.get_anchors(extract_cache.file_sha256(file_path))
+    except OSError:
+        return None
+
+
+def load_or_ingest(file_path: str) -> Dict[str, Any]:
+    """Return the artifact for a PDF, ingesting and caching it on first use (keyed by content hash)."""
+    sha = extract_cache.file_sha256(file_path)
+    artifact = extract_cache.get(sha)
+    if artifact is not None:
+        return artifact
+    artifact = ingest_many([file_path])[file_path]
+    if isinstance(artifact, Exception):
+        raise artifact
+    extract_cache.put(sha, artifact)
+    return artifact
+
+
+def load_or_ingest_many(file_paths: List[str], workers: Optional[int] = None, on_done: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+    """Like load_or_ingest for several files: cached artifacts are returned as-is and all misses
+    are ingested together on the process pool. Failed files map to the Exception.
+    on_done(path, artifact_or_exception) is called as each file becomes available, cached ones first.
+    """
+    results: Dict[str, Any] = _NotifyingDict(on_done) if on_done else {}
+    missing: Dict[str, str] = {}
+    for path in file_paths:
+        try:
+            sha = extract_cache.file_sha256(path)
+        except Exception as e:
+            results[path] = e
+            continue
+        artifact = extract_cache.get(sha)
+        if artifact is not None:
+            results[path] = artifact
+        else:
+            missing[path] = sha
+    if missing:
+        def _store(path: str, artifact: Any) -> None:
+            if not isinstance(artifact, Exception):
+                extract_cache.put(missing[path], artifact)
+            results[path] = artifact
+        ingest_many(list(missing), workers, on_done=_store)
+    return dict(results)
+
+
+class LazyPages(Sequence):
+    """Page texts of a PDF, extracted when they are first read.
+
+    len() is known up front (page_count, no layout analysis). The first page read loads the cached
+    artifact if there is one; otherwise only the EXTRACT_PAGES_PER_TASK pages around the requested
+    page are extracted and kept. Once every page has been read this way, the assembled artifact is
+    cached like a full ingestion. load() extracts every page not read yet at once, spreading the
+    blocks over the process pool, for consumers that need the whole document.
+
+    A block that can't be extracted reads as "[Error extracting text: ...]" on its first page (empty
+    pages after it), like a file that fails eager extraction. on_extract(extracted, total) is called
+    whenever pages have actually been extracted or loaded, from the thread that read them.
+    """
+
+    def __init__(self, file_path: str, on_extract: Optional[Callable[[int, int], None]] = None):
+        self.file_path = file_path
+        self.on_extract = on_extract
+        self._pages: List[Optional[str]] = [None] * page_count(file_path)
+        self._results: Dict[int, Tuple[str, Any, Any, Tuple[float, float]]] = {}
+        self._cache_checked = False
+        self._failed = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        page = self._pages[index]
+        if page is None:
+            with self._lock:
+                extracted = self._pages[index] is None
+                if extracted:
+                    self._extract(index)
+                page = self._pages[index]
+            if extracted:
+                self._report()
+        return page
+
+    def _report(self) -> None:
+        if self.on_extract is not None:
+            try:
+                self.on_extract(self.extracted, len(self))
+            except Exception as e:
+                print("progress callback failed:", e)
+
+    @property
+    def extracted(self) -> int:
+        """Pages whose text has been read so far."""
+        return sum(1 for p in self._pages if p is not None)
+
+    def _load_cached(self) -> bool:
+        # only the first extraction looks for a cached artifact; afterwards pages are read here
+        if self._cache_checked:
+            return False
+        self._cache_checked = True
+        artifact = load_artifact(self.file_path)
+        if artifact is not None and len(artifact.get("pages", [])) == len(self._pages):
+            self._pages = [str(p or "") for p in artifact["pages"]]
+            return True
+        return False
+
+    def _block(self, index: int) -> Tuple[int, int]:
+        start = index - index % EXTRACT_PAGES_PER_TASK
+        return start, min(start + EXTRACT_PAGES_PER_TASK, len(self._pages))
+
+    def _store(self, start: int, stop: int, results: Any) -> None:
+        if isinstance(results, Exception):
+            print("page extraction failed:", self.file_path, results)
+            empty = anchors.group_words([], None, ANCHOR_GROUP_SIZE) + ((0.0, 0.0),)
+            results = [(f"[Error extracting text: {results}]",) + empty] + [("",) + empty] * (stop - start - 1)
+            self._failed = True
+        for i, result in enumerate(results, start=start):
+            self._pages[i] = result[0]
+            self._results[i] = result
+
+    def _cache_if_complete(self) -> None:
+        if not self._failed and self._results and len(self._results) == len(self._pages):
+            # every page was read here: keep the work, the next request gets a full cache hit
+            artifact = _assemble([self._results[i] for i in range(len(self._pages))])
+            self._results = {}
+            try:
+                extract_cache.put(extract_cache.file_sha256(self.file_path), artifact)
+            except OSError as e:
+                print("extract cache write failed:", e)
+
+    def _extract(self, index: int) -> None:
+        if self._load_cached():
+            return
+        start, stop = self._block(index)
+        self._store(start, stop, ingest_page_ranges(self.file_path, [(start, stop)])[0])
+        self._cache_if_complete()
+
+    def anchor_table(self) -> Optional["anchors.AnchorTable"]:
+        """Anchors of the leading pages extracted here so far, with the ids they have in the full
+        document; None when nothing was extracted (the cached artifact has the full table)."""
+        with self._lock:
+            prefix = []
+            while len(prefix) in self._results:
+                prefix.append(self._results[len(prefix)])
+        if not prefix:
+            return None
+        return anchors.AnchorTable.from_pages([(boxes, spans, dims) for _, boxes, spans, dims in prefix],
+                                              text_lengths=[len(text) for text, _, _, _ in prefix])
+
+    def load(self) -> "LazyPages":
+        """Make every page available: the cached artifact, or else the blocks of pages not read yet,
+        extracted together on the process pool (pages already read are kept)."""
+        with self._lock:
+            loaded = self._load_cached()
+            blocks = sorted({self._block(i) for i, p in enumerate(self._pages) if p is None})
+            if blocks:
+                for (start, stop), results in zip(blocks, ingest_page_ranges(self.file_path, blocks)):
+                    self._store(start, stop, results)
+                self._cache_if_complete()
+        if loaded or blocks:
+            self._report()
+        return self
+
+
+class Paper(dict):
+    """A paper in the {title, pages} shape the chat and analysis code expects, with pages a
+    LazyPages, so only the pages a consumer reads are ever extracted."""
+
+    def __init__(self, title: str, file_path: str, on_extract: Optional[Callable[[int, int], None]] = None):
+        super().__init__(title=title, pages=LazyPages(file_path, on_extract))
+
+    @property
+    def page_count(self) -> int:
+        return len(self["pages"])
@@ -0,0 +1,198 @@
+import os
+import uuid
+import hashlib
+from typing import Dict, Any, List, Optional, Tuple
+
+try:
+    from python_multipart.multipart import MultipartParser, parse_options_header
+    from python_multipart.exceptions import MultipartParseError
+except ModuleNotFoundError:  # older python-multipart releases
+    from multipart.multipart import MultipartParser, parse_options_header
+    from multipart.exceptions import MultipartParseError
+
+from starlette.requests import Request
+
+import extract_cache
+from executors import run_io
+
+# Uploads larger than this are rejected while they are still being received.
+MAX_UPLOAD_BYTES = int(os.environ.get("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+# Room for the multipart boundaries and part headers around the file itself.
+_MULTIPART_OVERHEAD = 64 * 1024
+
+# receive_pdf reads the request body itself, so routes using it declare the body for the OpenAPI
+# schema with openapi_extra={"requestBody": OPENAPI_REQUEST_BODY}.
+OPENAPI_REQUEST_BODY: Dict[str, Any] = {
+    "required": True,
+    "content": {
+        "multipart/form-data": {
+            "schema": {
+                "type": "object",
+                "required": ["file"],
+                "properties": {"file": {"type": "string", "format": "binary"}},
+            }
+        }
+    },
+}
+
+
+class UploadRejected(ValueError):
+    """The upload is not an acceptable PDF (wrong type, too large or missing); the message is client-safe."""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class _FilePart:
+    """Multipart callbacks that pick out the `file` field and buffer its bytes between reads."""
+
+    def __init__(self, field: str):
+        self.field = field
+        self.found = False
+        # set once the closing boundary has been parsed, i.e. the body wasn't cut short
+        self.complete = False
+        self.filename = ""
+        self.content_type = ""
+        self.pending: List[bytes] = []
+        self._in_target = False
+        self._header_field = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+
+    def callbacks(self) -> Dict[str, Any]:
+        return {
+            "on_part_begin": self._part_begin,
+            "on_header_field": lambda data, start, end: self._add(data, start, end, "_header_field"),
+            "on_header_value": lambda data, start, end: self._add(data, start, end, "_header_value"),
+            "on_header_end": self._header_end,
+            "on_headers_finished": self._headers_finished,
+            "on_part_data": self._part_data,
+            "on_part_end": self._part_end,
+            "on_end": self._end,
+        }
+
+    def _add(self, data: bytes, start: int, end: int, attr: str) -> None:
+        setattr(self, attr, getattr(self, attr) + data[start:end])
+
+    def _part_begin(self) -> None:
+        self._headers = {}
+
+    def _header_end(self) -> None:
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+
+    def _headers_finished(self) -> None:
+        _, options = parse_options_header(self._headers.get(b"content-disposition"))
+        name = options.get(b"name", b"").decode("latin-1")
+        # only the first part with the expected field name is kept; other fields are skipped
+        self._in_target = name == self.field and not self.found
+        if self._in_target:
+            self.found = True
+            self.filename = options.get(b"filename", b"").decode("utf-8", "replace")
+            self.content_type = self._headers.get(b"content-type", b"").decode("latin-1")
+
+    def _part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._in_target:
+            self.pending.append(data[start:end])
+
+    def _part_end(self) -> None:
+        self._in_target = False
+
+    def _end(self) -> None:
+        self.complete = True
+
+
+def _check_type(filename: str, content_type: str) -> None:
+    ext = os.path.splitext(filename)[1]
+    if ext.lower() != ".pdf" or (content_type and "pdf" not in content_type.lower()):
+        raise UploadRejected("PDF files only, max 50MB each")
+
+
+def _write_chunks(f, sha, chunks: List[bytes]) -> None:
+    for chunk in chunks:
+        sha.update(chunk)
+        f.write(chunk)
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def _commit(tmp_path: str, upload_dir: str, digest: str) -> Tuple[str, bool]:
+    dest_path = os.path.join(upload_dir, f"{digest}.pdf")
+    duplicate = os.path.exists(dest_path)
+    if duplicate:
+        _remove(tmp_path)
+    else:
+        os.replace(tmp_path, dest_path)
+    # the hash is already known, so the extraction cache doesn't need to read the file again
+    extract_cache.remember_sha256(dest_path, digest)
+    return dest_path, duplicate
+
+
+async def receive_pdf(request: Request, upload_dir: str, field: str = "file") -> Dict[str, Any]:
+    """Stream the `field` part of a multipart upload into upload_dir, hashing it while it is written.
+
+    The file is stored content-addressed as <sha256>.pdf, so the same PDF uploaded twice maps to the
+    same file id (and its cached artifact, anchors and index). The upload is rejected as soon as it
+    exceeds MAX_UPLOAD_BYTES (or declares a larger Content-Length), without reading the rest, and
+    a malformed or truncated multipart body (no closing boundary) is rejected with a 400.
+    Returns { file_path, file_id, sha256, size, filename, duplicate }; raises UploadRejected.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type"))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise UploadRejected("Expected a multipart/form-data upload", status_code=422)
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > MAX_UPLOAD_BYTES + _MULTIPART_OVERHEAD:
+        raise UploadRejected("PDF files only, max 50MB each", status_code=413)
+
+    part = _FilePart(field)
+    parser = MultipartParser(boundary, part.callbacks())
+    tmp_path = os.path.join(upload_dir, f".upload-{uuid.uuid4().hex}.part")
+    sha = hashlib.sha256()
+    size = 0
+    checked = False
+    f: Optional[Any] = None
+    try:
+        f = open(tmp_path, "wb")
+        async for chunk in request.stream():
+            try:
+                parser.write(chunk)
+            except MultipartParseError as e:
+                raise UploadRejected(f"Malformed multipart upload: {e}")
+            if part.found and not checked:
+                _check_type(part.filename, part.content_type)
+                checked = True
+            if part.pending:
+                chunks, part.pending = part.pending, []
+                size += sum(len(c) for c in chunks)
+                if size > MAX_UPLOAD_BYTES:
+                    raise UploadRejected("PDF files only, max 50MB each", status_code=413)
+                await run_io(_write_chunks, f, sha, chunks)
+        parser.finalize()
+        if not part.complete:
+            raise UploadRejected("Malformed multipart upload: missing final boundary")
+        if not part.found:
+            raise UploadRejected(f"Missing '{field}' file field", status_code=422)
+        f.close()
+        f = None
+        dest_path, duplicate = await run_io(_commit, tmp_path, upload_dir, sha.hexdigest())
+    except BaseException:
+        if f is not None:
+            f.close()
+        _remove(tmp_path)
+        raise
+    return {
+        "file_path": dest_path,
+        "file_id": os.path.basename(dest_path),
+        "sha256": sha.hexdigest(),
+        "size": size,
+        "filename": part.filename,
+        "duplicate": duplicate,
+    }
@@ -31,7 +31,8 @@ export function FileUploadZone({ projectId, onFileUploaded }: FileUploadZoneProp
   const [analyzing, setAnalyzing] = useState(false);
   const [jobId, setJobId] = useState<string | null>(null);
   const [jobStatus, setJobStatus] = useState<string | null>(null);
-  const pollingRef = useRef<NodeJS.Timeout | null>(null);
+  const [jobProgress, setJobProgress] = useState<string>("");
+  const eventsRef = useRef<EventSource | null>(null);
 
   const onDrop = useCallback(
     async (acceptedFiles: File[]) => {
@@ -90,27 +91,41 @@ export function FileUploadZone({ projectId, onFileUploaded }: FileUploadZoneProp
     [projectId, onFileUploaded],
   );
 
-  // Poll job status
+  // Follow job progress over Server-Sent Events instead of polling /job-status
   useEffect(() => {
     if (!jobId) return;
     setJobStatus("pending");
-    pollingRef.current = setInterval(async () => {
-      const res = await fetch(`${process.env.NEXT_PUBLIC_BACKEND_URL}/job-status/${jobId}`);
-      const data = await res.json();
+    setJobProgress("");
+    const partials: string[] = [];
+    const source = new EventSource(`${process.env.NEXT_PUBLIC_BACKEND_URL}/job-events/${jobId}`);
+    eventsRef.current = source;
+    source.addEventListener("status", (e) => {
+      const data = JSON.parse((e as MessageEvent).data);
       setJobStatus(data.status);
-      if (data.status === "completed") {
-        // store the whole result object so we can render structured summaries
-        setAnalysisResult(data.result || data.result?.answer || data.result?.text || null);
-        setAnalyzing(false);
-        clearInterval(pollingRef.current!);
-      } else if (data.status === "failed") {
+      if (data.status === "failed" || data.status === "not_found") {
         setError(data.error || "Analysis failed");
         setAnalyzing(false);
-        clearInterval(pollingRef.current!);
+        source.close();
       }
-    }, 2000);
+    });
+    source.addEventListener("progress", (e) => {
+      const data = JSON.parse((e as MessageEvent).data);
+      setJobProgress(data.total ? `${data.stage} ${data.current}/${data.total}` : data.stage);
+    });
+    source.addEventListener("partial", (e) => {
+      // show each paper's summary as soon as it is ready
+      const data = JSON.parse((e as MessageEvent).data);
+      partials.push(data.text);
+      setAnalysisResult({ text: partials.join("\n\n-----\n\n") });
+    });
+    source.addEventListener("result", (e) => {
+      // store the whole result object so we can render structured summaries
+      setAnalysisResult(JSON.parse((e as MessageEvent).data));
+      setAnalyzing(false);
+      source.close();
+    });
     return () => {
-      if (pollingRef.current) clearInterval(pollingRef.current);
+      source.close();
     };
   }, [jobId]);
 
@@ -203,7 +218,7 @@ export function FileUploadZone({ projectId, onFileUploaded }: FileUploadZoneProp
         <div className="mt-4 text-center text-muted-foreground">
           <span className="animate-spin inline-block mr-2">🔄</span>
           {jobStatus === "pending" || jobStatus === "running"
-            ? "Analyzing PDF with AI... (this may take a minute)"
+            ? `Analyzing PDF with AI... ${jobProgress ? `(${jobProgress})` : "(this may take a minute)"}`
             : "Preparing analysis..."}
         </div>
       )}